@@ -0,0 +1,78 @@
+"""
+Benchmark of ConversionManager's throughput for different numbers of workers.
+Generates a set of synthetic wav files and converts them with 1, 2, 4... workers, printing a
+JSON line per run. EXT may list several formats separated by commas (e.g. mp3,ogg), which
+are converted in a single pass; with --separate, each format is converted in a pass of its
+own instead, as a baseline. Requires ffmpeg. Run from the project's folder:
+    python benchmarks/bench_conversion.py [--files N] [--seconds S] [--extension EXT]
+                                          [--separate]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import argparse
+import tempfile
+from pydub.generators import Sine
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.conversion import ConversionManager, parse_extensions
+
+
+def generate_sources(directory: pathlib.Path, files: int, seconds: float) -> list[pathlib.Path]:
+    """Writes `files` wav files of a sine of `seconds` duration into directory"""
+    tone = Sine(440).to_audio_segment(duration=seconds * 1000)
+    paths = []
+    for i in range(files):
+        path = pathlib.Path(directory, f"source_{i}.wav")
+        tone.export(path, format="wav")
+        paths.append(path)
+    return paths
+
+
+def worker_counts() -> list[int]:
+    """Powers of two up to the number of CPUs, plus the number of CPUs itself"""
+    cpus = os.cpu_count() or 1
+    counts = [2 ** i for i in range(cpus.bit_length()) if 2 ** i < cpus]
+    return counts + [cpus]
+
+
+def run(files: int, seconds: float, extension: str, separate: bool = False) -> None:
+    """Converts the same set of sources with every worker count, printing the throughput"""
+    passes = parse_extensions(extension) if separate else [extension]
+    with tempfile.TemporaryDirectory() as directory:
+        sources = generate_sources(pathlib.Path(directory), files, seconds)
+        for workers in worker_counts():
+            errors = 0
+            start = time.perf_counter()
+            for pass_extension in passes:
+                manager = ConversionManager(sources, workers=workers)
+                manager.convert_all(pass_extension)
+                errors += len(manager.errors)
+            elapsed = time.perf_counter() - start
+            print(json.dumps({"benchmark": "conversion",
+                              "workers": workers,
+                              "files": files,
+                              "seconds_per_file": seconds,
+                              "formats": extension,
+                              "passes": len(passes),
+                              "errors": errors,
+                              "elapsed": round(elapsed, 3),
+                              "files_per_second": round(files / elapsed, 3)}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=32, help="Number of files to convert")
+    parser.add_argument('--seconds', type=float, default=30,
+                        help="Duration of each generated file")
+    parser.add_argument('--extension', type=str, default="mp3",
+                        help="Output format, or several separated by commas")
+    parser.add_argument('--separate', action="store_true",
+                        help="Convert to each format in a pass of its own")
+    parsed_args = parser.parse_args()
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required to run the conversion benchmark.")
+    run(parsed_args.files, parsed_args.seconds, parsed_args.extension, parsed_args.separate)
@@ -0,0 +1,129 @@
+"""
+Distributed mode benchmark against the local fake services of benchmarks/fake_services.py: a
+coordinator puts a synthetic playlist in a queue file shared by --workers worker processes,
+each one standing for a host (with its own cache and, through WORKER_ARGS like --max-rate, its
+own bandwidth cap). With --crash, the first worker is killed once it has leased songs, so the
+rest take them over when their leases (--lease) expire.
+Prints a JSON line per number of workers with the elapsed time, the throughput, the songs
+completed and failed and the items taken over, along with the current commit.
+Run from the project's folder:
+    python benchmarks/bench_distributed.py [--songs 100] [--workers 1,2,4] [--lease S]
+        [--crash] [--latency MS] [--bandwidth KIB] [--song-size KIB] [-- WORKER_ARGS]
+"""
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+import fake_services  # pylint: disable=wrong-import-position
+from bench_end_to_end import get_commit, parse_list  # pylint: disable=wrong-import-position
+
+
+def run_program(arguments: list[str], address: str, cache: pathlib.Path, results=None) -> None:
+    """Runs the program's main with arguments against the fake services"""
+    sys.stdout = sys.stderr = open(os.devnull, "w", encoding="utf-8")  # Progress bars
+    os.environ["XDG_CACHE_HOME"] = str(cache)
+    fake_services.install_routes(address)
+    # pylint: disable=import-outside-toplevel
+    import playlist_downloader
+    failed = playlist_downloader.main(playlist_downloader.get_parser().parse_args(arguments))
+    if results is not None:
+        results.put(len(failed))
+
+
+def measure(songs: int, workers: int, lease: float, crash: bool, address: str,
+            worker_args: list[str]) -> dict:
+    """Downloads the fake playlist with workers processes, returning the report"""
+    # pylint: disable=import-outside-toplevel
+    from src.distributed import SQLiteWorkQueue
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        queue_path = pathlib.Path(directory, "queue.sqlite3")
+        worker_processes = [context.Process(
+            target=run_program,
+            args=(["--queue", str(queue_path), "--worker", "--lease", str(lease), *worker_args],
+                  address, pathlib.Path(directory, f"cache_{number}")))
+            for number in range(workers)]
+        results = context.Queue()
+        start = time.time()
+        coordinator = context.Process(target=run_program, args=(
+            [fake_services.playlist_url(songs), "-p", str(pathlib.Path(directory, "Songs")),
+             "--queue", str(queue_path), "--sync"],
+            address, pathlib.Path(directory, "cache_coordinator"), results))
+        coordinator.start()
+        for process in worker_processes:
+            process.start()
+        if crash:
+            queue = SQLiteWorkQueue(queue_path)
+            while not any(item["status"] == "leased" for run in get_runs(queue_path)
+                          for item in queue.get_items(run)):
+                time.sleep(0.01)
+            queue.close()
+            worker_processes[0].kill()
+        failed = results.get()
+        elapsed = time.time() - start
+        coordinator.join()
+        for process in worker_processes:
+            process.terminate()
+            process.join()
+        queue = SQLiteWorkQueue(queue_path)
+        items = [item for run in get_runs(queue_path) for item in queue.get_items(run)]
+        queue.close()
+    completed = sum(item["status"] == "done" for item in items)
+    return {"benchmark": "distributed", "commit": get_commit(), "songs": songs,
+            "workers": workers, "crash": crash, "lease": lease, "elapsed": round(elapsed, 3),
+            "songs_per_second": round(completed / elapsed, 3), "completed": completed,
+            "failed": failed, "taken_over": sum(item["leases"] > 1 for item in items),
+            "worker_args": worker_args}
+
+
+def get_runs(queue_path: pathlib.Path) -> list[str]:
+    """Returns the runs put in the queue at queue_path"""
+    # pylint: disable=import-outside-toplevel
+    import sqlite3
+    with sqlite3.connect(queue_path) as connection:
+        try:
+            return [row[0] for row in connection.execute("SELECT DISTINCT run FROM items")]
+        except sqlite3.OperationalError:  # Not created yet
+            return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, default=100, help="Size of the playlist")
+    parser.add_argument('--workers', type=parse_list(int), default=[1, 2, 4],
+                        help="Comma separated numbers of worker processes")
+    parser.add_argument('--lease', type=float, default=2.0, help="Seconds of each lease")
+    parser.add_argument('--crash', action="store_true",
+                        help="Kill the first worker once it has leased songs")
+    parser.add_argument('--latency', type=float, default=20, help="Milliseconds per request")
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help="KiB/s of each media connection; 0 for no limit")
+    parser.add_argument('--song-size', type=int, default=256, help="KiB of each audio stream")
+    parser.add_argument('worker_args', nargs=argparse.REMAINDER,
+                        help="Arguments passed to every worker, after --")
+    parsed_args = parser.parse_args()
+    extra_args = parsed_args.worker_args[1:] if parsed_args.worker_args[:1] == ["--"] \
+        else parsed_args.worker_args
+    address_queue = multiprocessing.get_context("spawn").Queue()
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_services.serve_forever, args=(address_queue,), daemon=True,
+        kwargs={"latency": parsed_args.latency / 1000,
+                "bandwidth": parsed_args.bandwidth * 1024 or None,
+                "song_size": parsed_args.song_size * 1024})
+    server.start()
+    server_address = address_queue.get()
+    try:
+        for worker_count in parsed_args.workers:
+            print(json.dumps(measure(parsed_args.songs, worker_count, parsed_args.lease,
+                                     parsed_args.crash, server_address, extra_args)),
+                  flush=True)
+    finally:
+        server.terminate()
+        server.join()
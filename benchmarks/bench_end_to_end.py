@@ -0,0 +1,227 @@
+"""
+End-to-end benchmark against the local fake services of benchmarks/fake_services.py, which play
+Spotify and youtube with configurable latency, bandwidth, error rate and capacity (concurrent
+media responses before throttling with 429s). Each scenario runs over
+synthetic playlists of every size in --songs:
+    main: the whole program, through playlist_downloader.main
+    download_manager: DownloadManager over the playlist's searchstrings
+    conversion: ConversionManager over generated wav files (requires ffmpeg)
+Prints a JSON line per scenario and size with the throughput, the p50/p99 latency per song, the
+peak RSS and the peak number of threads, along with the current commit, so runs of different
+commits can be compared. The fake services run in their own process and every scenario in a
+fresh one, so they don't count towards the measures.
+Run from the project's folder:
+    python benchmarks/bench_end_to_end.py [--songs 10,100,1000] [--scenarios main,...]
+        [--latency MS] [--bandwidth KIB] [--error-rate R] [--capacity N] [--song-size KIB]
+        [-- MAIN_ARGS]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from typing import Callable, Optional
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+import fake_services  # pylint: disable=wrong-import-position
+
+SAMPLE_INTERVAL = 0.005
+
+
+class ThreadSampler:
+    """Samples the number of threads of the process, keeping the maximum seen"""
+
+    def __init__(self) -> None:
+        self.peak_threads = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> int:
+        """Stops sampling and returns the peak, not counting the sampler itself"""
+        self._stop.set()
+        self._thread.join()
+        return self.peak_threads - 1
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def run_main(songs: int, directory: pathlib.Path, main_args: list[str], address: str) -> dict:
+    """Downloads a fake playlist through the program's main"""
+    # pylint: disable=import-outside-toplevel
+    import playlist_downloader
+    args = playlist_downloader.get_parser().parse_args(
+        [fake_services.playlist_url(songs), "-p", str(directory / "Songs"), *main_args])
+    start = time.time()
+    playlist_downloader.main(args)
+    return dict(get_server_measures(address), elapsed=time.time() - start)
+
+
+def run_download_manager(songs: int, directory: pathlib.Path, main_args: list[str],
+                         address: str) -> dict:
+    """Downloads the fake playlist's searchstrings through a DownloadManager"""
+    # pylint: disable=import-outside-toplevel
+    from src.downloads import DownloadManager
+    del main_args
+    start = time.time()
+    manager = DownloadManager(fake_services.get_searchstrings(songs), directory / "Songs")
+    manager.start_all()
+    manager.wait_until_finished()
+    return dict(get_server_measures(address), elapsed=time.time() - start)
+
+
+def get_server_measures(address: str) -> dict:
+    """Latency of each song, from its search to its last byte served, and the errors served"""
+    stats = fake_services.get_stats(address)
+    latencies = [stats["completed"][video_id] - searched
+                 for video_id, searched in stats["searched"].items()
+                 if video_id in stats["completed"]]
+    return {"latencies": latencies, "server_errors": stats["errors"]}
+
+
+def run_conversion(songs: int, directory: pathlib.Path, main_args: list[str],
+                   address: str) -> dict:
+    """Converts `songs` generated wav files to mp3 through a ConversionManager"""
+    # pylint: disable=import-outside-toplevel
+    from pydub.generators import Sine
+    from src.conversion import ConversionManager
+    del main_args, address
+    tone = Sine(440).to_audio_segment(duration=5000)
+    sources = []
+    for i in range(songs):
+        sources.append(pathlib.Path(directory, f"source_{i}.wav"))
+        tone.export(sources[-1], format="wav")
+    start = time.time()
+    manager = ConversionManager(sources)
+    manager.convert_all("mp3")
+    elapsed = time.time() - start
+    outputs = [source.with_suffix(".mp3") for source in sources]
+    return {"elapsed": elapsed,
+            "latencies": [path.stat().st_mtime - start for path in outputs if path.exists()],
+            "conversion_errors": len(manager.errors)}
+
+
+SCENARIOS = {"main": run_main, "download_manager": run_download_manager,
+             "conversion": run_conversion}
+
+
+def run_scenario(name: str, songs: int, main_args: list[str], address: str,
+                 results: multiprocessing.Queue) -> None:
+    """
+    Runs a scenario in this (fresh) process and puts its measures in results, or the error
+    that stopped it.
+    """
+    sys.stderr = open(os.devnull, "w", encoding="utf-8")  # Progress bars
+    fake_services.install_routes(address)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["XDG_CACHE_HOME"] = str(pathlib.Path(directory, "cache"))
+        sampler = ThreadSampler()
+        try:
+            measures = SCENARIOS[name](songs, pathlib.Path(directory), main_args, address)
+        except Exception as error:  # pylint: disable=broad-except
+            results.put({"error": repr(error)})
+            return
+        measures["peak_threads"] = sampler.stop()
+    measures["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    measures["peak_child_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    results.put(measures)
+
+
+def percentile(values: list[float], fraction: float) -> Optional[float]:
+    """Returns the value below which `fraction` of values are (nearest rank), None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def get_commit() -> Optional[str]:
+    """Returns the commit being benchmarked, None if it can't be known"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(name: str, songs: int, settings: dict, main_args: list[str],
+            song_size: int) -> dict:
+    """Runs a scenario against fresh fake services, returning its report"""
+    context = multiprocessing.get_context("spawn")
+    address_queue = context.Queue()
+    server = context.Process(target=fake_services.serve_forever, args=(address_queue,),
+                             kwargs=dict(settings, song_size=song_size), daemon=True)
+    server.start()
+    address = address_queue.get()
+    results = context.Queue()
+    client = context.Process(target=run_scenario, args=(name, songs, main_args, address, results))
+    client.start()
+    try:
+        measures = results.get()
+    finally:
+        client.join()
+        server.terminate()
+        server.join()
+    if "error" in measures:
+        return {"benchmark": "end_to_end", "scenario": name, "commit": get_commit(),
+                "songs": songs, "error": measures["error"]}
+    latencies = measures.pop("latencies")
+    elapsed = measures.pop("elapsed")
+    report = {"benchmark": "end_to_end", "scenario": name, "commit": get_commit(),
+              "songs": songs, "completed": len(latencies), "elapsed": round(elapsed, 3),
+              "songs_per_second": round(len(latencies) / elapsed, 3),
+              "p50_latency": round(percentile(latencies, 0.5) or 0, 4),
+              "p99_latency": round(percentile(latencies, 0.99) or 0, 4)}
+    if name != "conversion":
+        report["mb_per_second"] = round(len(latencies) * song_size / 1e6 / elapsed, 3)
+    report.update({key: round(value, 2) if isinstance(value, float) else value
+                   for key, value in measures.items()})
+    return dict(report, **settings, song_size=song_size)
+
+
+def parse_list(cast: Callable[[str], object]) -> Callable[[str], list]:
+    """Returns a parser of comma separated lists of values"""
+    return lambda text: [cast(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=parse_list(int), default=[10, 100, 1000],
+                        help="Comma separated sizes of the playlists, up to 5000")
+    parser.add_argument('--scenarios', type=parse_list(str), default=list(SCENARIOS),
+                        help=f"Comma separated scenarios, out of {', '.join(SCENARIOS)}")
+    parser.add_argument('--latency', type=float, default=20, help="Milliseconds per request")
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help="KiB/s of each media connection; 0 for no limit")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of media requests failing with a 503")
+    parser.add_argument('--capacity', type=int, default=0,
+                        help="Concurrent media responses before throttling; 0 for no limit")
+    parser.add_argument('--song-size', type=int, default=256, help="KiB of each audio stream")
+    parser.add_argument('main_args', nargs=argparse.REMAINDER,
+                        help="Arguments passed to the program in the main scenario, after --")
+    parsed_args = parser.parse_args()
+    extra_args = parsed_args.main_args[1:] if parsed_args.main_args[:1] == ["--"] \
+        else parsed_args.main_args
+    service_settings = {"latency": parsed_args.latency / 1000,
+                        "bandwidth": parsed_args.bandwidth * 1024 or None,
+                        "error_rate": parsed_args.error_rate,
+                        "capacity": parsed_args.capacity or None}
+    for scenario in parsed_args.scenarios:
+        if scenario == "conversion" and not shutil.which("ffmpeg"):
+            print(json.dumps({"benchmark": "end_to_end", "scenario": scenario,
+                              "skipped": "ffmpeg not found"}))
+            continue
+        for song_count in parsed_args.songs:
+            print(json.dumps(measure(scenario, song_count, service_settings, extra_args,
+                                     parsed_args.song_size * 1024)), flush=True)
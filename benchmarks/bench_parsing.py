@@ -0,0 +1,95 @@
+"""
+Benchmark of the parse throughput of playlist pages: the structured PlaylistPageParser against
+the previous BeautifulSoup get_text plus regex path. A large page is synthesized from the
+fixture at testing/fixtures/playlist_resource.html. Prints a JSON line per parser. Each parser
+runs in its own process, which is stopped after --timeout seconds: the greedy trimming regex of
+the previous path backtracks for minutes even on small pages.
+Run from the project's folder:
+    python benchmarks/bench_parsing.py [--tracks N] [--repeat N] [--timeout S]
+"""
+import sys
+import json
+import time
+import pathlib
+import argparse
+import multiprocessing
+from bs4 import BeautifulSoup
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.parsing import parse_playlist_page
+from src.scrap import process_raw_text
+
+FIXTURE = pathlib.Path("testing/fixtures/playlist_resource.html")
+
+
+def synthesize_page(tracks: int) -> str:
+    """Repeats the fixture's tracks (both data and markup) until the page has `tracks` of them"""
+    html = FIXTURE.read_text(encoding="utf-8")
+    data_start = html.index('<script id="resource"')
+    data_start = html.index(">", data_start) + 1
+    data_end = html.index("</script>", data_start)
+    document = json.loads(html[data_start:data_end])
+    items = document["tracks"]["items"]
+    document["tracks"]["items"] = [items[i % len(items)] for i in range(tracks)]
+    document["tracks"]["total"] = tracks
+
+    grid_start = html.index('<div role="grid">') + len('<div role="grid">')
+    grid_end = html.index("</div>\n<p>", grid_start)
+    rows = html[grid_start:grid_end]
+    rows = rows * (tracks // len(items) + 1)
+    return (html[:data_start] + json.dumps(document) + html[data_end:grid_start] + rows
+            + html[grid_end:])
+
+
+def old_path(html: str) -> list[dict]:
+    """Previous parsing: the whole DOM is built to extract its text, then split by regex"""
+    return process_raw_text(BeautifulSoup(html, "html.parser").get_text())
+
+
+PARSERS = {"structured": parse_playlist_page, "get_text_regex": old_path}
+
+
+def time_parser(name: str, html: str, repeat: int) -> None:
+    """Times the parser over html, printing its throughput"""
+    error = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            tracks = len(PARSERS[name](html))
+        except ValueError as err:
+            tracks, error = 0, str(err)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(json.dumps({"benchmark": "parsing",
+                      "parser": name,
+                      "page_mb": round(len(html.encode()) / 1e6, 3),
+                      "tracks": tracks,
+                      "error": error,
+                      "seconds": round(elapsed, 4),
+                      "mb_per_second": round(len(html.encode()) / 1e6 / elapsed, 2)}))
+
+
+def measure(name: str, html: str, repeat: int, timeout: float) -> None:
+    """Runs time_parser in a child process, reporting a timeout if it takes too long"""
+    process = multiprocessing.Process(target=time_parser, args=(name, html, repeat))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        print(json.dumps({"benchmark": "parsing",
+                          "parser": name,
+                          "page_mb": round(len(html.encode()) / 1e6, 3),
+                          "timed_out": True,
+                          "seconds": timeout}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=5000, help="Tracks in the page")
+    parser.add_argument('--repeat', type=int, default=5, help="Parses per measure")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="Seconds after which a parser is stopped")
+    parsed_args = parser.parse_args()
+    page = synthesize_page(parsed_args.tracks)
+    for parser_name in PARSERS:
+        measure(parser_name, page, parsed_args.repeat, parsed_args.timeout)
@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the cost of DownloadProgressBar.callback per chunk, called from several
+threads at the same time, as the download workers do. Prints a JSON line per thread count.
+Run from the project's folder:
+    python benchmarks/bench_progressbar.py [--streams N] [--chunks N]
+"""
+import io
+import sys
+import json
+import time
+import pathlib
+import argparse
+import threading
+from contextlib import redirect_stderr
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.progressbar import DownloadProgressBar
+
+
+class FakeStream:
+    """Minimal stand-in of a pytube Stream: only its filesize is needed"""
+
+    def __init__(self, filesize: int) -> None:
+        self.filesize = filesize
+
+
+def run(streams: int, chunks: int, threads: int) -> dict:
+    """Feeds every chunk of `streams` streams through the callback from `threads` threads"""
+    chunk_size = 1024
+    stream_list = [FakeStream(chunks * chunk_size) for _ in range(streams)]
+    with redirect_stderr(io.StringIO()):
+        progress_bar = DownloadProgressBar(stream_list)
+
+        def download(assigned_streams: list[FakeStream]) -> None:
+            for stream in assigned_streams:
+                for chunk in range(chunks):
+                    remaining_bytes = stream.filesize - (chunk + 1) * chunk_size
+                    progress_bar.callback(stream, b"", remaining_bytes)
+
+        workers = [threading.Thread(target=download, args=(stream_list[i::threads],))
+                   for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        progress_bar.close()
+    calls = streams * chunks
+    return {"benchmark": "progressbar_callback",
+            "threads": threads,
+            "calls": calls,
+            "finished": progress_bar.is_finished(),
+            "ns_per_call": round(elapsed / calls * 1e9, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=64, help="Number of streams")
+    parser.add_argument('--chunks', type=int, default=2000, help="Chunks per stream")
+    parsed_args = parser.parse_args()
+    for thread_count in (1, 4, 16, 64):
+        print(json.dumps(run(parsed_args.streams, parsed_args.chunks, thread_count)))
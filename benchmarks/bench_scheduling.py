@@ -0,0 +1,83 @@
+"""
+Benchmark of the makespan (total run time) of DownloadManager under each download schedule,
+over synthetic stream size distributions served by the fake services of
+benchmarks/fake_services.py with a limited bandwidth per connection. Each run is done with a
+cold search cache, where sizes become known as songs are resolved, and with a warm one, where
+they're known almost at once. Prints a JSON line per distribution, cache and schedule, along
+with the makespan's lower bound: the biggest stream alone, or every byte split evenly across
+the workers.
+Run from the project's folder:
+    python benchmarks/bench_scheduling.py [--songs N] [--jobs N] [--bandwidth KIB]
+        [--song-size KIB] [--distributions fixed,uniform,lognormal,rare-huge]
+"""
+import sys
+import json
+import time
+import pathlib
+import argparse
+import tempfile
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+# pylint: disable=wrong-import-position
+import fake_services
+from src.cache import SearchCache
+from src.downloads import DownloadManager
+from src.engine import SCHEDULES
+from src.search import YTVideo
+
+
+def warm_up(cache: SearchCache, searchstrings: list[str]) -> None:
+    """Searches every song and resolves its stream, so they're in the cache"""
+    for searchstring in searchstrings:
+        YTVideo(searchstring, cache=cache).get_stream()
+
+
+def run(songs: int, jobs: int, bandwidth: int, song_size: int, distribution: str) -> None:
+    """Downloads the same playlist with every schedule and cache state, printing the makespan"""
+    services = fake_services.FakeServices(latency=0.02, bandwidth=bandwidth, song_size=song_size,
+                                          sizes=distribution)
+    fake_services.install_routes(services.address)
+    searchstrings = fake_services.get_searchstrings(songs)
+    sizes = [fake_services.get_song_size(fake_services.get_video_id(searchstring), song_size,
+                                         distribution) for searchstring in searchstrings]
+    lower_bound = max(max(sizes), sum(sizes) / jobs) / bandwidth
+    for warm in (False, True):
+        for schedule in SCHEDULES:
+            with tempfile.TemporaryDirectory() as directory:
+                cache = SearchCache(pathlib.Path(directory, "cache.sqlite3"))
+                if warm:
+                    warm_up(cache, searchstrings)
+                start = time.perf_counter()
+                manager = DownloadManager(searchstrings, pathlib.Path(directory, "Songs"),
+                                          jobs=jobs, cache=cache, schedule=schedule)
+                manager.start_all()
+                manager.wait_until_finished()
+                makespan = time.perf_counter() - start
+                cache.close()
+            print(json.dumps({"benchmark": "scheduling",
+                              "distribution": distribution,
+                              "cache": "warm" if warm else "cold",
+                              "schedule": schedule,
+                              "songs": songs,
+                              "jobs": jobs,
+                              "makespan": round(makespan, 3),
+                              "lower_bound": round(lower_bound, 3),
+                              "ratio_to_bound": round(makespan / lower_bound, 3)}), flush=True)
+    services.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, default=200, help="Songs in the playlist")
+    parser.add_argument('--jobs', type=int, default=4, help="Concurrent downloads")
+    parser.add_argument('--bandwidth', type=int, default=4096, help="KiB/s of each connection")
+    parser.add_argument('--song-size', type=int, default=256, help="Mean KiB of each stream")
+    parser.add_argument('--distributions', type=lambda text: text.split(","),
+                        default=list(fake_services.SIZE_DISTRIBUTIONS),
+                        help="Comma separated size distributions")
+    parsed_args = parser.parse_args()
+    sys.stderr = open("/dev/null", "w", encoding="utf-8")  # Progress bars
+    for size_distribution in parsed_args.distributions:
+        run(parsed_args.songs, parsed_args.jobs, parsed_args.bandwidth * 1024,
+            parsed_args.song_size * 1024, size_distribution)
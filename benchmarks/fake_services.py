@@ -0,0 +1,401 @@
+"""
+Local stand-ins of the services playlist_downloader talks to, for benchmarks that can't rely on
+the internet. A single HTTP server plays Spotify (playlist page and its json pages), youtube's
+search and player endpoints (stream metadata) and youtube's media servers (bytes with range
+support). Every request waits `latency` seconds, media is served at `bandwidth` bytes per
+second per connection and a fraction `error_rate` of media requests fails with a 503. Beyond
+`capacity` concurrent media responses, requests are throttled with a 429 and a Retry-After.
+Stream sizes follow one of SIZE_DISTRIBUTIONS around `song_size`.
+
+The server logs when each video is searched and when its last byte is served, along with the
+player requests, exposed as json at /_stats, so per-song latencies can be measured whatever
+drives the downloads.
+
+pytube's own youtube client can't be pointed to another host: besides the innertube api, it needs
+youtube's watch page and the player script to decipher signatures. install_routes replaces it
+with a minimal client of the fake endpoints (LocalSearch and LocalYouTube), which still builds
+pytube's Stream objects, and routes the playlist connections of src.pages to the server.
+FakeServicesTestCase does it around each test of the program's own test suite.
+"""
+import json
+import time
+import random
+import hashlib
+import pathlib
+import tempfile
+import threading
+import unittest
+import http.client
+from typing import Callable, Optional
+from urllib import request
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pytube import Stream, StreamQuery, YouTube
+from pytube import extract
+
+PAGE_LIMIT = 100
+TOKEN = "benchmark-token"
+MEDIA_CHUNK_SIZE = 16 * 1024
+# Seconds a throttled client is asked to wait
+RETRY_AFTER = 1
+SIZE_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "rare-huge")
+AUDIO_FORMATS = [{"itag": 140, "mimeType": 'audio/mp4; codecs="mp4a.40.2"', "bitrate": 130000},
+                 {"itag": 251, "mimeType": 'audio/webm; codecs="opus"', "bitrate": 140000}]
+
+
+class FakeServicesHandler(BaseHTTPRequestHandler):
+    """Handler of every fake endpoint; its settings are class attributes, see FakeServices"""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    bandwidth = None
+    error_rate = 0.0
+    capacity = None
+    song_size = 256 * 1024
+    sizes = "fixed"
+    stats_lock = threading.Lock()
+    searched = {}
+    completed = {}
+    errors = 0
+    serving = 0
+    players = 0
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Routes the request to its endpoint after the configured latency"""
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "playlist":
+            self.send_json(None, self.playlist_page(parts[1]), "text/html")
+        elif parts[:2] == ["v1", "playlists"]:
+            self.playlist_tracks(parts[2], int(query["offset"]), int(query["limit"]))
+        elif parts == ["youtubei", "v1", "search"]:
+            self.search(query["query"])
+        elif parts == ["youtubei", "v1", "player"]:
+            self.player(query["videoId"])
+        elif parts[0] == "media":
+            self.media(parts[1])
+        elif parts == ["_stats"]:
+            with self.stats_lock:
+                self.send_json({"searched": self.searched, "completed": self.completed,
+                                "errors": type(self).errors, "players": type(self).players})
+        else:
+            self.send_error(404)
+
+    def playlist_page(self, playlist_id: str) -> str:
+        """Html page embedding the first tracks of the playlist, its pagination and a token"""
+        total = playlist_size(playlist_id)
+        resource = {"type": "playlist", "name": playlist_id,
+                    "tracks": {"items": [{"track": get_track(i)}
+                                         for i in range(min(PAGE_LIMIT, total))],
+                               "total": total, "offset": 0, "limit": PAGE_LIMIT,
+                               "next": f"https://api.spotify.com/v1/playlists/{playlist_id}/"
+                                       f"tracks?offset={PAGE_LIMIT}&limit={PAGE_LIMIT}"}}
+        return ("<html><head>"
+                f'<script id="session" type="application/json">'
+                f'{json.dumps({"accessToken": TOKEN})}</script>'
+                f'<script id="resource" type="application/json">{json.dumps(resource)}</script>'
+                f"</head><body><h1>{playlist_id}</h1></body></html>")
+
+    def playlist_tracks(self, playlist_id: str, offset: int, limit: int) -> None:
+        """Json page of the playlist's tracks, like Spotify's web api"""
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            self.send_error(401)
+            return
+        total = playlist_size(playlist_id)
+        self.send_json({"items": [{"track": get_track(i)}
+                                  for i in range(offset, min(offset + limit, total))],
+                        "total": total, "offset": offset, "limit": limit})
+
+    def search(self, searchstring: str) -> None:
+        """First result of searching searchstring: a video made up from it"""
+        video_id = get_video_id(searchstring)
+        with self.stats_lock:
+            self.searched.setdefault(video_id, time.time())
+        self.send_json({"videoId": video_id, "title": searchstring.split(",")[0]})
+
+    def player(self, video_id: str) -> None:
+        """Metadata of the video and its audio streams, with urls to the fake media server"""
+        with self.stats_lock:
+            type(self).players += 1
+        host = self.headers["Host"]
+        size = get_song_size(video_id, self.song_size, self.sizes)
+        formats = [dict(audio_format, contentLength=str(size),
+                        url=f"http://{host}/media/{video_id}?itag={audio_format['itag']}&sig=0")
+                   for audio_format in AUDIO_FORMATS]
+        self.send_json({"playabilityStatus": {"status": "OK"},
+                        "videoDetails": {"videoId": video_id, "title": video_id,
+                                         "lengthSeconds": "180"},
+                        "streamingData": {"adaptiveFormats": formats}})
+
+    def media(self, video_id: str) -> None:
+        """
+        Serves a stream, failing a fraction error_rate of requests and throttling the rest past
+        capacity
+        """
+        if self.error_rate and random.random() < self.error_rate:
+            with self.stats_lock:
+                type(self).errors += 1
+            self.send_error(503)
+            return
+        if self.capacity:
+            with self.stats_lock:
+                throttled = type(self).serving >= self.capacity
+                type(self).errors += throttled
+                type(self).serving += not throttled
+            if throttled:
+                self.send_response(429)
+                self.send_header("Retry-After", str(RETRY_AFTER))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        try:
+            self.send_media(video_id)
+        finally:
+            if self.capacity:
+                with self.stats_lock:
+                    type(self).serving -= 1
+
+    def send_media(self, video_id: str) -> None:
+        """Sends the requested range of the stream of video_id, at the configured bandwidth"""
+        size = get_song_size(video_id, self.song_size, self.sizes)
+        start, end = 0, size - 1
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            first, last = byte_range.split("=")[1].split("-")
+            start, end = int(first), min(int(last or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        position = start
+        while position <= end:
+            chunk_size = min(MEDIA_CHUNK_SIZE, end + 1 - position)
+            self.wfile.write(bytes(chunk_size))
+            position += chunk_size
+            if self.bandwidth:
+                time.sleep(chunk_size / self.bandwidth)
+        if end == size - 1:
+            with self.stats_lock:
+                self.completed[video_id] = time.time()
+
+    def send_json(self, content, body: Optional[str] = None,
+                  content_type: str = "application/json") -> None:
+        """Sends content as json (or body as is), with a length so connections are kept alive"""
+        encoded_body = (body if body is not None else json.dumps(content)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        """Silences the server logs"""
+
+
+class FakeServices:
+    """Runs the fake services in a thread of the current process"""
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None,
+                 error_rate: float = 0.0, song_size: int = 256 * 1024,
+                 sizes: str = "fixed", capacity: Optional[int] = None) -> None:
+        """
+        Starts the server on a free local port
+            Parameters:
+                latency (float): seconds every request waits before being answered
+                bandwidth (float): bytes per second of each media connection; None for no limit
+                error_rate (float): fraction of media requests failing with a 503
+                song_size (int): size in bytes of every audio stream, or their mean size
+                sizes (str): distribution of the sizes of the streams, one of SIZE_DISTRIBUTIONS
+                capacity (int): concurrent media responses served before throttling requests
+                    with a 429; None for no limit
+        """
+        handler = type("ConfiguredHandler", (FakeServicesHandler,),
+                       {"latency": latency, "bandwidth": bandwidth, "error_rate": error_rate,
+                        "song_size": song_size, "sizes": sizes, "capacity": capacity,
+                        "stats_lock": threading.Lock(), "searched": {}, "completed": {},
+                        "errors": 0, "serving": 0, "players": 0})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.address = f"127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        """Stops the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve_forever(address_queue, **settings) -> None:
+    """Runs the fake services until the process is terminated, sending their address first"""
+    services = FakeServices(**settings)
+    address_queue.put(services.address)
+    threading.Event().wait()
+
+
+def get_stats(address: str) -> dict:
+    """Returns the search and completion times logged by the server at address"""
+    with request.urlopen(f"http://{address}/_stats") as response:
+        return json.loads(response.read())
+
+
+def playlist_size(playlist_id: str) -> int:
+    """Number of tracks of a fake playlist, named bench<N>"""
+    return int(playlist_id.removeprefix("bench"))
+
+
+def playlist_url(songs: int) -> str:
+    """Url of a fake playlist with `songs` tracks, as seen by the program"""
+    return f"https://open.spotify.com/playlist/bench{songs}"
+
+
+def get_track(index: int) -> dict:
+    """Spotify's web api track at index of every fake playlist"""
+    return {"type": "track", "name": f"Song {index}",
+            "artists": [{"type": "artist", "name": f"Artist {index}"}]}
+
+
+def get_searchstrings(songs: int) -> list[str]:
+    """Searchstrings of the first `songs` tracks of the fake playlists"""
+    return [f"Song {i}, Artist {i}" for i in range(songs)]
+
+
+def get_song_size(video_id: str, mean_size: int, distribution: str) -> int:
+    """
+    Size of the stream of a fake video, drawn from distribution (seeded with the video id):
+        fixed: every stream is mean_size bytes
+        uniform: between 0.5 and 1.5 times mean_size
+        lognormal: heavy tailed, a few streams several times bigger than the rest
+        rare-huge: one in 50 streams (by video id) is 50 times mean_size, the rest mean_size
+    """
+    if distribution == "uniform":
+        return int(mean_size * random.Random(video_id).uniform(0.5, 1.5))
+    if distribution == "lognormal":
+        return max(1, int(mean_size * random.Random(video_id).lognormvariate(-0.5, 1)))
+    if distribution == "rare-huge" and int(video_id, 16) % 50 == 0:
+        return mean_size * 50
+    return mean_size
+
+
+def get_video_id(searchstring: str) -> str:
+    """Id of the fake video found for searchstring, 11 characters like youtube's"""
+    return hashlib.sha1(searchstring.encode("utf-8")).hexdigest()[:11]
+
+
+class LocalYouTube(YouTube):
+    """pytube's YouTube, getting its metadata and streams from the fake player endpoint"""
+    address = None
+
+    @property
+    def vid_info(self):
+        """Player response of the video, fetched from the fake services"""
+        if not self._vid_info:
+            query = urlencode({"videoId": self.video_id})
+            with request.urlopen(f"http://{self.address}/youtubei/v1/player?{query}") as response:
+                self._vid_info = json.loads(response.read())
+        return self._vid_info
+
+    def check_availability(self) -> None:
+        """Raises if the fake player didn't mark the video as playable"""
+        if self.vid_info["playabilityStatus"]["status"] != "OK":
+            raise ValueError(f"Video {self.video_id} isn't available.")
+
+    @property
+    def fmt_streams(self):
+        """pytube's streams of the video; their urls are already signed"""
+        if not self._fmt_streams:
+            stream_manifest = extract.apply_descrambler(self.streaming_data)
+            self._fmt_streams = [Stream(stream=stream, monostate=self.stream_monostate)
+                                 for stream in stream_manifest]
+        return self._fmt_streams
+
+    @property
+    def streams(self) -> StreamQuery:
+        """Interface to query the streams of the video"""
+        self.check_availability()
+        return StreamQuery(self.fmt_streams)
+
+
+class LocalSearch:
+    """Search of the fake services, with the interface used from pytube's Search"""
+
+    def __init__(self, query: str) -> None:
+        with request.urlopen(f"http://{LocalYouTube.address}/youtubei/v1/search"
+                             f"?query={quote(query)}") as response:
+            result = json.loads(response.read())
+        video = LocalYouTube(f"https://youtube.com/watch?v={result['videoId']}")
+        video.title = result["title"]
+        self.results = [video]
+
+
+def install_routes(address: str) -> Callable[[], None]:
+    """
+    Makes the program talk to the fake services at address: playlist pages are requested to
+    it whatever their host, and youtube is queried through LocalSearch and LocalYouTube.
+    Returns a function undoing it, so tests can route the program only while they run.
+    """
+    # pylint: disable=import-outside-toplevel
+    from src import engine, pages, scrap, search
+    original_pool = pages.ConnectionPool
+
+    class RoutedConnectionPool(original_pool):
+        """ConnectionPool sending every request to the fake services"""
+
+        def _get_connection(self, scheme: str, host: str,
+                            renew: bool = False) -> http.client.HTTPConnection:
+            return super()._get_connection("http", address, renew)
+
+    routes = [(pages, "ConnectionPool", RoutedConnectionPool),
+              (scrap, "ConnectionPool", RoutedConnectionPool),
+              (engine, "ConnectionPool", RoutedConnectionPool),
+              (search, "Search", LocalSearch), (search, "YouTube", LocalYouTube)]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in routes]
+    for module, name, value in routes:
+        setattr(module, name, value)
+    LocalYouTube.address = address
+
+    def uninstall_routes() -> None:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+    return uninstall_routes
+
+
+class FakeServicesTestCase(unittest.TestCase):
+    """
+    Base of the tests running the program against the fake services: each test gets its own
+    server, started with the settings of SERVICES (see FakeServices), the program routed to
+    it and a temporary folder at self.path.
+    """
+    SERVICES = {"song_size": 16 * 1024}
+
+    def setUp(self) -> None:
+        self.services = FakeServices(**self.SERVICES)
+        self.uninstall_routes = install_routes(self.services.address)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.uninstall_routes()
+        self.services.close()
+        self.directory.cleanup()
+
+    def get_player_requests(self) -> int:
+        """Returns the number of player requests (stream resolutions) served so far"""
+        return get_stats(self.services.address)["players"]
+
+    def get_completed(self, expected: int = 0) -> list[str]:
+        """
+        Returns the ids of the videos whose stream was served, by completion time. Waits up to
+        a second for `expected` of them, since the server logs each one after its last byte.
+        """
+        deadline = time.time() + 1
+        completed = get_stats(self.services.address)["completed"]
+        while len(completed) < expected and time.time() < deadline:
+            time.sleep(0.01)
+            completed = get_stats(self.services.address)["completed"]
+        return sorted(completed, key=completed.get)
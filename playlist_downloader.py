@@ -1,66 +1,278 @@
 #!/usr/bin/python
 """Searches and downloads a playlist"""
+import sys
+import asyncio
 import argparse
 from pathlib import Path
 from typing import Callable
-from src.scrap import Scrapper
-from src.downloads import DownloadManager
-from src.conversion import ConversionManager
+from src.cache import SearchCache
+from src.conversion import parse_extensions
+from src.daemon import Daemon, get_status, submit_job
+from src.distributed import DEFAULT_LEASE, SQLiteWorkQueue, Worker, coordinate
+from src.engine import DEFAULT_SCHEDULE, SCHEDULES, download_playlist
+from src.metrics import Metrics
+from src.ratelimit import RateLimiter
+from src.retry import DEFAULT_ATTEMPTS
+from src.store import DEFAULT_MAX_SIZE, AudioStore
+from src.transfer import DEFAULT_SEGMENTS, DEFAULT_SEGMENT_THRESHOLD
+from src.workers import DEFAULT_JOBS, DEFAULT_SEARCH_JOBS
 
 
-def main(args: argparse.Namespace) -> None:
+def main(args: argparse.Namespace) -> dict[str, Exception]:
     """
-    Downloads the songs inside a playlist.
+    Downloads the songs inside one or several playlists, running the async engine until it's
+    done. See engine.download_playlist. Returns the songs that failed, along with their errors.
+    With daemon, runs a daemon instead; with submit, the playlists are downloaded by the daemon
+    running, and with status, its jobs are printed (see daemon.Daemon). With queue, the songs
+    are put in that shared queue and downloaded by its workers, or, with worker, this process
+    is one of them (see distributed).
     Parameters inside args:
-        url (str): url link to a Spotify's playlist. Can be obtained inside spotify's desktop
-            app by right-clicking --> Share --> Copy Spotify URL.
+        urls (list[str]): url links to Spotify's playlists. Can be obtained inside spotify's
+            desktop app by right-clicking --> Share --> Copy Spotify URL.
+        url_file (Path): file with more playlist urls, one per line.
         artist (str): if different than None, only the songs with an artist containing
             selected_artist will be downloaded (case insensitive)
         path (Path): Folder to download the songs into. If it doesn't exist it will be created.
-        extension (str): Desired format of the output audios (mp3, f.x.).
+            With several playlists, each one is saved in a subfolder named after its id.
+        extension (str): Desired format of the output audios (mp3, f.x.), or several separated
+            by commas (mp3,ogg f.x.).
         keep_originals (bool): If True, original files will be kept after a change of format
         appended_songs (list[str]): list with searchings to be appended to the playlist songs.
+        jobs (int): maximum number of songs being downloaded at the same time.
+        search_jobs (int): maximum number of youtube queries running at the same time.
+        no_cache (bool): If True, the persistent cache of searches and streams isn't used.
+        refresh_cache (bool): If True, every search is done again and rewritten in the cache.
+        sync (bool): If True, only the songs missing from the manifest at path are downloaded,
+            and the manifest is updated afterwards.
+        prune (bool): If True (along with sync), songs no longer in the playlist are deleted.
+        segments (int): number of parallel connections used for each big stream.
+        segment_threshold (int): size in MiB above which streams are downloaded in segments.
+        convert_jobs (int): number of processes converting files at the same time. If None,
+            the number of CPUs.
+        store (bool): If True, downloaded and converted audios are kept in a local store shared
+            across runs, and taken from there when requested again.
+        store_size (int): size in MiB above which the least recently used stored audios are
+            removed.
+        metrics (Path): if provided, the time spent in each stage of each song, the bytes
+            transferred and the retries are written there (Prometheus' text format if it ends
+            in .prom or .txt, JSON otherwise), even if the run fails.
+        schedule (str): order of the downloads: "playlist" or "largest-first".
+        max_rate (int): if provided, KiB per second all the downloads together are limited to.
+        retries (int): attempts of each request (search, stream query or download without
+            progress) before its song is given up.
+        daemon (bool): If True, runs a daemon downloading the jobs submitted to it until it's
+            interrupted. The options of the playlists are given by each job; the rest apply to
+            all of them.
+        submit (bool): If True, the playlists are submitted as a job to the daemon running, and
+            the job is waited for.
+        no_wait (bool): If True (along with submit), returns once the job is queued.
+        status (int): if provided, the status of the job with that id, or of the last ones if
+            0, is printed.
+        daemon_dir (Path): folder of the daemon's queue, socket and spool folder. If None, a
+            folder in the user's cache directory.
+        queue (Path): if provided, SQLite file of a work queue shared by several hosts (f.x.
+            on a network filesystem). The songs are put there and downloaded by its workers,
+            into path, which every worker must reach at the same location.
+        worker (bool): If True (along with queue), downloads the songs of the queue until it's
+            interrupted.
+        drain (bool): If True (along with worker), stops once the queue has no songs left.
+        lease (float): seconds a worker holds each song for before another one can take it
+            over, unless it renews it.
     """
     path = args.path if args.path else Path("Songs/")
-    playlist_titles = []
-    if args.url:
-        playlist_titles += Scrapper(args.url, args.artist).get_searchstring()
-    if args.appended_songs:
-        playlist_titles += args.appended_songs
+    urls = list(args.urls)
+    if args.url_file:
+        urls += read_url_file(args.url_file)
+    try:
+        if args.submit:
+            return submit(args, urls, path)
+        if args.status is not None:
+            for status in get_status(args.status if args.status else None, args.daemon_dir):
+                print_job(status)
+            return {}
+    except OSError as error:
+        sys.exit(f"No daemon is running ({error}); start one with --daemon.")
+    cache = None if args.no_cache else SearchCache(refresh=args.refresh_cache)
+    store = AudioStore(max_size=args.store_size * 1024 * 1024) if args.store else None
+    metrics = Metrics()
+    limiter = RateLimiter(args.max_rate * 1024) if args.max_rate else None
+    if args.daemon:
+        daemon = Daemon(args.daemon_dir, jobs=args.jobs, search_jobs=args.search_jobs,
+                        convert_jobs=args.convert_jobs, cache=cache, segments=args.segments,
+                        segment_threshold=args.segment_threshold * 1024 * 1024, store=store,
+                        metrics=metrics, metrics_path=args.metrics, schedule=args.schedule,
+                        limiter=limiter, retries=args.retries)
+        print(f"Daemon listening at {daemon.socket_path}, spool folder {daemon.spool_path}")
+        try:
+            asyncio.run(daemon.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.close()
+        return {}
+    if args.queue:
+        return run_distributed(args, urls, path, cache, store, metrics, limiter)
+    try:
+        return asyncio.run(download_playlist(
+            urls, path, appended_songs=args.appended_songs, artist=args.artist,
+            extension=args.extension, keep_originals=args.keep_originals, jobs=args.jobs,
+            search_jobs=args.search_jobs, convert_jobs=args.convert_jobs, cache=cache,
+            sync=args.sync, prune=args.prune, segments=args.segments,
+            segment_threshold=args.segment_threshold * 1024 * 1024, store=store, metrics=metrics,
+            schedule=args.schedule, limiter=limiter, retries=args.retries))
+    finally:
+        if args.metrics:
+            metrics.save(args.metrics)
 
-    down_manager = DownloadManager(playlist_titles, path)
-    down_manager.start_all()
-    down_manager.wait_until_finished()
-    audio_paths = down_manager.get_file_paths()
 
-    if args.extension:
-        conv_manager = ConversionManager(audio_paths)
-        conv_manager.convert_all(args.extension)
-        if not args.keep_originals:
-            conv_manager.delete_originals()
+def run_distributed(args: argparse.Namespace, urls: list[str], path: Path, cache, store,
+                    metrics: Metrics, limiter) -> dict[str, Exception]:
+    """
+    Runs a worker of the queue in args, or puts the songs of args in it and waits for the
+    workers to download them. Returns the songs that failed, along with their errors.
+    """
+    queue = SQLiteWorkQueue(args.queue)
+    try:
+        if args.worker:
+            worker = Worker(queue, jobs=args.jobs, search_jobs=args.search_jobs,
+                            convert_jobs=args.convert_jobs, cache=cache, segments=args.segments,
+                            segment_threshold=args.segment_threshold * 1024 * 1024,
+                            store=store, metrics=metrics, schedule=args.schedule,
+                            limiter=limiter, retries=args.retries, lease=args.lease)
+            print(f"Worker {worker.name} leasing songs from {args.queue}")
+            try:
+                asyncio.run(worker.run(until_drained=args.drain))
+            except KeyboardInterrupt:
+                pass
+            return {}
+        return asyncio.run(coordinate(
+            urls, path, queue, appended_songs=args.appended_songs, artist=args.artist,
+            extension=args.extension, keep_originals=args.keep_originals, cache=cache,
+            sync=args.sync, prune=args.prune, metrics=metrics))
+    finally:
+        queue.close()
+        if args.metrics:
+            metrics.save(args.metrics)
+
+
+def submit(args: argparse.Namespace, urls: list[str], path: Path) -> dict[str, Exception]:
+    """
+    Submits the playlists of args as a job to the daemon running and prints its status. Returns
+    the songs that failed, or the error that stopped the job, if it was waited for.
+    """
+    job = {"urls": urls, "path": str(path.absolute()), "appended_songs": args.appended_songs,
+           "artist": args.artist, "extension": args.extension,
+           "keep_originals": args.keep_originals, "sync": args.sync, "prune": args.prune}
+    status = submit_job(job, args.daemon_dir, wait=not args.no_wait)
+    print_job(status)
+    failed = {song: RuntimeError(error) for song, error in status["failed"].items()}
+    if status["error"]:
+        failed[f"Job {status['id']}"] = RuntimeError(status["error"])
+    return failed
+
+
+def print_job(status: dict) -> None:
+    """Prints the status of a daemon's job, with the songs that failed"""
+    print(f"Job {status['id']} ({status['source']}): {status['status']}")
+    if status["error"]:
+        print(f"  {status['error']}")
+    for searchstring, error in status["failed"].items():
+        print(f"  {searchstring}: {error}")
+
+
+def read_url_file(url_file: Path) -> list[str]:
+    """Returns the urls in url_file, one per line. Blank lines and '#' comments are skipped"""
+    lines = url_file.read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
 
 
 def check_arguments_are_valid(args: argparse.Namespace, send_error: Callable[[str], None]):
     """
     Checks that the arguments in args are valid, otherwise sends an error through parser.
     Checks for:
-        - Either url or appended_songs being present
+        - Either urls, url_file or appended_songs being present, unless running a daemon or
+          asking for the status of its jobs, when none of them can be
+        - daemon, submit and status aren't passed together, and no_wait only along with submit
+        - queue isn't passed along with daemon, submit or status; worker only along with queue
+          and without songs; drain only along with worker; lease is a positive number
+        - url_file, if provided, is an existing file
+        - extension, if provided, is a valid format or a list of them separated by commas
         - keep_originals can only be present if another extension has been provided
+        - jobs and search_jobs are positive numbers
+        - no_cache and refresh_cache aren't passed together
+        - prune is only passed along with sync
+        - segments is a positive number and segment_threshold isn't negative
+        - convert_jobs, if provided, is a positive number
+        - store_size is a positive number
+        - max_rate, if provided, is a positive number
+        - retries is a positive number
     """
-    if not args.url and not args.appended_songs:
-        send_error("Either a url or a list of appended songs \
+    has_songs = args.urls or args.url_file or args.appended_songs
+    if sum([args.daemon, args.submit, args.status is not None]) > 1:
+        send_error("Only one of --daemon, --submit and --status may be passed.")
+    if args.no_wait and not args.submit:
+        send_error("Flag --no-wait may only be passed along with --submit.")
+    if args.queue and (args.daemon or args.submit or args.status is not None):
+        send_error("Option --queue can't be passed along with --daemon, --submit or --status.")
+    if args.worker and not args.queue:
+        send_error("Flag --worker may only be passed along with --queue.")
+    if args.drain and not args.worker:
+        send_error("Flag --drain may only be passed along with --worker.")
+    if args.lease <= 0:
+        send_error("The lease (--lease) must be a positive number of seconds.")
+    if args.worker:
+        if has_songs:
+            send_error("The songs to download are put in the queue by a coordinator (--queue \
+                        without --worker), not passed to --worker.")
+    elif args.daemon or args.status is not None:
+        if has_songs:
+            send_error("The songs to download are submitted to the daemon with --submit, not \
+                        passed to --daemon or --status.")
+    elif not has_songs:
+        send_error("Either a url, a file of urls (--url-file) or a list of appended songs \
                     (--append) must be provided.")
+    if args.url_file and not args.url_file.is_file():
+        send_error(f"The file of urls (--url-file) {args.url_file} doesn't exist.")
+    if args.extension:
+        try:
+            parse_extensions(args.extension)
+        except ValueError as error:
+            send_error(f"Invalid --extension: {error}")
     if not args.extension and args.keep_originals:
         send_error("Flag --keep-originals may only be passed if a \
                     change of extension (--extension) is provided.")
+    if args.jobs < 1:
+        send_error("The number of jobs (--jobs) must be at least 1.")
+    if args.search_jobs < 1:
+        send_error("The number of search jobs (--search-jobs) must be at least 1.")
+    if args.no_cache and args.refresh_cache:
+        send_error("Flags --no-cache and --refresh-cache can't be passed together.")
+    if args.prune and not args.sync:
+        send_error("Flag --prune may only be passed along with --sync.")
+    if args.segments < 1:
+        send_error("The number of segments (--segments) must be at least 1.")
+    if args.segment_threshold < 0:
+        send_error("The segment threshold (--segment-threshold) can't be negative.")
+    if args.convert_jobs is not None and args.convert_jobs < 1:
+        send_error("The number of conversion jobs (--convert-jobs) must be at least 1.")
+    if args.store_size < 1:
+        send_error("The size of the store (--store-size) must be at least 1 MiB.")
+    if args.max_rate is not None and args.max_rate < 1:
+        send_error("The maximum rate (--max-rate) must be at least 1 KiB/s.")
+    if args.retries < 1:
+        send_error("The number of attempts (--retries) must be at least 1.")
 
 
-if __name__ == "__main__":
+def get_parser() -> argparse.ArgumentParser:
+    """Returns the parser of the command line arguments"""
     parser = argparse.ArgumentParser()
-    parser.add_argument('url',
+    parser.add_argument('urls', metavar="URL",
                         type=str,
-                        nargs="?",
-                        help="Spotify's playlist")
+                        nargs="*",
+                        help="Spotify's playlists. Songs shared between them are downloaded once.")
+    parser.add_argument('--url-file',
+                        type=Path,
+                        help="File with more playlist urls, one per line.")
     parser.add_argument('-p', '--path', metavar="DESTINATION_PATH",
                         type=Path,
                         help="Path of the directory songs are downloaded into.")
@@ -70,19 +282,138 @@ if __name__ == "__main__":
                               are downloaded")
     parser.add_argument('-e', '--extension',
                         type=str,
-                        help="Desired audio extension for the downloaded files. By default, the \
-                              original format of the youtube's video audio; typically mp4.")
+                        help="Desired audio extension for the downloaded files, or several \
+                              separated by commas (e.g. mp3,ogg) to get each song in all of \
+                              them. By default, the original format of the youtube's video \
+                              audio; typically mp4.")
     parser.add_argument('--keep-originals',
                         action="store_true",
                         help="Keep original files. Only valid if --extension argument is provided.")
+    parser.add_argument('--convert-jobs',
+                        type=int,
+                        help="Number of files converted at the same time (one process each). \
+                              Defaults to the number of CPUs.")
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=DEFAULT_JOBS,
+                        help=f"Maximum number of songs downloaded at the same time. Defaults to \
+                               {DEFAULT_JOBS}.")
+    parser.add_argument('--search-jobs',
+                        type=int,
+                        default=DEFAULT_SEARCH_JOBS,
+                        help=f"Maximum number of youtube queries running at the same time. \
+                               Defaults to {DEFAULT_SEARCH_JOBS}.")
+    parser.add_argument('--no-cache',
+                        action="store_true",
+                        help="Don't use the persistent cache of youtube searches and streams.")
+    parser.add_argument('--refresh-cache',
+                        action="store_true",
+                        help="Search every song again, updating the persistent cache.")
+    parser.add_argument('--sync',
+                        action="store_true",
+                        help="Only download the songs missing from DESTINATION_PATH, according to \
+                              the manifest kept there.")
+    parser.add_argument('--prune',
+                        action="store_true",
+                        help="Delete the songs that are no longer in the playlist. Only valid \
+                              along with --sync.")
+    parser.add_argument('--schedule',
+                        choices=SCHEDULES,
+                        default=DEFAULT_SCHEDULE,
+                        help="Order of the downloads: as songs are found (playlist) or the \
+                              biggest resolved song first (largest-first), so a big song \
+                              doesn't delay the end of the run. Defaults to playlist.")
+    parser.add_argument('--segments',
+                        type=int,
+                        default=DEFAULT_SEGMENTS,
+                        help="Number of parallel connections used to download each stream bigger \
+                              than --segment-threshold. Defaults to 1 (no segmentation).")
+    parser.add_argument('--segment-threshold', metavar="MIB",
+                        type=int,
+                        default=DEFAULT_SEGMENT_THRESHOLD // (1024 * 1024),
+                        help=f"Size in MiB above which streams are downloaded in segments. \
+                               Defaults to {DEFAULT_SEGMENT_THRESHOLD // (1024 * 1024)}.")
+    parser.add_argument('--max-rate', metavar="KIB",
+                        type=int,
+                        help="Maximum KiB per second downloaded by all the songs together. Short \
+                              bursts above it are allowed after idle periods. No limit by \
+                              default.")
+    parser.add_argument('--retries', metavar="N",
+                        type=int,
+                        default=DEFAULT_ATTEMPTS,
+                        help=f"Attempts of each search, stream query and download without \
+                               progress before its song is given up, waiting longer after each \
+                               failure. Defaults to {DEFAULT_ATTEMPTS}.")
+    parser.add_argument('--store',
+                        action="store_true",
+                        help="Keep the downloaded and converted audios in a local store shared \
+                              across runs and folders, and take them from there when requested \
+                              again.")
+    parser.add_argument('--store-size', metavar="MIB",
+                        type=int,
+                        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help=f"Size in MiB above which the least recently used audios are \
+                               removed from the store. Defaults to \
+                               {DEFAULT_MAX_SIZE // (1024 * 1024)}.")
+    parser.add_argument('--metrics', metavar="PATH",
+                        type=Path,
+                        help="Write the time spent in each stage of each song, the bytes \
+                              transferred and the retries to PATH: in Prometheus' text format if \
+                              it ends in .prom or .txt, as JSON otherwise.")
+    parser.add_argument('--daemon',
+                        action="store_true",
+                        help="Run as a daemon, downloading the jobs submitted with --submit or \
+                              placed as JSON files in its spool folder one after another, with \
+                              the caches and workers kept warm between them. The options of the \
+                              playlists are given by each job; the rest apply to all of them.")
+    parser.add_argument('--submit',
+                        action="store_true",
+                        help="Submit the playlists as a job to the daemon running instead of \
+                              downloading them here, and wait for it to finish.")
+    parser.add_argument('--no-wait',
+                        action="store_true",
+                        help="Along with --submit, return once the job is queued.")
+    parser.add_argument('--status', metavar="ID",
+                        type=int,
+                        nargs="?",
+                        const=0,
+                        help="Print the status of the daemon's job ID, or of its last jobs.")
+    parser.add_argument('--daemon-dir', metavar="PATH",
+                        type=Path,
+                        help="Folder of the daemon's job queue, socket and spool folder. \
+                              Defaults to a folder in the user's cache directory.")
+    parser.add_argument('--queue', metavar="PATH",
+                        type=Path,
+                        help="SQLite file of a work queue shared by several hosts (e.g. on a \
+                              network filesystem). The songs are put there and downloaded by \
+                              the workers (--worker) into DESTINATION_PATH, which they must all \
+                              reach at the same location, waiting until they finish.")
+    parser.add_argument('--worker',
+                        action="store_true",
+                        help="Along with --queue, download the songs put in the queue until \
+                              interrupted, along with any other workers.")
+    parser.add_argument('--drain',
+                        action="store_true",
+                        help="Along with --worker, stop once the queue has no songs left.")
+    parser.add_argument('--lease', metavar="SECONDS",
+                        type=float,
+                        default=DEFAULT_LEASE,
+                        help=f"Seconds a worker holds each song for, renewing it while it's \
+                               alive; a crashed worker's songs are taken over by others once it \
+                               expires. Defaults to {DEFAULT_LEASE:g}.")
 
     parser.add_argument('--append',
                         type=str,
                         nargs="+",
                         dest="appended_songs",
                         help="List of songs to append to include in the download.")
+    return parser
+
 
+if __name__ == "__main__":
+    parser = get_parser()
     parsed_args = parser.parse_args()
     check_arguments_are_valid(parsed_args, parser.error)
 
-    main(parsed_args)
+    if main(parsed_args):
+        sys.exit(1)
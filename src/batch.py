@@ -0,0 +1,63 @@
+"""Module for batches of several playlists, where each song is downloaded only once."""
+from pathlib import Path
+from urllib.parse import urlsplit
+from .cache import normalize_searchstring
+
+
+class PlaylistBatch:
+    """
+    Songs of several playlists, each with the destination folders it has to be saved in. Songs
+    are the same if their searchstrings are equal once normalized or, given a cache, if they
+    were already resolved to the same video.
+    """
+
+    def __init__(self, cache=None) -> None:
+        """
+            Parameters:
+                cache (SearchCache): cache used to find songs resolved to the same video;
+                    None to only compare searchstrings.
+        """
+        self.cache = cache
+        self.songs = {}
+        self._video_keys = {}
+
+    def add(self, searchstrings: list[str], destination: Path) -> list[str]:
+        """
+        Adds the songs to be saved in destination. Returns the searchstrings of those that
+        weren't in the batch yet.
+        """
+        added = []
+        for searchstring in searchstrings:
+            key = self._get_key(searchstring)
+            if key not in self.songs:
+                added.append(searchstring)
+            self.songs.setdefault(key, []).append((destination, searchstring))
+        return added
+
+    def get_songs(self) -> list[str]:
+        """Returns one searchstring per distinct song, in the order they were added"""
+        return [targets[0][1] for targets in self.songs.values()]
+
+    def get_targets(self, searchstring: str) -> list[tuple[Path, str]]:
+        """
+        Returns the (destination, searchstring) pairs of the song, the first one being where
+        it's downloaded.
+        """
+        return self.songs[self._get_key(searchstring)]
+
+    def _get_key(self, searchstring: str) -> str:
+        """Returns the key of the song: its cached video id if any, its searchstring otherwise"""
+        key = normalize_searchstring(searchstring)
+        if key in self.songs or not self.cache:
+            return key
+        video = self.cache.get_video(searchstring)
+        if not video:
+            return key
+        return self._video_keys.setdefault(video["video_id"], key)
+
+
+def playlist_folder_name(url: str) -> str:
+    """Returns the name of the folder of a playlist: its id, the last segment of its url"""
+    if "://" not in url:
+        url = f"https://{url}"
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
@@ -0,0 +1,135 @@
+"""Module for the persistent cache of youtube searches and resolved streams."""
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_TTL = 30 * 24 * 60 * 60  # 30 days, in seconds
+DEFAULT_MAX_ENTRIES = 20000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    searchstring TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    itag INTEGER,
+    mime_type TEXT,
+    filesize INTEGER,
+    created REAL NOT NULL
+);
+"""
+
+
+class SearchCache:
+    """
+    SQLite cache mapping searchstrings to youtube videos, and videos to their selected audio
+    stream. Entries older than ttl are ignored and evicted; when there are more than
+    max_entries searches, the oldest ones are evicted.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, refresh: bool = False) -> None:
+        """
+        Opens (or creates) the cache database and evicts its stale entries.
+            Parameters:
+                path (Path): database file. Defaults to a file in the user's cache directory.
+                ttl (float): seconds an entry is valid for.
+                max_entries (int): maximum number of searches kept.
+                refresh (bool): if True, lookups always miss, so every entry gets rewritten.
+        """
+        self.path = path if path else default_cache_dir() / "cache.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+        self.evict()
+
+    def get_video(self, searchstring: str) -> Optional[dict]:
+        """Returns the video_id and title cached for searchstring, or None if missing"""
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT s.video_id, v.title FROM searches s JOIN videos v USING (video_id) "
+                "WHERE s.searchstring = ? AND s.created > ?",
+                (normalize_searchstring(searchstring), self._oldest_valid())).fetchone()
+        if not row:
+            return None
+        return {"video_id": row[0], "title": row[1]}
+
+    def set_video(self, searchstring: str, video_id: str, title: str) -> None:
+        """Caches video_id (with its title) as the result of searchstring"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?)",
+                (normalize_searchstring(searchstring), video_id, now))
+            self._connection.execute(
+                "INSERT INTO videos (video_id, title, created) VALUES (?, ?, ?) "
+                "ON CONFLICT (video_id) DO UPDATE SET title = excluded.title",
+                (video_id, title, now))
+
+    def get_stream(self, video_id: str) -> Optional[dict]:
+        """Returns the itag, mime_type and filesize of the stream cached for video_id"""
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT itag, mime_type, filesize FROM videos "
+                "WHERE video_id = ? AND itag IS NOT NULL AND created > ?",
+                (video_id, self._oldest_valid())).fetchone()
+        if not row:
+            return None
+        return {"itag": row[0], "mime_type": row[1], "filesize": row[2]}
+
+    def set_stream(self, video_id: str, itag: int, mime_type: str, filesize: int) -> None:
+        """Caches the stream selected for video_id. The video must have been cached already"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE videos SET itag = ?, mime_type = ?, filesize = ?, created = ? "
+                "WHERE video_id = ?",
+                (itag, mime_type, filesize, time.time(), video_id))
+
+    def evict(self) -> None:
+        """Removes the expired entries and the oldest searches beyond max_entries"""
+        oldest_valid = self._oldest_valid()
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM searches WHERE created <= ?", (oldest_valid,))
+            self._connection.execute(
+                "DELETE FROM searches WHERE searchstring NOT IN "
+                "(SELECT searchstring FROM searches ORDER BY created DESC LIMIT ?)",
+                (self.max_entries,))
+            self._connection.execute(
+                "DELETE FROM videos WHERE created <= ? OR video_id NOT IN "
+                "(SELECT video_id FROM searches)", (oldest_valid,))
+
+    def close(self) -> None:
+        """Closes the connection to the database"""
+        with self._lock:
+            self._connection.close()
+
+    def _oldest_valid(self) -> float:
+        """Creation time of the oldest entry that hasn't expired"""
+        return time.time() - self.ttl
+
+
+def default_cache_dir() -> Path:
+    """Returns playlist_downloader's folder inside the user's cache directory"""
+    base = os.environ.get("XDG_CACHE_HOME")
+    base = Path(base) if base else Path.home() / ".cache"
+    return base / "playlist_downloader"
+
+
+def normalize_searchstring(searchstring: str) -> str:
+    """Lowercases searchstring and collapses its whitespace, so equivalent searches match"""
+    return " ".join(searchstring.lower().split())
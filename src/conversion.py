@@ -1,33 +1,220 @@
 """Module for converting playlist_downloader's audio files into different formats."""
 import os
+import time
+import subprocess
 from pathlib import Path
+import threading
+from typing import Optional
+from concurrent.futures import Future, ProcessPoolExecutor, wait
 from pydub import AudioSegment
 from pydub.exceptions import CouldntEncodeError
+from .metrics import Metrics
+from .progressbar import ConversionProgressBar
 
 
 class ConversionManager:
     """Manages the audio conversions through Converter instances"""
 
-    def __init__(self, audio_paths: list[Path]) -> None:
-        """Creates the converters"""
+    def __init__(self, audio_paths: list[Path], workers: Optional[int] = None) -> None:
+        """
+        Creates the converters
+            Parameters:
+                audio_paths (list[Path]): files to be converted
+                workers (int): number of processes converting at the same time. Defaults to the
+                    number of CPUs.
+        """
         check_paths_are_valid(audio_paths)
         self.converters = [Converter(path) for path in audio_paths]
+        self.workers = workers
+        self.new_extensions = []
+        self.errors = {}
 
     def convert_all(self, new_extension) -> None:
-        """Starts the conversion on all files."""
+        """
+        Converts all files, to one format or several separated by commas (see
+        parse_extensions), in a pool of processes. A failed conversion doesn't stop the rest;
+        its exception is saved in self.errors under the path of the original file.
+        """
+        self.new_extensions = parse_extensions(new_extension)
+        pipeline = ConversionPipeline(new_extension, self.workers, delete_originals=False,
+                                      total=len(self.converters))
         for converter in self.converters:
-            converter.convert_to(new_extension)
+            pipeline.submit(converter.original_path)
+        pipeline.wait_until_finished()
+        self.errors = pipeline.errors
 
     def delete_originals(self) -> None:
-        """Deletes all the original files"""
+        """
+        Deletes all the original files, except those whose conversion failed and those that
+        were already in one of the formats converted to.
+        """
         for converter in self.converters:
-            converter.delete_original()
+            if converter.original_path not in self.errors and \
+                    converter.original_extension not in self.new_extensions:
+                converter.delete_original()
+
+
+class ConversionPipeline:
+    """
+    Converts audio files in a pool of processes as they're submitted, so conversions can start
+    while other files are still being downloaded. With several formats, each file is decoded
+    once and encoded into all of them by the same process (see Converter.convert_to).
+    """
+
+    def __init__(self, new_extension: str, workers: Optional[int] = None,
+                 delete_originals: bool = True, total: Optional[int] = None,
+                 store=None, metrics: Optional[Metrics] = None,
+                 executor: Optional[ProcessPoolExecutor] = None) -> None:
+        """
+        Starts the pool of processes
+            Parameters:
+                new_extension (str): format the files are converted to, or several separated
+                    by commas (see parse_extensions)
+                workers (int): number of processes converting at the same time. Defaults to the
+                    number of CPUs.
+                delete_originals (bool): if True, each original file is deleted as soon as its
+                    conversion to every format succeeds.
+                total (int): number of files expected, used by the progress bar.
+                store (AudioStore): store checked before converting each file submitted with
+                    store names, and where their conversions are kept; None disables it.
+                metrics (Metrics): where the time each file waits and takes to be converted is
+                    recorded. Defaults to new Metrics.
+                executor (ProcessPoolExecutor): pool of processes shared with other pipelines,
+                    left running when this one finishes; workers is ignored then. None to
+                    start a pool for this pipeline.
+        """
+        self.new_extensions = parse_extensions(new_extension)
+        self.delete_originals = delete_originals
+        self.store = store
+        self.metrics = metrics if metrics else Metrics()
+        self.errors = {}
+        self._futures = []
+        self._lock = threading.Lock()
+        self._own_executor = executor is None
+        self._executor = executor if executor else ProcessPoolExecutor(max_workers=workers)
+        self.progress_bar = ConversionProgressBar(total)
+
+    def submit(self, path: Path, store_names: Optional[dict[str, str]] = None,
+               song: Optional[str] = None) -> Future:
+        """
+        Queues the conversion of the file at path to every format. store_names, if provided,
+        maps each format to the name of the converted file in the store; formats stored there
+        are taken from it instead. Its metrics are recorded under song, which defaults to the
+        file's name. Returns the Future of the conversion, done once the converted files are in
+        place (and in the store). A file isn't converted to its own format, and it's remuxed
+        to those that can hold its codec (see can_remux).
+        """
+        check_file_exists(path)
+        song = song if song else path.name
+        store_names = store_names if self.store and store_names else {}
+        original_extension = path.suffix[1:]
+        if original_extension in self.new_extensions:
+            self.metrics.count("conversions_skipped", song=song)
+        pending = []
+        for extension in self.new_extensions:
+            if extension == original_extension:
+                continue
+            if extension in store_names and \
+                    self.store.materialize(store_names[extension],
+                                           path.with_suffix(f".{extension}")):
+                self.metrics.count("conversion_store_hits", song=song)
+                continue
+            if can_remux(original_extension, extension):
+                self.metrics.count("remuxes", song=song)
+            pending.append(extension)
+        # Materialized formats are already stored; the rest are stored once converted
+        store_names = {extension: name for extension, name in store_names.items()
+                       if extension in pending or extension == original_extension}
+        if not pending:
+            future = Future()
+            future.set_result(None)
+            self._on_converted(path, future, store_names)
+            return future
+        submitted = time.time()
+
+        def on_converted(finished: Future) -> None:
+            if not finished.exception():
+                started, seconds = finished.result()
+                self.metrics.record("convert_queue", max(0.0, started - submitted), song)
+                self.metrics.record("convert", seconds, song)
+            self._on_converted(path, finished, store_names)
+
+        future = self._executor.submit(convert_file, path, ",".join(pending))
+        future.add_done_callback(on_converted)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def take_stored(self, path: Path, store_names: dict[str, str],
+                    song: Optional[str] = None) -> bool:
+        """
+        Places the conversions of the file that would be at path, to every format, from the
+        store, under their store_names, so the file itself isn't needed. Returns False, placing
+        none, unless all of them are stored and the original isn't to be kept.
+        """
+        if not self.store or not self.delete_originals or \
+                not all(self.store.contains(store_names[extension])
+                        for extension in self.new_extensions):
+            return False
+        for extension in self.new_extensions:
+            # Evicted since checked; the original is converted instead
+            if not self.store.materialize(store_names[extension],
+                                          path.with_suffix(f".{extension}")):
+                return False
+            self.metrics.count("conversion_store_hits", song=song if song else path.name)
+        self.progress_bar.callback()
+        return True
+
+    def wait_until_finished(self) -> None:
+        """Waits until every submitted conversion has finished and stops the pool, unless shared"""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        if self._own_executor:
+            self._executor.shutdown()
+        self.progress_bar.close()
+
+    def get_paths(self, path: Path) -> list[Path]:
+        """Returns the paths of the conversions of the file at path, one per format"""
+        return [path.with_suffix(f".{extension}") for extension in self.new_extensions]
+
+    def _on_converted(self, path: Path, future: Future,
+                      store_names: Optional[dict[str, str]] = None) -> None:
+        """
+        Saves the error of a failed conversion, or keeps the new files in the store (under
+        their store_names, if any) and deletes the original if requested and it isn't one of
+        them.
+        """
+        error = future.exception()
+        if error:
+            with self._lock:
+                self.errors[path] = error
+            self.progress_bar.callback()
+            return
+        for extension, name in (store_names or {}).items():
+            self.store.put(name, path.with_suffix(f".{extension}"))
+        if self.delete_originals and path not in self.get_paths(path):
+            path.unlink(missing_ok=True)
+        self.progress_bar.callback()
 
 
 class Converter:
-    """Interface to convert the format of an audio file"""
+    """
+    Interface to convert the format of an audio file. Conversions are streamed through ffmpeg,
+    which decodes and encodes the audio in small buffers, so the memory used doesn't grow with
+    the duration of the file. When the new format can hold the original codec, the audio is
+    copied into the new container instead, without decoding it. Several formats are written by
+    the same ffmpeg process, which reads and decodes the file once for all of them.
+    """
 
     VALID_FORMATS = ["mp3", "mp4", "ogg"]
+    # Output arguments of ffmpeg for each format; codecs match those used by pydub's export
+    ENCODER_ARGS = {"mp3": ["-f", "mp3", "-c:a", "libmp3lame"],
+                    "mp4": ["-f", "mp4", "-c:a", "aac"],
+                    "ogg": ["-f", "ogg", "-c:a", "libvorbis"]}
+    # Formats (as extensions) whose codec each format can hold as is: AAC from mp4 and m4a, and
+    # Opus or Vorbis from webm (youtube's audio containers) and ogg
+    REMUX_SOURCES = {"mp4": ["mp4", "m4a"], "ogg": ["webm", "ogg"]}
 
     def __init__(self, path: Path) -> None:
         """Parses the original name and extension"""
@@ -37,14 +224,43 @@ class Converter:
         self.original_extension = extension.split(".")[1]
 
     def convert_to(self, new_extension: str) -> None:
-        """Converts the original file to the new_extension format"""
-        if new_extension not in Converter.VALID_FORMATS:
-            raise ValueError(f"Conversion to format '{new_extension}' is not supported.")
-        new_file = Path(f"{self.filename}.{new_extension}")
-        original_audio = AudioSegment.from_file(
-            self.original_path,
-            format=self.original_extension)
-        original_audio.export(new_file, format=new_extension)
+        """
+        Converts the original file to the new_extension format, or to several formats separated
+        by commas (see parse_extensions), remuxing it when possible (see can_remux). Each
+        output is written to a temporary file; they replace the new files once the whole
+        conversion has succeeded, so either every format is converted or none is. The file
+        isn't converted to its own format.
+        """
+        new_extensions = [extension for extension in parse_extensions(new_extension)
+                          if extension != self.original_extension]
+        if not new_extensions:
+            return
+        outputs = {}
+        command = [AudioSegment.converter, "-y", "-v", "error", "-i", str(self.original_path)]
+        for extension in new_extensions:
+            new_file = Path(f"{self.filename}.{extension}")
+            temporary_file = Path(f"{new_file}.part")
+            outputs[temporary_file] = new_file
+            if can_remux(self.original_extension, extension):
+                output_args = ["-f", extension, "-c:a", "copy"]
+            else:
+                output_args = Converter.ENCODER_ARGS[extension]
+            command += ["-vn", *output_args, str(temporary_file)]
+        try:
+            process = subprocess.run(command, stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                     check=False)
+        except FileNotFoundError as error:
+            raise CouldntEncodeError(f"Encoder '{AudioSegment.converter}' wasn't found.") \
+                from error
+        if process.returncode != 0:
+            for temporary_file in outputs:
+                temporary_file.unlink(missing_ok=True)
+            raise CouldntEncodeError(
+                f"Converting {self.original_path} to {', '.join(new_extensions)} failed:\n"
+                f"{process.stderr.decode(errors='replace')}")
+        for temporary_file, new_file in outputs.items():
+            os.replace(temporary_file, new_file)
 
     def delete_original(self) -> None:
         """Deletes the original file"""
@@ -52,6 +268,38 @@ class Converter:
         check_file_exists(self.original_path)
         self.original_path.unlink()
 
+def convert_file(path: Path, new_extension: str) -> tuple[float, float]:
+    """
+    Converts the file at path to new_extension (one format or several, separated by commas);
+    entry point of the conversion processes.
+    Returns when the conversion started (seconds since the epoch) and the seconds it took.
+    """
+    started = time.time()
+    Converter(path).convert_to(new_extension)
+    return started, time.time() - started
+
+def can_remux(original_extension: str, new_extension: str) -> bool:
+    """
+    Checks if audio in the original_extension format can be converted to new_extension by
+    copying its codec into the new container, with no re-encoding
+    """
+    return original_extension in Converter.REMUX_SOURCES.get(new_extension, [])
+
+def parse_extensions(extension: str) -> list[str]:
+    """
+    Returns the formats in extension, which holds one format or several separated by commas
+    (e.g. "mp3,ogg"), without repetitions. Raises ValueError if any isn't valid.
+    """
+    extensions = list(dict.fromkeys(part.strip() for part in extension.split(",")))
+    for new_extension in extensions:
+        check_format_is_valid(new_extension)
+    return extensions
+
+def check_format_is_valid(extension: str) -> None:
+    """Checks extension is one of the formats Converter can convert to"""
+    if extension not in Converter.VALID_FORMATS:
+        raise ValueError(f"Conversion to format '{extension}' is not supported.")
+
 def check_paths_are_valid(paths: list[Path]) -> None:
     """Checks that the list of paths is not empty or None and that they're instances of Path"""
     if paths == None:
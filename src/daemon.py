@@ -0,0 +1,384 @@
+"""
+Module for the daemon mode of playlist_downloader: a long-running process taking jobs (playlists
+to download) from a persistent queue, so the caches, stages and conversion processes it keeps
+stay warm from one job to the next.
+"""
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+from .cache import default_cache_dir
+from .conversion import parse_extensions
+from .engine import DEFAULT_SCHEDULE, Stages, download_playlist
+from .metrics import Metrics
+from .retry import DEFAULT_ATTEMPTS
+from .transfer import DEFAULT_SEGMENTS, DEFAULT_SEGMENT_THRESHOLD
+from .workers import DEFAULT_JOBS, DEFAULT_SEARCH_JOBS
+
+QUEUE_NAME = "jobs.sqlite3"
+SOCKET_NAME = "daemon.sock"
+SPOOL_NAME = "spool"
+# Seconds between two looks at the spool folder
+SPOOL_INTERVAL = 1.0
+# Number of jobs listed by the status command
+STATUS_LIMIT = 20
+# Options of a job, along with their type; see download_playlist
+JOB_OPTIONS = {"urls": list, "path": str, "appended_songs": list, "artist": str,
+               "extension": str, "keep_originals": bool, "sync": bool, "prune": bool}
+FINISHED_STATUSES = ("done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    failed TEXT,
+    error TEXT
+);
+"""
+
+
+class JobQueue:
+    """
+    SQLite queue of the daemon's jobs, taken in submission order. Each job goes from "queued"
+    to "running", and then to "done", or "failed" if it raised or any of its songs failed.
+    Since the queue is kept on disk, jobs submitted while the daemon is stopped, or interrupted
+    by its stop, are run when it starts again.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Opens (or creates) the queue database.
+            Parameters:
+                path (Path): database file
+        """
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+
+    def submit(self, job: dict, source: str) -> int:
+        """Queues job, which came from source (the socket or a spool file). Returns its id"""
+        check_job(job)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (job, source, status, submitted) VALUES (?, ?, 'queued', ?)",
+                (json.dumps(job), source, time.time()))
+        return cursor.lastrowid
+
+    def take(self) -> Optional[tuple[int, dict]]:
+        """Marks the oldest queued job as running and returns its id and options, if any"""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT id, job FROM jobs WHERE status = 'queued' ORDER BY id").fetchone()
+            if not row:
+                return None
+            self._connection.execute(
+                "UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                (time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def finish(self, job_id: int, failed: Optional[dict[str, Exception]] = None,
+               error: Optional[Exception] = None) -> None:
+        """
+        Records the end of a running job, with the songs that failed (by searchstring) or the
+        error that stopped it, if any.
+        """
+        failed = failed if failed else {}
+        status = "failed" if failed or error else "done"
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, finished = ?, failed = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps({song: str(song_error)
+                                                  for song, song_error in failed.items()}),
+                 str(error) if error else None, job_id))
+
+    def requeue_interrupted(self) -> int:
+        """Queues again the jobs left running by a daemon that stopped. Returns how many"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+        return cursor.rowcount
+
+    def get(self, job_id: int) -> Optional[dict]:
+        """Returns the status of the job with job_id, or None if there isn't one"""
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?",
+                                           (job_id,)).fetchone()
+        return job_status(row) if row else None
+
+    def get_recent(self, limit: int = STATUS_LIMIT) -> list[dict]:
+        """Returns the status of the last limit jobs submitted, oldest first"""
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?",
+                                            (limit,)).fetchall()
+        return [job_status(row) for row in reversed(rows)]
+
+    def close(self) -> None:
+        """Closes the connection to the database"""
+        with self._lock:
+            self._connection.close()
+
+
+class Daemon:
+    """
+    Long-running process downloading the jobs of a JobQueue one after another. Jobs are
+    submitted through a unix socket (see send_request) or by placing their options, as JSON,
+    in a .json file of the spool folder, which is looked at every SPOOL_INTERVAL seconds. The
+    search cache, the audio store, the threads of the stages, the conversion processes and the
+    limits learnt by the circuit breakers are kept from one job to the next, so a job doesn't
+    pay for the start of the process nor for cold caches.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, jobs: int = DEFAULT_JOBS,
+                 search_jobs: int = DEFAULT_SEARCH_JOBS, convert_jobs: Optional[int] = None,
+                 cache=None, segments: int = DEFAULT_SEGMENTS,
+                 segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD, store=None,
+                 metrics: Optional[Metrics] = None, metrics_path: Optional[Path] = None,
+                 schedule: str = DEFAULT_SCHEDULE, limiter=None,
+                 retries: int = DEFAULT_ATTEMPTS) -> None:
+        """
+        Opens the queue. The parameters not listed are those of download_playlist, shared by
+        every job.
+            Parameters:
+                directory (Path): folder of the queue, the socket and the spool folder.
+                    Defaults to default_daemon_dir().
+                metrics (Metrics): where the time spent in each stage of every job is recorded.
+                    Defaults to new Metrics.
+                metrics_path (Path): if provided, metrics are saved there after each job.
+        """
+        self.directory = directory if directory else default_daemon_dir()
+        self.queue = JobQueue(self.directory / QUEUE_NAME)
+        self.socket_path = self.directory / SOCKET_NAME
+        self.spool_path = self.directory / SPOOL_NAME
+        self.spool_path.mkdir(parents=True, exist_ok=True)
+        self.metrics = metrics if metrics else Metrics()
+        self.metrics_path = metrics_path
+        self.stage_options = {"jobs": jobs, "search_jobs": search_jobs, "segments": segments,
+                              "retries": retries, "convert_jobs": convert_jobs}
+        self.run_options = {"cache": cache, "segments": segments,
+                            "segment_threshold": segment_threshold, "store": store,
+                            "metrics": self.metrics, "schedule": schedule,
+                            "limiter": limiter, "retries": retries}
+        self._wakeup = None
+        self._finished = None
+
+    async def serve(self) -> None:
+        """
+        Listens at the socket and runs the queued jobs until cancelled. A job interrupted by
+        the cancellation is run again the next time the daemon is served.
+        """
+        check_not_running(self.socket_path)
+        self.socket_path.unlink(missing_ok=True)
+        self.queue.requeue_interrupted()
+        self._wakeup = asyncio.Event()
+        self._finished = asyncio.Condition()
+        stages = Stages(**self.stage_options)
+        server = await asyncio.start_unix_server(self._handle, path=str(self.socket_path))
+        try:
+            async with server:
+                await asyncio.gather(self._run_jobs(stages), self._watch_spool())
+        finally:
+            stages.shutdown()
+            self.socket_path.unlink(missing_ok=True)
+
+    def submit_spooled(self) -> list[int]:
+        """
+        Queues the jobs of the .json files in the spool folder, deleting them. Files that
+        aren't a valid job are renamed to .invalid. Returns the ids of the jobs queued.
+        """
+        job_ids = []
+        for path in sorted(self.spool_path.glob("*.json")):
+            try:
+                job_ids.append(self.queue.submit(json.loads(path.read_text(encoding="utf-8")),
+                                                 f"spool:{path.name}"))
+            except (ValueError, TypeError) as error:
+                print(f"Invalid job at {path}: {error}")
+                path.replace(path.with_suffix(".invalid"))
+                continue
+            path.unlink()
+        if job_ids and self._wakeup:
+            self._wakeup.set()
+        return job_ids
+
+    def close(self) -> None:
+        """Closes the queue"""
+        self.queue.close()
+
+    async def _run_jobs(self, stages: Stages) -> None:
+        """Runs the queued jobs one after another, waiting for new ones when there are none"""
+        while True:
+            taken = self.queue.take()
+            if not taken:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job_id, job = taken
+            try:
+                failed = await download_playlist(
+                    job.get("urls") or [], Path(job["path"]),
+                    appended_songs=job.get("appended_songs"), artist=job.get("artist"),
+                    extension=job.get("extension"),
+                    keep_originals=job.get("keep_originals", False),
+                    sync=job.get("sync", False), prune=job.get("prune", False),
+                    stages=stages, **self.run_options)
+            except Exception as error:  # pylint: disable=broad-except
+                self.queue.finish(job_id, error=error)
+            else:
+                self.queue.finish(job_id, failed)
+            if self.metrics_path:
+                self.metrics.save(self.metrics_path)
+            async with self._finished:
+                self._finished.notify_all()
+
+    async def _watch_spool(self) -> None:
+        """Queues the jobs placed in the spool folder, every SPOOL_INTERVAL seconds"""
+        while True:
+            self.submit_spooled()
+            await asyncio.sleep(SPOOL_INTERVAL)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Answers the request of a client: a JSON line, answered with another one. A request
+        that can't be answered is responded with the reason, under "rejected".
+        """
+        try:
+            try:
+                response = await self._respond(json.loads(await reader.readline()))
+            except (ValueError, TypeError, KeyError) as error:
+                response = {"rejected": str(error)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request: dict) -> dict:
+        """
+        Returns the response to request, whose "command" is one of:
+            submit: queues request["job"]; if request["wait"], responds once it's finished
+            wait: responds once the job with request["id"] is finished
+            status: the job with request["id"] or, without an id, the last ones
+        Jobs are responded with their status (see job_status).
+        """
+        command = request["command"]
+        if command == "submit":
+            job_id = self.queue.submit(request["job"], "socket")
+            self._wakeup.set()
+            return await self._wait(job_id) if request.get("wait") else self.queue.get(job_id)
+        if command == "wait":
+            return await self._wait(request["id"])
+        if command == "status":
+            if request.get("id") is None:
+                return {"jobs": self.queue.get_recent()}
+            return self._get_job(request["id"])
+        raise ValueError(f"Unknown command '{command}'.")
+
+    async def _wait(self, job_id: int) -> dict:
+        """Returns the status of the job with job_id once it has finished"""
+        async with self._finished:
+            await self._finished.wait_for(
+                lambda: self._get_job(job_id)["status"] in FINISHED_STATUSES)
+        return self._get_job(job_id)
+
+    def _get_job(self, job_id: int) -> dict:
+        """Returns the status of the job with job_id; raises ValueError if there isn't one"""
+        status = self.queue.get(job_id)
+        if not status:
+            raise ValueError(f"There's no job with id {job_id}.")
+        return status
+
+
+async def send_request(request: dict, directory: Optional[Path] = None) -> dict:
+    """
+    Sends request to the daemon listening at directory (see Daemon._respond) and returns its
+    response. Raises ValueError if the daemon rejected the request, and OSError if there's no
+    daemon listening.
+    """
+    socket_path = (directory if directory else default_daemon_dir()) / SOCKET_NAME
+    reader, writer = await asyncio.open_unix_connection(str(socket_path))
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without answering.")
+    response = json.loads(line)
+    if "rejected" in response:
+        raise ValueError(response["rejected"])
+    return response
+
+
+def submit_job(job: dict, directory: Optional[Path] = None, wait: bool = True) -> dict:
+    """
+    Submits job to the daemon listening at directory. Returns its status: once it has finished
+    if wait, right after being queued otherwise.
+    """
+    check_job(job)
+    return asyncio.run(send_request({"command": "submit", "job": job, "wait": wait}, directory))
+
+
+def get_status(job_id: Optional[int] = None, directory: Optional[Path] = None) -> list[dict]:
+    """Returns the status of the job with job_id or, if None, of the last jobs submitted"""
+    response = asyncio.run(send_request({"command": "status", "id": job_id}, directory))
+    return response["jobs"] if job_id is None else [response]
+
+
+def job_status(row: tuple) -> dict:
+    """Returns the status of a job from its row in the queue"""
+    job_id, job, source, status, submitted, started, finished, failed, error = row
+    return {"id": job_id, "job": json.loads(job), "source": source, "status": status,
+            "submitted": submitted, "started": started, "finished": finished,
+            "failed": json.loads(failed) if failed else {}, "error": error}
+
+
+def default_daemon_dir() -> Path:
+    """Returns the daemon's folder inside playlist_downloader's cache directory"""
+    return default_cache_dir() / "daemon"
+
+
+def check_job(job: dict) -> None:
+    """
+    Checks job only has options of JOB_OPTIONS, of their type, with urls or appended songs to
+    download and an absolute path, since the daemon runs in another folder than its clients
+    """
+    if not isinstance(job, dict):
+        raise TypeError("A job must be a JSON object with its options.")
+    for option, value in job.items():
+        if option not in JOB_OPTIONS:
+            raise ValueError(f"Unknown job option '{option}'.")
+        if value is not None and not isinstance(value, JOB_OPTIONS[option]):
+            raise TypeError(f"Job option '{option}' must be of type "
+                            f"{JOB_OPTIONS[option].__name__}.")
+    if not job.get("urls") and not job.get("appended_songs"):
+        raise ValueError("A job must have urls or appended songs to download.")
+    if not job.get("path") or not Path(job["path"]).is_absolute():
+        raise ValueError("A job must have the absolute path of its destination folder.")
+    if job.get("extension"):
+        parse_extensions(job["extension"])
+
+
+def check_not_running(socket_path: Path) -> None:
+    """Checks no daemon is listening at socket_path already"""
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX) as client:
+        try:
+            client.connect(str(socket_path))
+        except OSError:
+            return
+    raise RuntimeError(f"A daemon is already listening at {socket_path}.")
@@ -0,0 +1,417 @@
+"""
+Module for the distributed mode of playlist_downloader: a coordinator splits the songs of the
+playlists into work items of a queue shared by several workers, in other processes or hosts,
+which lease them, download and convert them and report their results.
+"""
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+from .engine import (DEFAULT_SCHEDULE, SongPipeline, Stages, place_song, plan_downloads,
+                     print_failed)
+from .metrics import Metrics
+from .retry import DEFAULT_ATTEMPTS
+from .transfer import DEFAULT_SEGMENTS, DEFAULT_SEGMENT_THRESHOLD
+from .workers import DEFAULT_JOBS, DEFAULT_SEARCH_JOBS
+
+# Seconds a worker holds an item for before it can be taken over, unless renewed
+DEFAULT_LEASE = 60.0
+# Leases of an item after which it's given up, since its workers keep dying with it
+DEFAULT_MAX_LEASES = 3
+# Seconds between two looks at the queue, of idle workers and of the coordinator
+POLL_INTERVAL = 1.0
+# Seconds a connection waits for another process to release the database
+BUSY_TIMEOUT = 60.0
+FINISHED_STATUSES = ("done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    song TEXT NOT NULL,
+    targets TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    expires REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, id);
+CREATE INDEX IF NOT EXISTS items_run ON items (run);
+"""
+
+
+class WorkQueue(ABC):
+    """
+    Interface of the queues shared by a coordinator and its workers. A work item is a dict with
+    its "id", the "run" of the coordinator that put it, the "song" (searchstring) to download,
+    its "targets" (destination folder and searchstring of each playlist it's in; see
+    PlaylistBatch.get_targets) and the "options" of the run (extension and keep_originals).
+    Items go from "pending" to "leased" by a worker, and then to "done", with a "result", or
+    "failed", with an "error". An item whose lease expires is pending again, so another worker
+    takes it over; after max_leases it's given up. Implementations must define every abstract
+    method and be safe to use from several processes at once; see SQLiteWorkQueue.
+    """
+
+    @abstractmethod
+    def put(self, run: str, items: list[dict]) -> None:
+        """Adds the items of run, each with its song, targets and options, as pending"""
+
+    @abstractmethod
+    def lease(self, worker: str, duration: float) -> Optional[dict]:
+        """
+        Leases the oldest pending item (or whose lease has expired) to worker for duration
+        seconds and returns it; None if there's none.
+        """
+
+    @abstractmethod
+    def renew(self, item_id: int, worker: str, duration: float) -> bool:
+        """
+        Extends the lease of worker on the item for duration seconds from now. Returns False if
+        worker doesn't hold it anymore.
+        """
+
+    @abstractmethod
+    def complete(self, item_id: int, worker: str, result: dict) -> bool:
+        """
+        Marks the item leased by worker as done with result. Returns False, without changing
+        it, if worker doesn't hold it anymore.
+        """
+
+    @abstractmethod
+    def fail(self, item_id: int, worker: str, error: str) -> bool:
+        """
+        Marks the item leased by worker as failed with error. Returns False, without changing
+        it, if worker doesn't hold it anymore.
+        """
+
+    @abstractmethod
+    def get_items(self, run: str) -> list[dict]:
+        """Returns the items of run, with their status, result and error"""
+
+    @abstractmethod
+    def is_drained(self) -> bool:
+        """Checks no item is pending or leased"""
+
+    def close(self) -> None:
+        """Releases the resources of the queue"""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    WorkQueue kept in a SQLite database, which can be on a filesystem shared by several hosts.
+    Every change is a transaction taking the database's write lock first (BEGIN IMMEDIATE), so
+    an item is never leased twice. The rollback journal is used rather than WAL, which doesn't
+    work over network filesystems; the filesystem must support locks (e.g. NFSv4).
+    """
+
+    def __init__(self, path: Path, max_leases: int = DEFAULT_MAX_LEASES,
+                 timeout: float = BUSY_TIMEOUT) -> None:
+        """
+        Opens (or creates) the queue database.
+            Parameters:
+                path (Path): database file, shared by the coordinator and the workers
+                max_leases (int): leases of an item after which it's given up if the last
+                    one expires
+                timeout (float): seconds waited for other processes to release the database
+        """
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_leases = max_leases
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=timeout, isolation_level=None,
+                                           check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode = DELETE")
+            self._connection.executescript(SCHEMA)
+
+    def put(self, run: str, items: list[dict]) -> None:
+        rows = [(run, item["song"], json.dumps(item["targets"]), json.dumps(item["options"]))
+                for item in items]
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO items (run, song, targets, options, status) "
+                "VALUES (?, ?, ?, ?, 'pending')", rows)
+
+    def lease(self, worker: str, duration: float) -> Optional[dict]:
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE items SET status = 'failed', worker = NULL, "
+                "error = 'Its lease expired ' || leases || ' times.' "
+                "WHERE status = 'leased' AND expires < ? AND leases >= ?",
+                (now, self.max_leases))
+            row = connection.execute(
+                "SELECT id, run, song, targets, options FROM items "
+                "WHERE status = 'pending' OR (status = 'leased' AND expires < ?) "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if not row:
+                return None
+            connection.execute(
+                "UPDATE items SET status = 'leased', worker = ?, expires = ?, "
+                "leases = leases + 1 WHERE id = ?", (worker, now + duration, row[0]))
+        return {"id": row[0], "run": row[1], "song": row[2], "targets": json.loads(row[3]),
+                "options": json.loads(row[4])}
+
+    def renew(self, item_id: int, worker: str, duration: float) -> bool:
+        return self._update_leased(item_id, worker, "expires = ?", (time.time() + duration,))
+
+    def complete(self, item_id: int, worker: str, result: dict) -> bool:
+        return self._update_leased(item_id, worker, "status = 'done', result = ?",
+                                   (json.dumps(result),))
+
+    def fail(self, item_id: int, worker: str, error: str) -> bool:
+        return self._update_leased(item_id, worker, "status = 'failed', error = ?", (error,))
+
+    def get_items(self, run: str) -> list[dict]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, song, targets, status, worker, leases, result, error FROM items "
+                "WHERE run = ? ORDER BY id", (run,)).fetchall()
+        return [{"id": row[0], "run": run, "song": row[1], "targets": json.loads(row[2]),
+                 "status": row[3], "worker": row[4], "leases": row[5],
+                 "result": json.loads(row[6]) if row[6] else None, "error": row[7]}
+                for row in rows]
+
+    def is_drained(self) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM items WHERE status IN ('pending', 'leased') LIMIT 1").fetchone()
+        return row is None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _update_leased(self, item_id: int, worker: str, assignments: str,
+                       parameters: tuple) -> bool:
+        """Sets assignments on the item if worker still holds its lease; returns if it did"""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                f"UPDATE items SET {assignments} "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (*parameters, item_id, worker))
+        return cursor.rowcount == 1
+
+    def _transaction(self) -> "_Transaction":
+        """Returns a context manager running its block as a write transaction"""
+        return _Transaction(self._connection, self._lock)
+
+
+class _Transaction:
+    """Write transaction on a connection in autocommit mode, serialized by lock"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock) -> None:
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        try:
+            self.connection.execute("ROLLBACK" if error_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+class Worker:
+    """
+    Worker of a WorkQueue: leases items, downloads and converts their songs through a
+    SongPipeline and links the files into their targets, which must be reachable from every
+    worker (e.g. on a shared filesystem), then reports the result. Holds up to jobs +
+    search_jobs items at once, so some are being searched while others download, and renews
+    their leases while they're being processed.
+    """
+
+    def __init__(self, queue: WorkQueue, name: Optional[str] = None, jobs: int = DEFAULT_JOBS,
+                 search_jobs: int = DEFAULT_SEARCH_JOBS, convert_jobs: Optional[int] = None,
+                 cache=None, segments: int = DEFAULT_SEGMENTS,
+                 segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD, store=None,
+                 metrics: Optional[Metrics] = None, schedule: str = DEFAULT_SCHEDULE,
+                 limiter=None, retries: int = DEFAULT_ATTEMPTS,
+                 lease: float = DEFAULT_LEASE, poll_interval: float = POLL_INTERVAL) -> None:
+        """
+        The parameters not listed are those of download_playlist.
+            Parameters:
+                queue (WorkQueue): queue the items are leased from
+                name (str): name of the worker in the queue. Defaults to the host's name and a
+                    random suffix.
+                lease (float): seconds each item is leased for, renewed every third of it
+                poll_interval (float): seconds between two looks at the queue while idle
+        """
+        self.queue = queue
+        self.name = name if name else f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.capacity = jobs + search_jobs
+        self.stage_options = {"jobs": jobs, "search_jobs": search_jobs, "segments": segments,
+                              "retries": retries, "convert_jobs": convert_jobs}
+        self.pipeline_options = {"cache": cache, "segments": segments,
+                                 "segment_threshold": segment_threshold, "store": store,
+                                 "schedule": schedule, "limiter": limiter, "retries": retries}
+        self.metrics = metrics if metrics else Metrics()
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._held = {}
+        # Pipeline of each run with items held, and how many; see _get_pipeline
+        self._pipelines = {}
+        self._run_items = {}
+        self._stages = None
+
+    async def run(self, until_drained: bool = False) -> int:
+        """
+        Processes items until cancelled or, if until_drained, until the queue has no items
+        pending or leased. Returns the number of items processed.
+        """
+        self._stages = Stages(**self.stage_options)
+        heartbeat = asyncio.create_task(self._renew_leases())
+        processed = 0
+        try:
+            while True:
+                while len(self._held) < self.capacity:
+                    item = await asyncio.to_thread(self.queue.lease, self.name, self.lease)
+                    if not item:
+                        break
+                    self._held[item["id"]] = asyncio.create_task(self._process(item))
+                if not self._held:
+                    if until_drained and await asyncio.to_thread(self.queue.is_drained):
+                        return processed
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                done, _ = await asyncio.wait(self._held.values(), timeout=self.poll_interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                processed += len(done)
+                self._held = {item_id: task for item_id, task in self._held.items()
+                              if task not in done}
+        finally:
+            heartbeat.cancel()
+            for task in self._held.values():
+                task.cancel()
+            await asyncio.gather(heartbeat, *self._held.values(), return_exceptions=True)
+            self._held = {}
+            for pipeline in self._pipelines.values():
+                pipeline.close()
+            self._pipelines = {}
+            self._run_items = {}
+            self._stages.shutdown()
+
+    async def _process(self, item: dict) -> None:
+        """Downloads the song of item into its targets and reports the result to the queue"""
+        targets = [(Path(destination), searchstring)
+                   for destination, searchstring in item["targets"]]
+        pipeline = self._get_pipeline(item["run"], item["options"])
+        pipeline.query_bar.add(1)
+        try:
+            try:
+                video, song_paths = await pipeline.process(item["song"], targets[0][0])
+                await asyncio.to_thread(place_song, song_paths, targets, video.get_video_id(),
+                                        {})
+            except Exception as error:  # pylint: disable=broad-except
+                self.metrics.count("failures", song=item["song"])
+                await asyncio.to_thread(self.queue.fail, item["id"], self.name, str(error))
+                return
+            result = {"video_id": video.get_video_id(),
+                      "files": [song_path.name for song_path in song_paths]}
+            await asyncio.to_thread(self.queue.complete, item["id"], self.name, result)
+        finally:
+            await self._release_pipeline(item["run"])
+
+    def _get_pipeline(self, run: str, options: dict) -> SongPipeline:
+        """
+        Returns the pipeline of run, made on its first item held. Pipelines only live while
+        items of their run are held, so no video downloaded by a run (which may have moved or
+        deleted its files since) is taken for another one.
+        """
+        if run not in self._pipelines:
+            self._pipelines[run] = SongPipeline(
+                0, extension=options.get("extension"),
+                keep_originals=options.get("keep_originals", False), metrics=self.metrics,
+                stages=self._stages, **self.pipeline_options)
+            self._run_items[run] = 0
+        self._run_items[run] += 1
+        return self._pipelines[run]
+
+    async def _release_pipeline(self, run: str) -> None:
+        """Closes the pipeline of run once none of its items is held"""
+        self._run_items[run] -= 1
+        if self._run_items[run] == 0:
+            del self._run_items[run]
+            await asyncio.to_thread(self._pipelines.pop(run).close)
+
+    async def _renew_leases(self) -> None:
+        """Renews the leases of the items held every third of the lease"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            for item_id in list(self._held):
+                await asyncio.to_thread(self.queue.renew, item_id, self.name, self.lease)
+
+
+async def coordinate(urls: list[str], path: Path, queue: WorkQueue,
+                     appended_songs: Optional[list[str]] = None, artist: Optional[str] = None,
+                     extension: Optional[str] = None, keep_originals: bool = False,
+                     cache=None, sync: bool = False, prune: bool = False,
+                     metrics: Optional[Metrics] = None,
+                     poll_interval: float = POLL_INTERVAL) -> dict[str, Exception]:
+    """
+    Scrapes the playlists of urls and puts each of their songs as a work item of queue, to be
+    downloaded by the workers into path (a folder every worker can reach), as download_playlist
+    would. Waits until every item is finished, then updates the manifests (with sync). Returns
+    the songs that failed, by searchstring, and the playlists that couldn't be scraped, by
+    url, along with their error; poll_interval is the seconds between two looks at the
+    items, see download_playlist for the rest of the parameters.
+    """
+    metrics = metrics if metrics else Metrics()
+    path = path.absolute()
+    batch, manifests, failed_playlists = await plan_downloads(
+        urls, path, appended_songs, artist, extension, cache, sync, prune, metrics)
+    run = uuid.uuid4().hex
+    options = {"extension": extension, "keep_originals": keep_originals}
+    await asyncio.to_thread(queue.put, run, [
+        {"song": song,
+         "targets": [[str(destination), searchstring]
+                     for destination, searchstring in batch.get_targets(song)],
+         "options": options} for song in batch.get_songs()])
+    while True:
+        items = await asyncio.to_thread(queue.get_items, run)
+        if all(item["status"] in FINISHED_STATUSES for item in items):
+            break
+        await asyncio.sleep(poll_interval)
+
+    failed = await asyncio.to_thread(record_items, items, manifests, metrics)
+    print_failed(failed_playlists, "playlists")
+    print_failed(failed)
+    return {**failed_playlists, **failed}
+
+
+def record_items(items: list[dict], manifests: dict, metrics: Metrics) -> dict[str, Exception]:
+    """
+    Adds the files of the items done to the manifests of their targets, if any, and saves
+    them. Returns the songs of the items that failed, along with their errors.
+    """
+    failed = {}
+    for item in items:
+        if item["status"] == "failed":
+            failed[item["song"]] = RuntimeError(item["error"])
+            metrics.count("failures", song=item["song"])
+            continue
+        for destination, searchstring in item["targets"]:
+            if Path(destination) in manifests:
+                manifests[Path(destination)].add(
+                    searchstring, item["result"]["video_id"],
+                    *[Path(destination, name) for name in item["result"]["files"]])
+    for manifest in manifests.values():
+        manifest.save()
+    return failed
@@ -1,26 +1,46 @@
 """Container for the Downloader class"""
+import asyncio
 import threading
-from typing import Callable
+from concurrent.futures import Future
+from typing import Callable, Optional
 from pathlib import Path
-from pytube import Stream
-from .search import YTVideo
-from .progressbar import DownloadProgressBar, QueryProgressBar
+from .engine import DEFAULT_SCHEDULE, SongPipeline
+from .metrics import Metrics
+from .retry import DEFAULT_ATTEMPTS
+from .transfer import DEFAULT_SEGMENTS, DEFAULT_SEGMENT_THRESHOLD
+from .workers import DEFAULT_JOBS, DEFAULT_SEARCH_JOBS
 
-Callback = Callable[[Stream, bytes, int], None]
 
 class DownloadManager:
-    """Class that handles all the downloads through Downloader instances"""
+    """
+    Class that handles all the downloads through Downloader instances. It's a blocking
+    interface to the engine for callers that don't run asyncio: each song goes through an
+    engine.SongPipeline, run by an event loop in a thread of the manager, so songs are
+    searched, deduplicated, taken from the store and scheduled as in a normal run.
+    """
 
-    def __init__(self, song_list: list[str], path: Path) -> None:
+    def __init__(self, song_list: list[str], path: Path, jobs: int = DEFAULT_JOBS,
+                 search_jobs: int = DEFAULT_SEARCH_JOBS, cache=None,
+                 segments: int = DEFAULT_SEGMENTS,
+                 segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD,
+                 on_finished: Optional[Callable[["Downloader"], None]] = None,
+                 paths: Optional[list[Path]] = None, store=None,
+                 metrics: Optional[Metrics] = None,
+                 schedule: str = DEFAULT_SCHEDULE, limiter=None,
+                 retries: int = DEFAULT_ATTEMPTS, extension: Optional[str] = None) -> None:
         """
-        Creates a Downloader instance for each song in song_list.
-        Initializes the has_started list, which keeps track of which downloads have been
-        started.
-        Creates a QueryProgressBar and a DownloadProgressBar, used to keep track of the state of
-        the yt queries and the downloads, respectively.
+        Creates a Downloader instance for each song in song_list, and the SongPipeline they
+        go through, whose progress bars track the queries and the downloads.
             Parameters:
                 song_list (string list): list with the titles of the songs to be downloaded.
                 path (string): path of the directory where the songs will be saved.
+                on_finished (function): called with each Downloader as soon as its song has
+                    been downloaded, from the manager's thread.
+                paths (Path list): folder of each song of song_list, if they're not all saved
+                    in path.
+                extension (str): format the songs are converted to, if any (see
+                    engine.SongPipeline).
+            See engine.download_playlist for the rest of the parameters.
         """
         check_songlist(song_list)
         self.song_list = song_list
@@ -28,96 +48,168 @@ class DownloadManager:
         if not path.exists():
             path.mkdir()
         self.path = path
-        self.query_bar = QueryProgressBar(len(song_list))
-        self.downloads = [Downloader(song, self) for song in song_list]
-
-        stream_list = [d.stream() for d in self.downloads]
-        self.download_bar = DownloadProgressBar(stream_list)
+        self.metrics = metrics if metrics else Metrics()
+        self.on_finished = on_finished
+        self.failed = {}
+        self.pipeline = SongPipeline(len(song_list), jobs=jobs, search_jobs=search_jobs,
+                                     extension=extension, cache=cache, segments=segments,
+                                     segment_threshold=segment_threshold, store=store,
+                                     metrics=self.metrics, schedule=schedule, limiter=limiter,
+                                     retries=retries)
+        self.query_bar = self.pipeline.query_bar
+        self.download_bar = self.pipeline.download_bar
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        paths = paths if paths else [path] * len(song_list)
+        for folder in set(paths) - {path}:
+            folder.mkdir(parents=True, exist_ok=True)
+        self.downloads = [Downloader(song, self, song_path)
+                          for song, song_path in zip(song_list, paths)]
 
     def start_all(self) -> None:
-        """Starts all downloads that haven't started already."""
+        """
+        Starts all downloads that haven't started already. Each song is queued for download
+        as soon as its query is resolved.
+        """
         for downloader in self.downloads:
-            downloader.download()
+            if not downloader.job:
+                downloader.download()
         self.has_started = True
 
+    def add_song(self, title: str, path: Optional[Path] = None) -> None:
+        """
+        Adds a song to the download list, which is queued right away if start_all has already
+        been called. Allows feeding songs as they're scraped (see Scrapper.iter_searchstring).
+        Must be called before wait_until_finished. The song is saved in path, or in the
+        manager's path if it's None.
+        """
+        check_songlist([title])
+        if path and not path.exists():
+            path.mkdir(parents=True)
+        downloader = Downloader(title, self, path)
+        self.downloads.append(downloader)
+        self.query_bar.add(1)
+        if self.has_started:
+            downloader.download()
+
+    def submit(self, downloader: "Downloader") -> Future:
+        """Queues the song of downloader in the pipeline; returns the Future of its result"""
+        with self._lock:
+            if not self._loop:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name="download-manager", daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(
+            self.pipeline.process(downloader.title, downloader.path), self._loop)
+
     def wait_until_finished(self) -> None:
-        """Waits until all the Downloader threads have finished"""
+        """
+        Waits until all the Downloader jobs have finished, then stops the pipeline. The songs
+        that failed, and those resolved to a video whose download failed, are saved in
+        self.failed along with their error, instead of stopping the rest.
+        """
         for downloader in self.downloads:
             if not downloader.job:
                 raise ValueError(f"Download at {downloader} hasn't been called yet")
-            downloader.job.join()
+        for downloader in self.downloads:
+            error = downloader.job.exception()
+            if error:
+                self.failed[downloader.title] = error
+                self.metrics.count("failures", song=downloader.title)
+        self.pipeline.close()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def get_pool_status(self) -> dict:
+        """Returns how many download workers are busy, out of how many, and the queued jobs"""
+        if self._loop and self._loop.is_running():
+            # Stages are only read from their loop
+            return asyncio.run_coroutine_threadsafe(self._get_pool_status(), self._loop).result()
+        return self._read_pool_status()
+
+    async def _get_pool_status(self) -> dict:
+        """get_pool_status, run in the manager's loop"""
+        return self._read_pool_status()
+
+    def _read_pool_status(self) -> dict:
+        """Reads the status of the download and search stages of the pipeline"""
+        download_stage, search_stage = self.pipeline.download_stage, self.pipeline.search_stage
+        return {"busy": download_stage.busy(),
+                "workers": download_stage.limit,
+                "queued": download_stage.queue_depth(),
+                "searching": search_stage.busy(),
+                "search_queued": search_stage.queue_depth()}
 
     def get_file_paths(self) -> list[Path]:
-        """Returns the audio file paths; can only be called after downloads are finished"""
-        return [d.get_absolute_path() for d in self.downloads]
+        """
+        Returns the audio file paths of the songs that didn't fail; can only be called after
+        downloads are finished
+        """
+        return [d.get_absolute_path() for d in self.downloads if d.title not in self.failed]
 
-    def is_download_complete(self) -> None:
+    def is_download_complete(self) -> bool:
         """Checks every Downloader has finished downloading its song"""
-        for download in self.downloads:
-            if not download.finished:
-                return False
-            return True
+        return all(download.job and download.job.done() for download in self.downloads)
 
-    def query_callback(self) -> None:
-        """Updates the query progressbar. Should be called when Downloader finishes a query"""
-        self.query_bar.callback()
+    def finished_callback(self, downloader: "Downloader") -> None:
+        """Hands downloader to on_finished. Should be called when its download has finished"""
+        if self.on_finished:
+            self.on_finished(downloader)
 
-    def download_callback(self, stream: Stream, chunk: bytes, remaining_bytes: int):
-        """
-        Connector between the callbacks in Downloader instances and the bar.
-        See DownloadProgressBar.callback for more info about the callback.
-        """
-        if "download_bar" not in self.__dict__.keys():
-            raise Exception("The DownloadProgressBar in DownloadManager should" \
-                            " have been created before callback is called.")
-
-        self.download_bar.callback(stream, chunk, remaining_bytes)
 
 class Downloader:
     """
     Class that handles the download of a single video.
     """
-    def __init__(self, title: str, parent: DownloadManager) -> None:
+    def __init__(self, title: str, parent: DownloadManager, path: Optional[Path] = None) -> None:
         """
-        Querys and selects a video; sets the download as a thread.
+        Saves the title; the video is queried and downloaded through the parent's pipeline.
             Parameters:
                 title (str): title of the song
                 parent (DownloadManager): Manager of the Downloader instance
+                path (Path): folder the song is saved in. Defaults to the parent's path.
         """
         self.title = title
-        self.path = parent.path
-        self.video = YTVideo(title, parent.download_callback)
-        parent.query_callback()
+        self.parent = parent
+        self.path = path if path else parent.path
+        self.video = None
+        self.paths = []
         self.job = None
 
-    def stream(self) -> Stream:
-        """
-        Returns the stream associated to the video. The stream is saved at YTVideo's cache, so after
-        the first call, get_stream is unexpensive to call.
-        """
-        return self.video.get_stream()
-
     def download(self) -> None:
-        """Thread wrapper around _stream_download_call"""
+        """Queues the song in the parent's pipeline"""
         if self.job:
-            raise ValueError(f"Download already at progress\nVid:{self.get_filename}")
-        self.job = threading.Thread(target=self._stream_download_call)
-        self.job.start()
+            raise ValueError(f"Download already at progress\nVid:{self.title}")
+        self.job = self.parent.submit(self)
+        self.job.add_done_callback(self._on_done)
 
-    def _stream_download_call(self) -> None:
-        """Downloads the associated stream in path"""
-        stream = self.video.get_stream()
-        stream.download(output_path=self.path, filename = self.get_filename())
-
-    def get_filename(self) -> None:
-        """Returns the relative path of the downloaded song."""
-        filename = self.video.vid.title
-        ext = self.video.get_format()
-        return f"{filename}.{ext}"
+    def get_error(self) -> Optional[Exception]:
+        """
+        Returns the error that stopped the song: its search, its download or, if it was
+        resolved to a video already being downloaded, that download's. None if it didn't fail
+        (or hasn't yet).
+        """
+        if self.job and self.job.done():
+            return self.job.exception()
+        return None
 
     def get_absolute_path(self) -> Path:
-        """Returns the absolute path of the downloaded song."""
-        return Path(self.path, self.get_filename())
+        """
+        Returns the absolute path of the downloaded song, converted if the parent has an
+        extension. If the song was a duplicate, the path where its video was downloaded.
+        """
+        return self.paths[0]
+
+    def _on_done(self, job: Future) -> None:
+        """Keeps the video and files of the song and hands it to the parent, unless it failed"""
+        if job.cancelled() or job.exception():
+            return
+        self.video, self.paths = job.result()
+        self.parent.finished_callback(self)
 
 
 def check_songlist(song_list: list[str]) -> None:
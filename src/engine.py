@@ -0,0 +1,662 @@
+"""
+Module for the asyncio engine of playlist_downloader: scraping, searching, resolving streams,
+downloading and converting run as async stages of a pipeline, each with bounded concurrency.
+"""
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import functools
+from pathlib import Path
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional, TypeVar, Union
+from pytube import Stream
+from .batch import PlaylistBatch, playlist_folder_name
+from .conversion import ConversionPipeline
+from .files import link_or_copy
+from .metrics import Metrics
+from .pages import DEFAULT_PAGE_JOBS, ConnectionPool
+from .progressbar import DownloadProgressBar, QueryProgressBar
+from .retry import DEFAULT_ATTEMPTS, CircuitBreaker, RetryPolicy
+from .scrap import Scrapper
+from .search import YTVideo
+from .store import object_name
+from .sync import Manifest
+from .transfer import (DEFAULT_SEGMENTS, DEFAULT_SEGMENT_THRESHOLD, download_resumable,
+                       download_segmented)
+from .workers import DEFAULT_JOBS, DEFAULT_SEARCH_JOBS, WorkerPool, check_worker_count
+
+T = TypeVar("T")
+
+# Maximum number of playlists scraped at the same time
+DEFAULT_SCRAPE_JOBS = 4
+# Orders in which resolved songs are downloaded: as they're resolved (playlist order) or the
+# biggest pending stream first, which keeps a big song from being left for the end (LPT)
+SCHEDULES = ("playlist", "largest-first")
+DEFAULT_SCHEDULE = "playlist"
+# Priority in the search stage of the stream resolutions, ahead of the searches pending, so
+# songs already found reach the download stage before new ones are searched
+RESOLVE_PRIORITY = -1
+
+
+class Stage:
+    """
+    Stage of the pipeline, running blocking calls (pytube, urllib, sqlite...) in its own pool
+    of `limit` threads. Coroutines wait for a slot of the stage before calling, so no more than
+    `limit` of them are inside at once, and the rest cost nothing but a coroutine. Slots are
+    handed out by priority (lowest first) and, among equal priorities, in arrival order.
+    Meant to be used from a single event loop.
+    """
+
+    def __init__(self, name: str, limit: int) -> None:
+        """
+            Parameters:
+                name (str): name of the stage, prefix of its threads' names
+                limit (int): maximum number of coroutines inside the stage at once
+        """
+        check_worker_count(limit)
+        self.name = name
+        self.limit = limit
+        self._executor = ThreadPoolExecutor(limit, thread_name_prefix=name)
+        self._waiting = []
+        # Tie breaker of equal priorities, keeping them in arrival order
+        self._counter = itertools.count()
+        self._inside = 0
+
+    @asynccontextmanager
+    async def slot(self, priority: float = 0) -> AsyncIterator[None]:
+        """Waits for a slot of the stage, held as long as the async with block"""
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def call(self, function: Callable[..., T], *args) -> T:
+        """Runs function(*args) in a thread of the stage, returning its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args))
+
+    def busy(self) -> int:
+        """Returns the number of coroutines inside the stage"""
+        return self._inside
+
+    def queue_depth(self) -> int:
+        """Returns the number of coroutines waiting for a slot of the stage"""
+        return sum(not future.done() for _, _, future in self._waiting)
+
+    def shutdown(self) -> None:
+        """Stops the threads of the stage"""
+        self._executor.shutdown()
+
+    async def _acquire(self, priority: float) -> None:
+        """Takes a free slot or, if there's none, waits until _release hands one over"""
+        if self._inside < self.limit and not self._waiting:
+            self._inside += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # A slot handed over right before the cancellation is passed on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        """Hands the slot over to the first coroutine waiting, or frees it"""
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._inside -= 1
+
+
+class Stages:
+    """
+    Stages of the pipeline, the retry policies of their requests, the keep-alive connections
+    and page workers used to scrape playlists and the pool of processes converting files. A
+    SongPipeline makes its own, unless it's given some to share with the runs before and
+    after it, so their threads, connections, processes and the limits learnt by their circuit
+    breakers stay warm (see daemon.Daemon). Meant to be used from a single event loop.
+    """
+
+    def __init__(self, jobs: int = DEFAULT_JOBS, search_jobs: int = DEFAULT_SEARCH_JOBS,
+                 segments: int = DEFAULT_SEGMENTS, retries: int = DEFAULT_ATTEMPTS,
+                 convert_jobs: Optional[int] = None) -> None:
+        """See download_playlist for the parameters"""
+        self.scrape = Stage("scrape", DEFAULT_SCRAPE_JOBS)
+        self.connections = ConnectionPool()
+        # Connections are kept per thread, so the page workers are kept along with them
+        self.pages = WorkerPool(DEFAULT_PAGE_JOBS * DEFAULT_SCRAPE_JOBS, name="page")
+        self.search = Stage("search", search_jobs)
+        self.download = Stage("download", jobs)
+        self.search_retry = RetryPolicy(retries, breaker=CircuitBreaker(search_jobs))
+        self.download_retry = RetryPolicy(retries, breaker=CircuitBreaker(jobs * segments))
+        self.convert_jobs = convert_jobs
+        self._conversion_executor = None
+
+    def get_conversion_executor(self) -> ProcessPoolExecutor:
+        """Returns the pool of processes converting files, started on the first call"""
+        if not self._conversion_executor:
+            self._conversion_executor = ProcessPoolExecutor(max_workers=self.convert_jobs)
+        return self._conversion_executor
+
+    def shutdown(self) -> None:
+        """Stops the threads of the stages, their connections and the conversion processes"""
+        self.scrape.shutdown()
+        self.pages.shutdown()
+        self.connections.close()
+        self.search.shutdown()
+        self.download.shutdown()
+        if self._conversion_executor:
+            self._conversion_executor.shutdown()
+
+
+class SongPipeline:
+    """
+    Runs each song through the stages: search and stream resolution (search stage), download
+    (download stage) and conversion (a pool of processes). Every song is a coroutine; a song
+    resolved to a video that another one is already downloading waits for its file instead.
+    See download_playlist for the parameters; jobs, search_jobs, segments, retries and
+    convert_jobs are those of the stages, so they're ignored if shared stages are provided.
+    """
+
+    def __init__(self, total: int, jobs: int = DEFAULT_JOBS,
+                 search_jobs: int = DEFAULT_SEARCH_JOBS, extension: Optional[str] = None,
+                 keep_originals: bool = False, convert_jobs: Optional[int] = None, cache=None,
+                 segments: int = DEFAULT_SEGMENTS,
+                 segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD, store=None,
+                 metrics: Optional[Metrics] = None, schedule: str = DEFAULT_SCHEDULE,
+                 limiter=None, retries: int = DEFAULT_ATTEMPTS,
+                 stages: Optional[Stages] = None) -> None:
+        check_schedule(schedule)
+        self.extension = extension
+        self.cache = cache
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.store = store
+        self.metrics = metrics if metrics else Metrics()
+        self.schedule = schedule
+        self.limiter = limiter
+        self.retries = retries
+        # Stages made here are stopped along with the pipeline; shared ones are left running
+        self.own_stages = stages is None
+        self.stages = stages if stages else Stages(jobs, search_jobs, segments, retries,
+                                                   convert_jobs)
+        self.search_stage = self.stages.search
+        self.download_stage = self.stages.download
+        self.search_retry = self.stages.search_retry
+        self.download_retry = self.stages.download_retry
+        self.query_bar = QueryProgressBar(total)
+        self.download_bar = DownloadProgressBar([])
+        self.conversions = None
+        if extension:
+            self.conversions = ConversionPipeline(
+                extension, delete_originals=not keep_originals, total=total, store=store,
+                metrics=self.metrics, executor=self.stages.get_conversion_executor())
+        # Future of the file of each video id, awaited by the songs resolved to it later
+        self.videos = {}
+
+    async def process(self, song: str, folder: Path) -> tuple[YTVideo, list[Path]]:
+        """
+        Searches, downloads and converts song into folder. Returns its video and the paths of
+        its files, one per format, which are in another folder if the video was already being
+        downloaded there.
+        """
+        video = await self._search(song)
+        video_id = video.get_video_id()
+        if video_id in self.videos:
+            self.metrics.count("duplicates", song=song)
+            return video, await asyncio.shield(self.videos[video_id])
+        self.videos[video_id] = asyncio.get_running_loop().create_future()
+        try:
+            paths = await self._take_conversions_from_store(song, video, folder)
+            if not paths:
+                paths = [await self._download(song, video, folder)]
+                if self.conversions:
+                    store_names = self._get_conversion_store_names(video) \
+                        if self.store else None
+                    # Submitting checks the file and the store, or even finishes the conversion
+                    conversion = await self.search_stage.call(
+                        self.conversions.submit, paths[0], store_names, song)
+                    await asyncio.wrap_future(conversion)
+                    paths = self.conversions.get_paths(paths[0])
+        except Exception as error:
+            self.videos[video_id].set_exception(error)
+            # Retrieved here so it isn't logged as never retrieved if no song awaits it
+            self.videos[video_id].exception()
+            # Songs resolved to the video later try it again rather than fail along with it
+            del self.videos[video_id]
+            raise
+        self.videos[video_id].set_result(paths)
+        return video, paths
+
+    def close(self) -> None:
+        """Waits for the conversions, stops the stages unless shared and closes the bars"""
+        if self.conversions:
+            self.conversions.wait_until_finished()
+        if self.own_stages:
+            self.stages.shutdown()
+        self.query_bar.close()
+        self.download_bar.close()
+
+    async def _search(self, song: str) -> YTVideo:
+        """Queries youtube (or the cache) for song in the search stage"""
+        queued = time.perf_counter()
+        try:
+            async with self.search_stage.slot():
+                self.metrics.record("search_queue", time.perf_counter() - queued, song)
+                with self.metrics.measure("search", song):
+                    return await self.search_stage.call(
+                        self.search_retry.call,
+                        lambda: YTVideo(song, cache=self.cache, extension=self.extension),
+                        self._count_retry(song))
+        finally:
+            self.query_bar.callback()
+
+    async def _download(self, song: str, video: YTVideo, folder: Path) -> Path:
+        """
+        Resolves the stream of video in the search stage, then downloads it into folder in the
+        download stage, unless it's in the store. If the stream was cached, the store is
+        checked first, so a stored song costs no request. Returns the path of the file.
+        """
+        stream_known = video.is_stream_known()
+        self.download_bar.add_song(song, video.get_filesize() if stream_known else None)
+        if stream_known:
+            path = await self._take_from_store(song, video, folder)
+            if path:
+                return path
+        stream = await self._resolve(song, video)
+        self.download_bar.set_filesize(song, stream.filesize)
+        if not stream_known:
+            path = await self._take_from_store(song, video, folder)
+            if path:
+                return path
+        path = self._get_path(video, folder)
+        store_name = self._get_store_name(video)
+        priority = -stream.filesize if self.schedule == "largest-first" else 0
+        queued = time.perf_counter()
+        async with self.download_stage.slot(priority):
+            self.metrics.record("download_queue", time.perf_counter() - queued, song)
+            with self.metrics.measure("download", song):
+                await self.download_stage.call(self._transfer, song, stream, path)
+        if self.store:
+            await self.download_stage.call(self.store.put, store_name, path)
+        return path
+
+    async def _resolve(self, song: str, video: YTVideo) -> Stream:
+        """Resolves the stream of video in the search stage, unless it already was"""
+        if video.is_stream_resolved():
+            return video.get_stream()
+        async with self.search_stage.slot(RESOLVE_PRIORITY):
+            with self.metrics.measure("resolve", song):
+                return await self.search_stage.call(self.search_retry.call, video.get_stream,
+                                                    self._count_retry(song))
+
+    async def _take_conversions_from_store(self, song: str, video: YTVideo,
+                                           folder: Path) -> Optional[list[Path]]:
+        """
+        Places the stored conversions of video to every format in folder, so its stream isn't
+        downloaded; returns their paths, None unless all of them are stored. The stream is
+        resolved first if it wasn't cached, since the conversions are stored by its itag.
+        """
+        if not self.conversions or not self.store or not self.conversions.delete_originals:
+            return None
+        if not video.is_stream_known():
+            await self._resolve(song, video)
+        path = self._get_path(video, folder)
+        if not await self.search_stage.call(self.conversions.take_stored, path,
+                                            self._get_conversion_store_names(video), song):
+            return None
+        return self.conversions.get_paths(path)
+
+    async def _take_from_store(self, song: str, video: YTVideo, folder: Path) -> Optional[Path]:
+        """Places the stored stream of video in folder; returns its path, None if not stored"""
+        if not self.store:
+            return None
+        path = self._get_path(video, folder)
+        if not await self.search_stage.call(self.store.materialize,
+                                            self._get_store_name(video), path):
+            return None
+        self.metrics.count("store_hits", song=song)
+        self.download_bar.callback(song, b"", 0)
+        return path
+
+    def _transfer(self, song: str, stream, path: Path) -> None:
+        """Downloads stream into path, in segments if it's big; blocks until it's done"""
+        transferred = [0]
+
+        def on_chunk(chunk: bytes, remaining_bytes: int) -> None:
+            transferred[0] += len(chunk)
+            self.download_bar.callback(song, chunk, remaining_bytes)
+
+        if self.segments > 1 and stream.filesize > self.segment_threshold:
+            retried = download_segmented(stream.url, path, stream.filesize, self.segments,
+                                         on_chunk, self.retries, limiter=self.limiter,
+                                         retry=self.download_retry)
+        else:
+            retried = download_resumable(stream.url, path, stream.filesize, on_chunk,
+                                         self.retries, limiter=self.limiter,
+                                         retry=self.download_retry)
+        self.metrics.count("bytes", transferred[0], song)
+        self.metrics.count("retries", retried, song)
+
+    def _count_retry(self, song: str) -> Callable[[Exception], None]:
+        """Returns the callback counting the retried searches of song in the metrics"""
+        return lambda error: self.metrics.count("search_retries", song=song)
+
+    @staticmethod
+    def _get_path(video: YTVideo, folder: Path) -> Path:
+        """Returns the path the stream of video is downloaded into, in folder"""
+        return Path(folder, f"{video.vid.title}.{video.get_format()}")
+
+    def _get_conversion_store_names(self, video: YTVideo) -> dict[str, str]:
+        """Returns the names of the conversions of video in the store, by format"""
+        return {extension: self._get_store_name(video, extension)
+                for extension in self.conversions.new_extensions}
+
+    @staticmethod
+    def _get_store_name(video: YTVideo, extension: Optional[str] = None) -> str:
+        """Returns the name of the stream of video in the store; see Downloader.get_store_name"""
+        return object_name(video.get_video_id(), video.get_itag(),
+                           extension if extension else video.get_format(),
+                           converted=extension is not None)
+
+
+async def download_playlist(urls: list[str], path: Path,
+                            appended_songs: Optional[list[str]] = None,
+                            artist: Optional[str] = None, extension: Optional[str] = None,
+                            keep_originals: bool = False, jobs: int = DEFAULT_JOBS,
+                            search_jobs: int = DEFAULT_SEARCH_JOBS,
+                            convert_jobs: Optional[int] = None, cache=None, sync: bool = False,
+                            prune: bool = False, segments: int = DEFAULT_SEGMENTS,
+                            segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD, store=None,
+                            metrics: Optional[Metrics] = None,
+                            schedule: str = DEFAULT_SCHEDULE, limiter=None,
+                            retries: int = DEFAULT_ATTEMPTS,
+                            stages: Optional[Stages] = None) -> dict[str, Exception]:
+    """
+    Downloads the songs of every playlist in urls. With a single url, the songs are saved in
+    path; with several, each playlist is saved in a subfolder of path named after its id.
+    Appended songs are saved in path. A song found in several playlists is downloaded (and
+    converted) once, then hardlinked into the other folders.
+    Playlists are scraped concurrently, and every song runs through the stages of a
+    SongPipeline as a coroutine, started as soon as its page arrives (with sync, once every
+    playlist has been compared with its manifest); blocking calls are made in the threads of
+    each stage, and conversions in a pool of processes, so the event loop is never blocked.
+    A song that fails doesn't stop the rest: the failed songs are printed at the end and
+    returned, by searchstring, along with their error. They're left out of the manifests, so
+    a later sync retries them. A playlist that can't be scraped doesn't stop the rest either:
+    it's printed and returned the same way, by url.
+        Parameters:
+            urls (list[str]): urls of Spotify's playlists
+            path (Path): folder to download the songs into. If it doesn't exist it's created.
+            appended_songs (list[str]): searchstrings to be downloaded besides the playlists
+            artist (str): if not None, only songs by an artist including it are downloaded
+            extension (str): format of the output audios, or several separated by commas (e.g.
+                "mp3,ogg") to save each song in all of them; None to keep youtube's format
+            keep_originals (bool): if True, original files are kept after a change of format
+            jobs (int): maximum number of songs being downloaded at the same time
+            search_jobs (int): maximum number of youtube queries running at the same time
+            convert_jobs (int): number of processes converting files; None for one per CPU
+            cache (SearchCache): persistent cache of searches and streams; None disables it
+            sync (bool): if True, only the songs missing from each folder's manifest are
+                downloaded, and the manifests are updated afterwards
+            prune (bool): if True (along with sync), songs no longer in a playlist are deleted
+            segments (int): number of parallel connections used for each big stream
+            segment_threshold (int): size in bytes above which streams are segmented
+            store (AudioStore): store of audios shared across runs, checked before downloading
+                or converting each song; None disables it
+            metrics (Metrics): where the time spent in each stage of the run is recorded
+            schedule (str): order of the downloads, one of SCHEDULES. With "largest-first",
+                each free download slot goes to the biggest stream among those already
+                resolved, so songs whose size isn't known yet are fitted in as it becomes known
+            limiter (RateLimiter): bandwidth limit shared by every download; None for no limit
+            retries (int): attempts of each request before its song is given up
+            stages (Stages): stages shared with other runs, left running afterwards; None to
+                make them for this run from jobs, search_jobs, segments, retries and
+                convert_jobs
+    """
+    metrics = metrics if metrics else Metrics()
+
+    def make_pipeline(total: int) -> SongPipeline:
+        return SongPipeline(total, jobs=jobs, search_jobs=search_jobs, extension=extension,
+                            keep_originals=keep_originals, convert_jobs=convert_jobs,
+                            cache=cache, segments=segments,
+                            segment_threshold=segment_threshold, store=store, metrics=metrics,
+                            schedule=schedule, limiter=limiter, retries=retries, stages=stages)
+
+    results = []
+    if sync:
+        # Every playlist is needed before downloading, to be compared with its manifest
+        batch, manifests, failed_playlists = await plan_downloads(
+            urls, path, appended_songs, artist, extension, cache, sync, prune, metrics, stages)
+        songs = batch.get_songs()
+        if songs:
+            pipeline = make_pipeline(len(songs))
+            try:
+                results = await asyncio.gather(
+                    *(pipeline.process(song, batch.get_targets(song)[0][0]) for song in songs),
+                    return_exceptions=True)
+            finally:
+                await asyncio.to_thread(pipeline.close)
+    else:
+        manifests = {}
+        pipeline = make_pipeline(0)
+        try:
+            batch, results, failed_playlists = await stream_downloads(
+                pipeline, urls, path, appended_songs, artist, cache, metrics, stages)
+        finally:
+            await asyncio.to_thread(pipeline.close)
+
+    # Linking, hashing and writing files; kept off the loop so a daemon keeps answering
+    failed = await asyncio.to_thread(place_songs, batch, results, manifests, metrics)
+    print_failed(failed_playlists, "playlists")
+    print_failed(failed)
+    return {**failed_playlists, **failed}
+
+
+async def plan_downloads(urls: list[str], path: Path, appended_songs: Optional[list[str]] = None,
+                         artist: Optional[str] = None, extension: Optional[str] = None,
+                         cache=None, sync: bool = False, prune: bool = False,
+                         metrics: Optional[Metrics] = None,
+                         stages: Optional[Stages] = None
+                         ) -> tuple[PlaylistBatch, dict, dict[str, Exception]]:
+    """
+    Scrapes the playlists of urls concurrently and groups their songs, along with
+    appended_songs, by destination folder, creating the folders. Returns a PlaylistBatch of
+    the songs to download, with sync the Manifest of each destination (songs already in
+    their manifest are left out of the batch) and the playlists that couldn't be scraped, by
+    url, along with their error. See download_playlist for the parameters.
+    """
+    metrics = metrics if metrics else Metrics()
+    playlists = await scrape_playlists(urls, artist, metrics, stages,
+                                       lambda url, scrapper: scrapper.get_searchstring())
+    destinations = {}
+    failed = {}
+    for url, searchstrings in zip(urls, playlists):
+        destination = get_destination(path, url, urls)
+        if isinstance(searchstrings, Exception):
+            failed[url] = searchstrings
+            destinations.setdefault(destination, [])
+            continue
+        destinations.setdefault(destination, []).extend(searchstrings)
+    if appended_songs:
+        destinations.setdefault(path, []).extend(appended_songs)
+    # A destination missing a playlist would lose all of its songs if pruned
+    incomplete = {get_destination(path, url, urls) for url in failed}
+    batch, manifests = await asyncio.to_thread(make_batch, destinations, extension, cache, sync,
+                                               prune, incomplete)
+    return batch, manifests, failed
+
+
+async def stream_downloads(pipeline: SongPipeline, urls: list[str], path: Path,
+                           appended_songs: Optional[list[str]] = None,
+                           artist: Optional[str] = None, cache=None,
+                           metrics: Optional[Metrics] = None,
+                           stages: Optional[Stages] = None
+                           ) -> tuple[PlaylistBatch, list, dict[str, Exception]]:
+    """
+    Scrapes the playlists of urls concurrently, sending each of their songs, and
+    appended_songs, through pipeline as soon as its page arrives, instead of waiting for every
+    playlist like plan_downloads. A song found again is only added to the targets of the
+    first one. Returns the PlaylistBatch of the songs, the results of processing them (their
+    video and files, or their error), in the order of its get_songs, and the playlists that
+    couldn't be scraped, by url, along with their error; songs found before the error are
+    still processed. See download_playlist for the parameters.
+    """
+    metrics = metrics if metrics else Metrics()
+    loop = asyncio.get_running_loop()
+    batch = PlaylistBatch(cache)
+    lock = threading.Lock()
+    folders = set()
+    tasks = []
+
+    def start(song: str, destination: Path) -> None:
+        pipeline.query_bar.add(1)
+        tasks.append(asyncio.ensure_future(pipeline.process(song, destination)))
+
+    def add(searchstrings: list[str], destination: Path) -> None:
+        """Adds searchstrings to the batch, starting the new songs; called from threads"""
+        with lock:
+            if destination not in folders:
+                destination.mkdir(parents=True, exist_ok=True)
+                folders.add(destination)
+            for song in batch.add(searchstrings, destination):
+                loop.call_soon_threadsafe(start, song, destination)
+
+    def read(url: str, scrapper: Scrapper) -> None:
+        destination = get_destination(path, url, urls)
+        for searchstring in scrapper.iter_searchstring():
+            add([searchstring], destination)
+
+    try:
+        if appended_songs:
+            await asyncio.to_thread(add, appended_songs, path)
+        scraped = await scrape_playlists(urls, artist, metrics, stages, read)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        # Songs are started before the scrape that found them returns
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    return batch, results, {url: error for url, error in zip(urls, scraped)
+                            if isinstance(error, Exception)}
+
+
+async def scrape_playlists(urls: list[str], artist: Optional[str], metrics: Metrics,
+                           stages: Optional[Stages],
+                           read: Callable[[str, Scrapper], T]) -> list[Union[T, Exception]]:
+    """
+    Scrapes the playlists of urls concurrently in the scrape stage of stages, or in one of
+    its own, returning what read(url, scrapper) returns for each of them, or the error its
+    playlist failed with (a bad url, a page that couldn't be fetched, an artist with no
+    matches...), which doesn't stop the rest. read is called in a thread of the stage, so it
+    can wait for the pages of the playlist.
+    """
+    if stages:
+        scrape_stage, connections, pages = stages.scrape, stages.connections, stages.pages
+    else:
+        scrape_stage = Stage("scrape", min(len(urls), DEFAULT_SCRAPE_JOBS) or 1)
+        connections, pages = None, None
+
+    async def scrape(url: str) -> T:
+        async with scrape_stage.slot():
+            with metrics.measure("scrape"):
+                try:
+                    return await scrape_stage.call(
+                        lambda: read(url, Scrapper(url, artist, connections=connections,
+                                                   pages=pages)))
+                except Exception:
+                    metrics.count("playlist_failures")
+                    raise
+
+    try:
+        return await asyncio.gather(*(scrape(url) for url in urls), return_exceptions=True)
+    finally:
+        if not stages:
+            scrape_stage.shutdown()
+
+
+def get_destination(path: Path, url: str, urls: list[str]) -> Path:
+    """Returns the folder the playlist at url is saved in: path, or its subfolder if several"""
+    return Path(path, playlist_folder_name(url)) if len(urls) > 1 else path
+
+
+def make_batch(destinations: dict[Path, list[str]], extension: Optional[str] = None,
+               cache=None, sync: bool = False, prune: bool = False,
+               incomplete: Optional[set[Path]] = None) -> tuple[PlaylistBatch, dict]:
+    """
+    Returns a PlaylistBatch of the searchstrings of each destination folder and their
+    manifests, creating the folders; see plan_downloads. Destinations in incomplete, missing
+    some of their songs, aren't pruned. Reads and writes files, so it's called from a thread.
+    """
+    manifests = {}
+    batch = PlaylistBatch(cache)
+    for destination, searchstrings in destinations.items():
+        if sync:
+            manifests[destination] = Manifest(destination)
+            if prune and destination not in (incomplete or set()):
+                manifests[destination].prune(searchstrings)
+            searchstrings = manifests[destination].get_missing(searchstrings, extension)
+        batch.add(searchstrings, destination)
+    songs = batch.get_songs()
+    for destination, _ in {target for song in songs for target in batch.get_targets(song)}:
+        destination.mkdir(parents=True, exist_ok=True)
+    return batch, manifests
+
+
+def place_song(song_paths: list[Path], targets: list[tuple[Path, str]], video_id: str,
+               manifests: dict[Path, Manifest]) -> None:
+    """
+    Links the files of a song into the folder of each of its targets (destination and
+    searchstring; see PlaylistBatch.get_targets), recording them in the destination's manifest
+    if there's one in manifests.
+    """
+    for destination, searchstring in targets:
+        target_paths = [Path(destination, song_path.name) for song_path in song_paths]
+        for song_path, target_path in zip(song_paths, target_paths):
+            link_or_copy(song_path, target_path)
+        if destination in manifests:
+            manifests[destination].add(searchstring, video_id, *target_paths)
+
+
+def place_songs(batch: PlaylistBatch, results: list, manifests: dict[Path, Manifest],
+                metrics: Metrics) -> dict[str, Exception]:
+    """
+    Places the files of each song of batch into its targets, given the results of processing
+    them (their video and files, or the error they failed with), then saves the manifests.
+    Returns the songs that failed, along with their errors.
+    """
+    failed = {}
+    for song, result in zip(batch.get_songs(), results):
+        if isinstance(result, BaseException):
+            failed[song] = result
+            metrics.count("failures", song=song)
+            continue
+        video, song_paths = result
+        # Songs resolved to a video already being downloaded point to its files
+        place_song(song_paths, batch.get_targets(song), video.get_video_id(), manifests)
+    for manifest in manifests.values():
+        manifest.save()
+    return failed
+
+
+def print_failed(failed: dict[str, Exception], kind: str = "songs") -> None:
+    """Prints the songs (or the kind of items) that failed, if any, along with their errors"""
+    if failed:
+        print(f"{len(failed)} {kind} failed:")
+    for name, error in failed.items():
+        print(f"  {name}: {error}")
+
+
+def check_schedule(schedule: str) -> None:
+    """Checks schedule is one of the supported SCHEDULES"""
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Schedule '{schedule}' is not one of {', '.join(SCHEDULES)}.")
@@ -0,0 +1,45 @@
+"""Module for placing a file in several folders without storing its content twice."""
+import os
+import shutil
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# ioctl request cloning a file's extents (reflink) on Linux filesystems like btrfs or xfs
+FICLONE = 0x40049409
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """
+    Makes destination have the content of source: through a hardlink if possible, otherwise a
+    reflink (copy on write), and as a last resort a plain copy. An existing destination is
+    replaced, unless it's already the same file.
+    """
+    if destination.exists():
+        if os.path.samefile(source, destination):
+            return
+        destination.unlink()
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, destination)
+        return
+    except OSError:
+        pass
+    if not reflink(source, destination):
+        shutil.copy2(source, destination)
+
+
+def reflink(source: Path, destination: Path) -> bool:
+    """Clones source into destination sharing its blocks. Returns False if not supported"""
+    if fcntl is None:
+        return False
+    try:
+        with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        return True
+    except OSError:
+        destination.unlink(missing_ok=True)
+        return False
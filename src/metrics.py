@@ -0,0 +1,124 @@
+"""Module for the timings and counters recorded along a run, exportable as JSON or Prometheus."""
+import json
+import time
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+PROMETHEUS_PREFIX = "playlist_downloader"
+PROMETHEUS_SUFFIXES = (".prom", ".txt")
+# Upper bounds, in seconds, of the buckets of the stage histograms
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class StageStats:
+    """Aggregated durations of a stage: count, sum, maximum and histogram buckets"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds: float) -> None:
+        """Adds a duration to the aggregates"""
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self) -> dict:
+        """Returns the aggregates as a dict"""
+        return {"count": self.count,
+                "total_seconds": round(self.total, 6),
+                "mean_seconds": round(self.total / self.count, 6) if self.count else 0,
+                "max_seconds": round(self.maximum, 6)}
+
+
+class Metrics:
+    """
+    Durations of the stages of a run (scraping, searching, resolving streams, queue waits,
+    downloading, converting...) and counters (bytes, retries...), both overall and per song.
+    Recording is a couple of dict updates under a lock, cheap enough to be always on. Safe to
+    use from many threads.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.songs = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, song: Optional[str] = None) -> None:
+        """Records that stage took seconds, for song if provided"""
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).add(seconds)
+            if song is not None:
+                song_stages = self._get_song(song)["stages"]
+                song_stages[stage] = song_stages.get(stage, 0) + seconds
+
+    def count(self, counter: str, value: int = 1, song: Optional[str] = None) -> None:
+        """Adds value to counter, for song if provided"""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+            if song is not None:
+                song_counters = self._get_song(song)["counters"]
+                song_counters[counter] = song_counters.get(counter, 0) + value
+
+    @contextmanager
+    def measure(self, stage: str, song: Optional[str] = None) -> Iterator[None]:
+        """Records the time spent inside the with block as stage; see record"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, song)
+
+    def to_dict(self) -> dict:
+        """Returns the report of the run: its duration, stages, counters and songs"""
+        with self._lock:
+            return {"elapsed_seconds": round(time.perf_counter() - self.start, 6),
+                    "stages": {stage: stats.to_dict() for stage, stats in self.stages.items()},
+                    "counters": dict(self.counters),
+                    "songs": {song: {"stages": {stage: round(seconds, 6)
+                                                for stage, seconds in data["stages"].items()},
+                                     "counters": dict(data["counters"])}
+                              for song, data in self.songs.items()}}
+
+    def to_prometheus(self) -> str:
+        """Returns the stages and counters in Prometheus' text exposition format"""
+        name = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each stage of the run.",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, stats in self.stages.items():
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, stats.buckets):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {stats.count}')
+            for counter, value in self.counters.items():
+                counter_name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+                lines += [f"# TYPE {counter_name} counter", f"{counter_name} {value}"]
+            elapsed = time.perf_counter() - self.start
+        lines += [f"# TYPE {PROMETHEUS_PREFIX}_elapsed_seconds gauge",
+                  f"{PROMETHEUS_PREFIX}_elapsed_seconds {elapsed:.6f}"]
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: Path) -> None:
+        """Writes the report to path: Prometheus' format if it ends in .prom or .txt, else JSON"""
+        if path.suffix in PROMETHEUS_SUFFIXES:
+            path.write_text(self.to_prometheus(), encoding="utf-8")
+        else:
+            path.write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+
+    def _get_song(self, song: str) -> dict:
+        """Returns the metrics of song, creating them if missing. The lock must be held"""
+        return self.songs.setdefault(song, {"stages": {}, "counters": {}})
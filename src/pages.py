@@ -0,0 +1,173 @@
+"""Module for fetching every page of a playlist over pooled keep-alive connections."""
+import json
+import codecs
+import threading
+import http.client
+from typing import Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from .parsing import PlaylistPageParser, find_tracks
+from .workers import WorkerPool
+
+DEFAULT_PAGE_JOBS = 4
+PAGE_CHUNK_SIZE = 64 * 1024
+DEFAULT_TIMEOUT = 30
+REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+
+class ConnectionPool:
+    """
+    Keep-alive http(s) connections, one per thread and host, reused across requests. A broken
+    connection is reopened once before giving up.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def request(self, url: str, headers: Optional[dict] = None) -> http.client.HTTPResponse:
+        """Sends a GET request for url. The response must be read completely before the next"""
+        parts = urlsplit(url)
+        path = urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        headers = dict(REQUEST_HEADERS, **(headers or {}))
+        for attempt in range(2):
+            connection = self._get_connection(parts.scheme, parts.netloc, renew=attempt > 0)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                if attempt:
+                    raise
+                continue
+            if response.status >= 400:
+                response.read()
+                raise http.client.HTTPException(f"Request to {url} failed ({response.status}).")
+            return response
+        raise http.client.HTTPException(f"Request to {url} failed.")
+
+    def close(self) -> None:
+        """Closes every connection opened by the pool"""
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def _get_connection(self, scheme: str, host: str,
+                        renew: bool = False) -> http.client.HTTPConnection:
+        """Returns this thread's connection to host, opening it if missing or renew is True"""
+        connections = self._local.__dict__.setdefault("connections", {})
+        connection = connections.get((scheme, host))
+        if connection and renew:
+            connection.close()
+            connection = None
+        if not connection:
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            connections[(scheme, host)] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+
+class PlaylistFetcher:
+    """
+    Fetches the first page of a playlist and, if the playlist doesn't fit in it, its remaining
+    pages concurrently. Iterating over the fetcher yields the tracks in playlist order, each page
+    as soon as it (and those before it) have arrived.
+    """
+
+    def __init__(self, url: str, jobs: int = DEFAULT_PAGE_JOBS,
+                 connections: Optional[ConnectionPool] = None,
+                 pages: Optional[WorkerPool] = None) -> None:
+        """
+        Fetches and parses the first page, then queues the fetch of the rest.
+            Parameters:
+                url (str): url of the playlist's page
+                jobs (int): maximum number of pages being fetched at the same time
+                connections (ConnectionPool): pool shared with other fetchers, left open when
+                    this one is closed. None to open a pool for this fetcher.
+                pages (WorkerPool): page workers shared with other fetchers, left running when
+                    this one is closed, so their connections are reused; jobs is ignored then.
+                    None to start workers for this fetcher.
+        """
+        self.url = url
+        self._own_connections = connections is None
+        self._own_pool = pages is None
+        self.connections = connections if connections else ConnectionPool()
+        parser = PlaylistPageParser()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        html_chunks = []
+        response = self.connections.request(url)
+        for raw_chunk in iter(lambda: response.read(PAGE_CHUNK_SIZE), b""):
+            html_chunks.append(raw_chunk)
+            parser.feed(decoder.decode(raw_chunk))
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+
+        self.first_page = b"".join(html_chunks)
+        self.first_tracks = parser.get_tracks()
+        token = parser.get_access_token()
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.page_urls = get_page_urls(url, parser.get_pagination(), len(self.first_tracks))
+
+        self._pages = [None] * len(self.page_urls)
+        self._pool = pages if pages else WorkerPool(jobs, name="page")
+        self._jobs = [self._pool.submit(lambda i=i: self._fetch_page(i))
+                      for i in range(len(self.page_urls))]
+
+    def __iter__(self) -> Iterator[dict]:
+        """Yields the tracks in order, waiting for each page to arrive"""
+        try:
+            yield from self.first_tracks
+            for i, job in enumerate(self._jobs):
+                job.join()
+                if job.error:
+                    raise job.error
+                yield from self._pages[i]
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stops the page workers and closes their connections, unless they're shared"""
+        if self._own_pool:
+            self._pool.shutdown()
+        if self._own_connections:
+            self.connections.close()
+
+    def _fetch_page(self, index: int) -> None:
+        """Fetches and parses the page at index, either a json document or an html page"""
+        response = self.connections.request(self.page_urls[index], self.headers)
+        body = response.read().decode("utf-8")
+        if "json" in response.getheader("Content-Type", ""):
+            self._pages[index] = list(find_tracks(json.loads(body)))
+        else:
+            parser = PlaylistPageParser()
+            parser.feed(body)
+            parser.close()
+            self._pages[index] = parser.get_tracks()
+
+
+def get_page_urls(url: str, pagination: Optional[dict], fetched: int) -> list[str]:
+    """
+    Returns the urls of the pages following the first one, according to its pagination. They're
+    derived from the 'next' url if there's one, otherwise from the playlist's url, by setting
+    the offset and limit of each page in their query.
+    """
+    if not pagination or not fetched:
+        return []
+    offset = (pagination["offset"] or 0) + fetched
+    limit = pagination["limit"] or fetched
+    base_url = pagination["next"] or url
+    return [with_query(base_url, offset=page_offset, limit=limit)
+            for page_offset in range(offset, pagination["total"], limit)]
+
+
+def with_query(url: str, **parameters) -> str:
+    """Returns url with parameters set in its query, replacing those already there"""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({key: str(value) for key, value in parameters.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
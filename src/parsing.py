@@ -0,0 +1,168 @@
+"""Module for extracting the tracks of a Spotify's playlist page from its embedded data."""
+import json
+import base64
+import binascii
+from html.parser import HTMLParser
+from typing import Iterator, Optional
+from urllib.parse import unquote
+
+# Scripts whose content may hold the playlist's data
+DATA_SCRIPT_TYPES = ("application/json", "application/ld+json", "text/plain")
+DATA_SCRIPT_IDS = ("resource", "initial-state", "__NEXT_DATA__")
+
+
+class PlaylistPageParser(HTMLParser):
+    """
+    Incremental parser of a playlist page. Only the content of the scripts carrying structured
+    data is kept; the rest of the html is tokenized and discarded, so no DOM is ever built.
+    Pages can be fed in chunks as they arrive through feed().
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self._script_parts = None
+        self.documents = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        """Starts buffering a script if it may contain the playlist's data"""
+        if tag != "script":
+            return
+        attributes = dict(attrs)
+        if attributes.get("type") in DATA_SCRIPT_TYPES or attributes.get("id") in DATA_SCRIPT_IDS:
+            self._script_parts = []
+
+    def handle_data(self, data: str) -> None:
+        """Buffers the content of the current data script"""
+        if self._script_parts is not None:
+            self._script_parts.append(data)
+
+    def handle_endtag(self, tag: str) -> None:
+        """Decodes the buffered script, if any"""
+        if tag != "script" or self._script_parts is None:
+            return
+        document = decode_document("".join(self._script_parts).strip())
+        if document is not None:
+            self.documents.append(document)
+        self._script_parts = None
+
+    def get_tracks(self) -> list[dict]:
+        """
+        Returns the tracks as dicts with 'title' and 'artist' keys, in playlist order. If several
+        scripts describe the playlist, the one with most tracks is used.
+        """
+        return list(find_tracks(self._main_document()))
+
+    def get_pagination(self) -> Optional[dict]:
+        """Returns the pagination of the tracks in the page; see find_pagination"""
+        return find_pagination(self._main_document())
+
+    def get_access_token(self) -> Optional[str]:
+        """Returns the access token embedded in the page, needed to request further pages"""
+        for document in self.documents:
+            token = find_value(document, "accessToken")
+            if isinstance(token, str):
+                return token
+        return None
+
+    def _main_document(self):
+        """Returns the decoded script with most tracks, or None if there's no script"""
+        return max(self.documents, key=lambda document: len(list(find_tracks(document))),
+                   default=None)
+
+
+def parse_playlist_page(html: str) -> list[dict]:
+    """Returns the tracks found in the structured data of html; see PlaylistPageParser"""
+    parser = PlaylistPageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.get_tracks()
+
+
+def decode_document(text: str):
+    """Decodes the content of a data script: plain, base64 or url-encoded json. None if none"""
+    if not text:
+        return None
+    decoders = (lambda raw: raw,
+                lambda raw: base64.b64decode(raw, validate=True).decode("utf-8"),
+                unquote)
+    for decoder in decoders:
+        try:
+            return json.loads(decoder(text))
+        except (ValueError, binascii.Error):
+            continue
+    return None
+
+
+def find_tracks(document) -> Iterator[dict]:
+    """Walks the json document in order, yielding every track record found"""
+    if isinstance(document, list):
+        for element in document:
+            yield from find_tracks(element)
+        return
+    if not isinstance(document, dict):
+        return
+    track = as_track(document)
+    if track:
+        yield track
+        return
+    for value in document.values():
+        yield from find_tracks(value)
+
+
+def find_pagination(document) -> Optional[dict]:
+    """
+    Returns the 'total', 'limit', 'offset' and 'next' (url, if any) of the first list of items
+    with a known total count found in document, or None if there's none.
+    """
+    if isinstance(document, list):
+        for element in document:
+            pagination = find_pagination(element)
+            if pagination:
+                return pagination
+        return None
+    if not isinstance(document, dict):
+        return None
+    total = document.get("total", document.get("totalCount"))
+    if isinstance(document.get("items"), list) and isinstance(total, int):
+        paging_info = document.get("pagingInfo", {})
+        return {"total": total,
+                "limit": document.get("limit", paging_info.get("limit")),
+                "offset": document.get("offset", paging_info.get("offset", 0)),
+                "next": document.get("next")}
+    return find_pagination(list(document.values()))
+
+
+def find_value(document, key: str):
+    """Returns the first value found under key in document, or None"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        document = list(document.values())
+    if isinstance(document, list):
+        for element in document:
+            value = find_value(element, key)
+            if value is not None:
+                return value
+    return None
+
+
+def as_track(record: dict) -> Optional[dict]:
+    """
+    Returns the title and artist of record if it describes a track, None otherwise. Supported
+    shapes are Spotify's web api tracks, its graphql tracks and schema.org's MusicRecording.
+    """
+    if record.get("@type") == "MusicRecording":
+        artists = record.get("byArtist", [])
+        artists = artists if isinstance(artists, list) else [artists]
+    elif record.get("type", "track") == "track" and record.get("__typename", "Track") == "Track":
+        artists = record.get("artists", [])
+        if isinstance(artists, dict):
+            artists = [item.get("profile", item) for item in artists.get("items", [])]
+    else:
+        return None
+    if not isinstance(record.get("name"), str) or not isinstance(artists, list) or not artists:
+        return None
+    artist_names = [artist.get("name") for artist in artists if isinstance(artist, dict)]
+    if not artist_names or not all(isinstance(name, str) for name in artist_names):
+        return None
+    return {"title": record["name"], "artist": ", ".join(artist_names)}
@@ -1,4 +1,6 @@
 """Module for progress bars' interfaces, and smaller classes they depend on."""
+import threading
+from typing import Hashable, Optional
 from pytube.streams import Stream
 from tqdm import tqdm
 
@@ -22,26 +24,59 @@ class QueryProgressBar:
         """Increases the bar by one"""
         self.query_bar.update(1)
 
+    def add(self, queries: int) -> None:
+        """Increases the total number of queries"""
+        self.query_bar.total += queries
+        self.query_bar.refresh()
+
     def reset(self) -> None:
         """Resets query_bar"""
         self.query_bar.reset()
 
+    def close(self) -> None:
+        """Closes query_bar"""
+        self.query_bar.close()
+
+
+class ConversionProgressBar:
+    """ConversionProgressBar displays how many audio files have been converted."""
+
+    def __init__(self, conversion_size: Optional[int]) -> None:
+        """
+        Initializes the bar
+            Parameters:
+                conversion_size (int): number of files to convert; None if unknown
+        """
+        bar_format = "Converting:  |{bar}| {n_fmt}/{total_fmt}"
+        self.conversion_bar = tqdm(total=conversion_size, bar_format=bar_format)
+
+    def callback(self) -> None:
+        """Increases the bar by one"""
+        self.conversion_bar.update(1)
+
+    def close(self) -> None:
+        """Closes conversion_bar"""
+        self.conversion_bar.close()
+
 
 class StreamTracker:
     """Tracks individual streams, providing information about their status"""
 
-    def __init__(self, stream: Stream) -> None:
+    def __init__(self, filesize: Optional[int] = None) -> None:
         """
         Saves the size of the stream and sets the downloaded bytes to 0
             Parameters:
-                stream (pytube's stream): Stream to be tracked.
+                filesize (int): size in bytes of the stream to be tracked; None if it isn't
+                    known yet.
         """
-        self.filesize = stream.filesize
+        self.filesize = filesize
         self.downloaded_bytes = 0
         self.last_chunk_size = 0
 
     def downloaded_percentage(self) -> int:
-        """Percentage of the stream that has been downloaded"""
+        """Percentage of the stream that has been downloaded; 0 while its size is unknown"""
+        if not self.filesize:
+            return 0
         return 100 * self.downloaded_bytes // self.filesize
 
     def update_downloaded_bytes(self, remaining_bytes: int) -> None:
@@ -52,57 +87,136 @@ class StreamTracker:
 
     def is_finished(self) -> None:
         """Checks if the stream has finished downloading"""
-        return self.filesize == self.downloaded_bytes
+        return self.filesize is not None and self.filesize == self.downloaded_bytes
 
 
 class DownloadProgressBar:
     """
     ProgressBar manages information from pytube's streams and videos to show
     and update a progress bar.
+    Songs can be tracked as soon as they're found, before the size of their stream is known:
+    the bar counts them, and grows its total as their sizes are set (see add_song and
+    set_filesize). Each song is tracked under a key, which is the stream itself when tracked
+    through add_stream.
+    Callbacks from the download threads only update counters, under a lock; the bar itself is
+    rendered from a separate timer thread, every refresh_interval seconds.
     """
 
-    def __init__(self, stream_list: list[Stream]) -> None:
+    REFRESH_INTERVAL = 0.1
+
+    def __init__(self, stream_list: list[Stream],
+                 refresh_interval: float = REFRESH_INTERVAL) -> None:
         """
-        Creates a StreamTracker for every stream provided, and starts a tqdm progress bar
+        Creates a StreamTracker for every stream provided, and starts a tqdm progress bar along
+        with the thread rendering it. More streams can be tracked later on through add_stream.
             Parameters:
                 stream_list (list): List containing the (pytube) streams to be tracked.
+                refresh_interval (float): seconds between renders of the bar.
         """
-        self.stream_trackers = {stream: StreamTracker(
-            stream) for stream in stream_list}
-        self.is_finished = {stream: False for stream in stream_list}
+        self._lock = threading.Lock()
+        self.stream_trackers = {}
+        self.finished_streams = set()
+        self.total_bytes = 0
+        self.downloaded_bytes = 0
+        self.unknown_sizes = 0
 
-        stream_sizes = [
-            tracker.filesize for tracker in self.stream_trackers.values()]
         bar_format = "Downloading: |{bar}| {desc}: {percentage:3.0f}%"
-        self.download_bar = tqdm(
-            total=sum(stream_sizes), bar_format=bar_format)
+        self.download_bar = tqdm(total=0, bar_format=bar_format)
+        for stream in stream_list:
+            self.add_stream(stream)
 
-        self.downloaded_bytes = 0
+        self.refresh_interval = refresh_interval
+        self._closed = threading.Event()
+        self._renderer = threading.Thread(target=self._render_loop, name="progressbar",
+                                          daemon=True)
+        self._renderer.start()
+
+    def add_stream(self, stream: Stream) -> None:
+        """Starts tracking stream, adding its size to the total of the bar"""
+        self.add_song(stream, stream.filesize)
 
-    def callback(self, stream: Stream, chunk: bytes, remaining_bytes: int) -> None:
+    def add_song(self, song: Hashable, filesize: Optional[int] = None) -> None:
+        """
+        Starts tracking the song under the key song. Its size is added to the total of the bar
+        if known; otherwise, once set through set_filesize.
         """
-        Callback method for the pytube stream.download() method.
+        with self._lock:
+            self.stream_trackers[song] = StreamTracker(filesize)
+            if filesize is None:
+                self.unknown_sizes += 1
+            else:
+                self.total_bytes += filesize
+
+    def set_filesize(self, song: Hashable, filesize: int) -> None:
+        """
+        Sets (or corrects) the size of the stream of a tracked song, updating the total of the
+        bar. Must be called before the first callback of song.
+        """
+        with self._lock:
+            tracker = self.stream_trackers[song]
+            if tracker.filesize is None:
+                self.unknown_sizes -= 1
+            self.total_bytes += filesize - (tracker.filesize or 0)
+            tracker.filesize = filesize
+
+    def callback(self, song: Hashable, chunk: bytes, remaining_bytes: int) -> None:
+        """
+        Callback method for the stream downloads.
         Recieves information from a particular stream, transmits the information to the relevant
-        StreamTracker and updates the status of ProgressBar.
+        StreamTracker and updates the counters of ProgressBar. Safe to call from many threads.
             Parameters:
-                stream (pytube stream): the stream whose download sent the callback
+                song (hashable): key of the song whose download sent the callback, such as
+                    its pytube stream
                 chunk (bytes): the chunk of bytes that has just been downloaded (unused)
                 remaining_bytes (int): the amount of bytes that haven't been downloaded
                     yet, in the stream from the argument
         """
         del chunk
-        print("called")
-        tracker = self.stream_trackers.get(stream)
-        tracker.update_downloaded_bytes(remaining_bytes)
-        self.update(stream, tracker)
-
-    def update(self, stream: Stream, tracker: StreamTracker) -> None:
-        """Updates the bar by the tracker's last chunk, checking if it has finished"""
-        self.download_bar.update(tracker.last_chunk_size)
-        self.is_finished[stream] = tracker.is_finished()
-        if all(self.is_finished):
-            self.download_bar.close()
+        with self._lock:
+            tracker = self.stream_trackers[song]
+            tracker.update_downloaded_bytes(remaining_bytes)
+            self.downloaded_bytes += tracker.last_chunk_size
+            if tracker.is_finished():
+                self.finished_streams.add(song)
+
+    def is_finished(self) -> bool:
+        """Checks if every tracked stream has finished downloading"""
+        with self._lock:
+            return len(self.finished_streams) == len(self.stream_trackers)
+
+    def render(self) -> None:
+        """
+        Draws the current state of the counters in the bar: the bytes downloaded out of the
+        known total, and the songs finished out of those tracked
+        """
+        with self._lock:
+            total_bytes, downloaded_bytes = self.total_bytes, self.downloaded_bytes
+            description = f"{len(self.finished_streams)}/{len(self.stream_trackers)} songs"
+            if self.unknown_sizes:
+                description += f", {self.unknown_sizes} sizes pending"
+        if self.download_bar.desc != description:
+            self.download_bar.set_description_str(description, refresh=False)
+        if self.download_bar.total != total_bytes:
+            self.download_bar.total = total_bytes
+        self.download_bar.update(downloaded_bytes - self.download_bar.n)
+
+    def close(self) -> None:
+        """Stops the rendering thread, draws the final state and closes the bar"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._renderer.join()
+        self.render()
+        self.download_bar.close()
 
     def reset(self) -> None:
         """Resets the bar"""
+        with self._lock:
+            self.downloaded_bytes = 0
+            self.finished_streams.clear()
         self.download_bar.reset()
+
+    def _render_loop(self) -> None:
+        """Renders the bar every refresh_interval seconds, until the bar is closed"""
+        while not self._closed.wait(self.refresh_interval):
+            self.render()
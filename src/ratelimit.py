@@ -0,0 +1,51 @@
+"""Module for the bandwidth limit shared by every download of a run."""
+import time
+import threading
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the bytes per second transferred by every thread sharing it. The
+    bucket holds up to burst bytes, so an idle limiter lets the first transfers through at full
+    speed. Bytes are charged once they've been read, and the bucket may go into debt: each
+    caller sleeps until the debt left by itself and the callers before it is paid. Since the
+    debt is taken in call order, concurrent transfers get an even share of the rate, and a
+    transfer slowed down by its server leaves its share to the rest.
+    """
+
+    def __init__(self, rate: int, burst: Optional[int] = None) -> None:
+        """
+        Creates a full bucket.
+            Parameters:
+                rate (int): maximum bytes per second, on average.
+                burst (int): maximum bytes transferred at once after an idle period. Defaults
+                    to a second's worth of rate.
+        """
+        check_rate(rate)
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        """
+        Charges amount bytes to the bucket, sleeping until they fit in the rate. Returns the
+        seconds slept.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def check_rate(rate: int) -> None:
+    """Checks rate is a positive number"""
+    if rate <= 0:
+        raise ValueError("The maximum rate must be a positive number of bytes per second.")
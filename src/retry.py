@@ -0,0 +1,211 @@
+"""Module for the retries of failed requests and the circuit breakers throttling them."""
+import time
+import random
+import socket
+import threading
+import http.client
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from typing import Callable, ContextManager, Iterator, Optional, TypeVar
+from urllib.error import HTTPError, URLError
+
+T = TypeVar("T")
+
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30
+# Errors of requests that may succeed if repeated: dropped connections, timeouts and responses
+# with one of RETRYABLE_STATUSES
+TRANSIENT_ERRORS = (URLError, http.client.HTTPException, ConnectionError, socket.timeout)
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+TOO_MANY_REQUESTS = 429
+# Outcomes a CircuitBreaker looks back at, and fraction of them failed that halves its limit
+DEFAULT_WINDOW = 10
+DEFAULT_ERROR_THRESHOLD = 0.5
+
+
+class CircuitBreaker:
+    """
+    Limit on the concurrent requests to a service, shared by every thread calling it, which
+    adapts to the service's health. A request throttled by the service (see is_throttled)
+    lowers the limit below the requests that were running along with it, and at least
+    `threshold` of the last `window` requests failing halves it; after `window` successes in a
+    row, it grows by one, up to its initial value. So while a service is failing, requests
+    wait for a slot instead of adding to its load.
+    """
+
+    def __init__(self, limit: int, window: int = DEFAULT_WINDOW,
+                 threshold: float = DEFAULT_ERROR_THRESHOLD) -> None:
+        """
+        Creates the breaker closed, allowing `limit` concurrent requests.
+            Parameters:
+                limit (int): maximum number of concurrent requests, while the service is healthy
+                window (int): number of recent requests the error rate is measured over
+                threshold (float): error rate above which the limit is lowered
+        """
+        self.max_limit = limit
+        self.limit = limit
+        self.window = window
+        self.threshold = threshold
+        self._outcomes = deque(maxlen=window)
+        self._successes = 0
+        self._active = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Waits until a request is allowed, which lasts as long as the with block"""
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    def record_success(self) -> None:
+        """Records a successful request, raising the limit after `window` in a row"""
+        with self._condition:
+            self._outcomes.append(True)
+            self._successes += 1
+            if self._successes >= self.window and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def record_failure(self, throttled: bool = False) -> None:
+        """
+        Records a failed request, lowering the limit if the error rate reaches the threshold.
+        If the request was throttled, which should be recorded while holding its slot, the
+        limit is lowered below the requests running.
+        """
+        with self._condition:
+            self._outcomes.append(False)
+            self._successes = 0
+            if throttled:
+                self.limit = max(1, min(self.limit, self._active) - 1)
+            if self._outcomes.count(False) >= self.threshold * self.window:
+                self.limit = max(1, self.limit // 2)
+                self._outcomes.clear()
+
+
+class RetryPolicy:
+    """
+    Retries of the requests that fail with a transient error (see is_retryable), waiting an
+    exponential backoff with full jitter between attempts, or as long as the server asked
+    through Retry-After if longer. If a CircuitBreaker is provided, each attempt takes one of
+    its slots and reports its outcome to it.
+    """
+
+    def __init__(self, attempts: int = DEFAULT_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 breaker: Optional[CircuitBreaker] = None) -> None:
+        """
+            Parameters:
+                attempts (int): maximum number of attempts of each call
+                base_delay (float): maximum seconds waited after the first failure, doubled
+                    after each of the next ones
+                max_delay (float): maximum seconds waited between attempts, besides Retry-After
+                breaker (CircuitBreaker): breaker shared by every call; None for no limit
+        """
+        check_attempts(attempts)
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    def call(self, task: Callable[[], T],
+             on_retry: Optional[Callable[[Exception], None]] = None) -> T:
+        """
+        Returns what task returns, calling it again after each transient error until attempts
+        run out; then, or on any other error, the error is raised. on_retry, if provided, is
+        called with each error retried.
+        """
+        attempt = 0
+        while True:
+            with self.slot():
+                try:
+                    return self.record_success(task())
+                except Exception as error:  # pylint: disable=broad-except
+                    self.record_failure(error)
+                    if attempt + 1 >= self.attempts or not is_retryable(error):
+                        raise
+                    failure = error
+            if on_retry:
+                on_retry(failure)
+            self.backoff(attempt, failure)
+            attempt += 1
+
+    def slot(self) -> ContextManager[None]:
+        """Returns a slot of the breaker, to be held while requesting; see CircuitBreaker.slot"""
+        return self.breaker.slot() if self.breaker else nullcontext()
+
+    def record_success(self, result: T = None) -> T:
+        """Reports a successful request to the breaker. Returns result, for convenience"""
+        if self.breaker:
+            self.breaker.record_success()
+        return result
+
+    def record_failure(self, error: Exception) -> None:
+        """Reports a failed request to the breaker, unless retrying it wouldn't help"""
+        if self.breaker and is_retryable(error):
+            self.breaker.record_failure(is_throttled(error))
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """Sleeps before retrying a request that failed `attempt` + 1 times; see get_delay"""
+        delay = self.get_delay(attempt, error)
+        time.sleep(delay)
+        return delay
+
+    def get_delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        Returns the seconds to wait after the failed attempt number `attempt` (0 for the first):
+        a random time up to base_delay * 2^attempt (capped at max_delay), or the Retry-After
+        of error if longer.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = get_retry_after(error)
+        return max(delay, retry_after) if retry_after else delay
+
+
+def is_retryable(error: Exception) -> bool:
+    """Checks if the request that raised error may succeed if repeated"""
+    if isinstance(error, HTTPError):
+        return error.code in RETRYABLE_STATUSES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def is_throttled(error: Exception) -> bool:
+    """Checks if error is the service asking to slow down: a 429, or a Retry-After"""
+    return isinstance(error, HTTPError) and \
+        (error.code == TOO_MANY_REQUESTS or get_retry_after(error) is not None)
+
+
+def get_retry_after(error: Optional[Exception]) -> Optional[float]:
+    """
+    Returns the seconds the server asked to wait before retrying in the Retry-After header of
+    error, which can be a number of seconds or a date. None if error isn't an HTTPError with it.
+    """
+    if not isinstance(error, HTTPError) or not error.headers:
+        return None
+    value = error.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_attempts(attempts: int) -> None:
+    """Checks the number of attempts is a positive integer"""
+    if attempts < 1:
+        raise ValueError("The number of attempts must be at least 1.")
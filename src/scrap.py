@@ -1,37 +1,80 @@
 """Container for the Scrapper class"""
 import re
-from urllib import request
+from typing import Iterator, Optional
 from bs4 import BeautifulSoup
+from .pages import DEFAULT_PAGE_JOBS, ConnectionPool, PlaylistFetcher
+from .workers import WorkerPool
 
 
 class Scrapper:
     """Class that extracts titles and artists from songs in a Spotify's url"""
-    def __init__(self, url: str, artist: str) -> None:
+    def __init__(self, url: str, artist: str, page_jobs: int = DEFAULT_PAGE_JOBS,
+                 connections: Optional[ConnectionPool] = None,
+                 pages: Optional[WorkerPool] = None) -> None:
         """
-        Fetches the url's html and wraps it inside a BeautifulSoup instance.
+        Fetches the url's first page through a PlaylistFetcher, which extracts the songs from
+        the structured data embedded in the page and fetches the rest of pages concurrently.
+        If the page has no structured data, falls back to parsing its text through BeautifulSoup.
+        If the whole playlist fits in the first page, it's filtered by artist right away.
             Parameters:
                 url (str): url of the Spotify's playlist
+                artist (str): if not None, only songs by an artist including it are kept
+                page_jobs (int): maximum number of pages being fetched at the same time
+                connections (ConnectionPool): keep-alive connections shared with other
+                    scrappers; None to open them for this one
+                pages (WorkerPool): page workers shared with other scrappers, along with
+                    connections; None to start them for this one
         """
         self.artist = artist
         check_url_is_valid(url)
         url = clean_url(url)
-        html = request.urlopen(url).read().decode("utf-8")
-        raw_text = BeautifulSoup(html, "html.parser").get_text()
-
-        self._song_data = process_raw_text(raw_text)
-        self._filter_by_artist(artist)
+        if not url.startswith("https://"):
+            url = f"https://{url}"
+        self._fetcher = PlaylistFetcher(url, page_jobs, connections, pages)
+        self._song_data = None
+        if not self._fetcher.first_tracks:
+            raw_text = BeautifulSoup(self._fetcher.first_page.decode("utf-8"),
+                                     "html.parser").get_text()
+            self._song_data = process_raw_text(raw_text)
+            self._filter_by_artist(artist)
+        elif not self._fetcher.page_urls:
+            self._song_data = self._fetcher.first_tracks
+            self._filter_by_artist(artist)
+
+    def iter_searchstring(self) -> Iterator[str]:
+        """
+        Yields the searchstrings ('title, artist') of the songs as their pages arrive, so they
+        can be searched before the whole playlist has been fetched.
+        """
+        if self._song_data is None:
+            songs = []
+            for song in self._fetcher:
+                songs.append(song)
+                if not self.artist or is_substring_included(song["artist"], self.artist):
+                    yield to_searchstring(song)
+            self._song_data = songs
+            self._filter_by_artist(self.artist)
+        else:
+            yield from self.get_searchstring()
 
     def get_titles(self) -> list[str]:
         """Returns the titles from the songs"""
-        return [song["title"] for song in self._song_data]
+        return [song["title"] for song in self._get_song_data()]
 
     def get_artists(self, filter_artists: bool = False):
         """Returns the artists of the songs"""
-        return [song["artist"] for song in self._song_data]
+        return [song["artist"] for song in self._get_song_data()]
 
     def get_searchstring(self) -> list[str]:
         """Gets the artist and title list and combines them in a single list 'title, artist'"""
-        return [f'{song["title"]}, {song["artist"]}' for song in self._song_data]
+        return [to_searchstring(song) for song in self._get_song_data()]
+
+    def _get_song_data(self) -> list[dict]:
+        """Returns the songs, waiting for every page of the playlist to arrive"""
+        if self._song_data is None:
+            self._song_data = list(self._fetcher)
+            self._filter_by_artist(self.artist)
+        return self._song_data
 
     def _filter_by_artist(self, artist) -> None:
         """Removes the elements in string_list with a corresponding False in self.is_included."""
@@ -50,6 +93,11 @@ class Scrapper:
         self._song_data = selection
 
 
+def to_searchstring(song: dict) -> str:
+    """Combines the title and artist of song as 'title, artist'"""
+    return f'{song["title"]}, {song["artist"]}'
+
+
 def check_url_is_valid(url: str) -> None:
     """Checks that the url belongs to a spotify's playlist"""
     prefixes = ["https://open.spotify.com/playlist",
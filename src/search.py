@@ -1,7 +1,8 @@
 """Container for classes and methods related to searching in youtube"""
 from typing import Callable
 from inspect import signature
-from pytube import Search, Stream
+from pytube import Search, Stream, YouTube
+from .conversion import Converter, can_remux, parse_extensions
 
 Callback = Callable[[Stream, bytes, int], None]
 
@@ -22,35 +23,129 @@ class YTVideo:
             searchstring (str): string to use on yt search engine
             callback (function): callback to handle the stream download. See documentation on
                 progressbar.DownloadProgressBar.callback
+            cache (SearchCache): persistent cache of searches and streams. If a search is
+                found there, youtube isn't queried.
+            extension (str): format the audio will be converted to, if any, or several separated
+                by commas. Streams that can be remuxed into them are preferred over those that
+                would need re-encoding.
     """
 
-    def __init__(self, searchstring: str, callback: Callback=None) -> None:
+    def __init__(self, searchstring: str, callback: Callback=None, cache=None,
+                 extension: str=None) -> None:
         check_callback(callback)
+        self.cache = cache
+        self.extension = extension
+        # It takes time to get the stream, will only fetch through get_stream
+        self._cached_stream = None
+        self._stream_info = None
 
-        search = Search(searchstring)
-        if len(search.results) == 0:
-            raise ValueError(f"The searchstring '{searchstring}' didn't have any matches.")
-        self.vid = search.results[0]
+        cached_video = cache.get_video(searchstring) if cache else None
+        if cached_video:
+            video_id = cached_video["video_id"]
+            self.vid = YouTube(f"https://youtube.com/watch?v={video_id}")
+            self.vid.title = cached_video["title"]
+            self._stream_info = cache.get_stream(video_id)
+            if self._stream_info and not self._suits_extension(self._stream_info["mime_type"]):
+                # Picked for another format; the stream is chosen again for this one
+                self._stream_info = None
+        else:
+            search = Search(searchstring)
+            if len(search.results) == 0:
+                raise ValueError(f"The searchstring '{searchstring}' didn't have any matches.")
+            self.vid = search.results[0]
+            if cache:
+                cache.set_video(searchstring, self.vid.video_id, self.vid.title)
 
-        # It takes time to get the stream, will only fetch through get_stream or get_format
-        self._cached_stream = None
+        if callback:
+            self.vid.register_on_progress_callback(callback)
 
     def get_url(self) -> str:
         """Gets the (not embeded) url of the video"""
         return self.vid.watch_url
 
+    def get_video_id(self) -> str:
+        """Gets the id of the video"""
+        return self.vid.video_id
+
     def get_stream(self) -> Stream:
-        """Returns the audio stream with most quality."""
+        """
+        Returns the audio stream selected by select_audio_stream for the extension. If the
+        stream was cached, it's picked by its itag instead.
+        """
+        if not self._cached_stream and self._stream_info:
+            self._cached_stream = self.vid.streams.get_by_itag(self._stream_info["itag"])
         if not self._cached_stream:
             audio_streams = self.vid.streams.filter(only_audio=True)
-            self._cached_stream = audio_streams.order_by("abr").first()
+            self._cached_stream = select_audio_stream(list(audio_streams), self.extension)
+            self._save_stream_info(self._cached_stream)
         return self._cached_stream
 
     def get_format(self) -> str:
         """Returns the format associated with the selected stream"""
-        raw_type = self.get_stream().mime_type
+        if self._stream_info:
+            raw_type = self._stream_info["mime_type"]
+        else:
+            raw_type = self.get_stream().mime_type
         return raw_type.split("/")[1]
 
+    def is_stream_known(self) -> bool:
+        """Checks if the selected stream's itag, format and size are known without querying it"""
+        return self._stream_info is not None
+
+    def is_stream_resolved(self) -> bool:
+        """Checks if the selected stream has been queried already, so get_stream returns at once"""
+        return self._cached_stream is not None
+
+    def get_itag(self) -> int:
+        """Returns the itag (youtube's id of the format) of the selected stream"""
+        if self._stream_info:
+            return self._stream_info["itag"]
+        return self.get_stream().itag
+
+    def get_filesize(self) -> int:
+        """Returns the size in bytes of the selected stream"""
+        if self._stream_info:
+            return self._stream_info["filesize"]
+        return self.get_stream().filesize
+
+    def _suits_extension(self, mime_type: str) -> bool:
+        """
+        Checks if a stream of mime_type is what would be selected for the extension, as far as
+        its format goes: one that can be remuxed into one of its formats, if they allow any.
+        """
+        extensions = parse_extensions(self.extension) if self.extension else []
+        if not any(Converter.REMUX_SOURCES.get(extension) for extension in extensions):
+            return True
+        subtype = mime_type.split("/")[1]
+        return any(subtype == extension or can_remux(subtype, extension)
+                   for extension in extensions)
+
+    def _save_stream_info(self, stream: Stream) -> None:
+        """Keeps the information of stream that can be known without fetching it again"""
+        self._stream_info = {"itag": stream.itag,
+                             "mime_type": stream.mime_type,
+                             "filesize": stream.filesize}
+        if self.cache:
+            self.cache.set_stream(self.get_video_id(), **self._stream_info)
+
+
+def select_audio_stream(streams: list[Stream], extension: str=None) -> Stream:
+    """
+    Returns the stream with the highest bitrate among streams that are already in the
+    extension format or can be remuxed into it (see conversion.can_remux), or among all of
+    them if none can or extension is None. With several formats separated by commas, the first
+    one that some stream suits is taken.
+    """
+    if not streams:
+        raise ValueError("The video doesn't have any audio streams.")
+    for new_extension in parse_extensions(extension) if extension else []:
+        suitable = [stream for stream in streams if stream.subtype == new_extension
+                    or can_remux(stream.subtype, new_extension)]
+        if suitable:
+            streams = suitable
+            break
+    return max(streams, key=lambda stream: stream.bitrate or 0)
+
 if __name__ == "__main__":
     vid = YTVideo("Alfonsina y el Mar")
     url = vid.get_url()
@@ -0,0 +1,128 @@
+"""Module for the local store of downloaded and converted audios, shared across runs."""
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+from .cache import default_cache_dir
+from .files import link_or_copy
+
+DEFAULT_MAX_SIZE = 4 * 1024 * 1024 * 1024  # 4 GiB, in bytes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+"""
+
+
+class AudioStore:
+    """
+    Content-addressed store of audio files, named after the video, stream and format they hold
+    (see object_name). Files are placed into destination folders through hardlinks, so a hit
+    costs neither a download, a conversion nor extra disk space. When the stored files exceed
+    max_size, the least recently used ones are removed.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """
+        Opens (or creates) the store and its index.
+            Parameters:
+                path (Path): folder of the store. Defaults to a folder in the user's cache
+                    directory.
+                max_size (int): maximum size in bytes of the stored files.
+        """
+        self.path = path if path else default_cache_dir() / "audio"
+        self.objects_path = self.path / "objects"
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path / "index.sqlite3", check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+
+    def materialize(self, name: str, destination: Path) -> bool:
+        """
+        Places the stored file called name at destination. Returns False if it isn't stored.
+        """
+        object_path = self.get_object_path(name)
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM objects WHERE name = ?",
+                                           (name,)).fetchone()
+        if not row:
+            return False
+        if not object_path.exists():
+            self._remove(name)
+            return False
+        link_or_copy(object_path, destination)
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE objects SET used = ? WHERE name = ?",
+                                     (time.time(), name))
+        return True
+
+    def contains(self, name: str) -> bool:
+        """Checks if a file called name is stored"""
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM objects WHERE name = ?",
+                                           (name,)).fetchone()
+        return row is not None and self.get_object_path(name).exists()
+
+    def put(self, name: str, source: Path) -> bool:
+        """
+        Stores the file at source under name, then removes files beyond max_size. Returns
+        False, storing nothing, if the file alone is bigger than max_size, since it would be
+        the first to go in a later collection and would take every older file with it.
+        """
+        if source.stat().st_size > self.max_size:
+            return False
+        object_path = self.get_object_path(name)
+        link_or_copy(source, object_path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects (name, size, used) VALUES (?, ?, ?)",
+                (name, object_path.stat().st_size, time.time()))
+        self.collect_garbage()
+        return True
+
+    def collect_garbage(self) -> None:
+        """Removes the least recently used files until the store fits in max_size"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name, size FROM objects ORDER BY used DESC").fetchall()
+        kept_size = 0
+        for name, size in rows:
+            kept_size += size
+            if kept_size > self.max_size:
+                self._remove(name)
+
+    def get_size(self) -> int:
+        """Returns the size in bytes of the stored files"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def get_object_path(self, name: str) -> Path:
+        """Returns the path of the stored file called name, in a subfolder to keep folders small"""
+        return self.objects_path / name[:2] / name
+
+    def close(self) -> None:
+        """Closes the connection to the index"""
+        with self._lock:
+            self._connection.close()
+
+    def _remove(self, name: str) -> None:
+        """Deletes the stored file called name and its index entry"""
+        self.get_object_path(name).unlink(missing_ok=True)
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM objects WHERE name = ?", (name,))
+
+
+def object_name(video_id: str, itag: int, extension: str, converted: bool = False) -> str:
+    """
+    Returns the name of the stored file of a video's stream: as it was downloaded, or
+    converted to extension.
+    """
+    kind = "converted" if converted else "original"
+    return f"{video_id}-{itag}-{kind}.{extension}"
@@ -0,0 +1,101 @@
+"""Module for the manifest that keeps a destination folder in sync with a playlist."""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Optional
+from .cache import normalize_searchstring
+from .conversion import check_file_exists, parse_extensions
+
+MANIFEST_NAME = ".playlist_manifest.json"
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+
+class Manifest:
+    """
+    Record of the songs already present in a destination folder: their searchstring, video id
+    and files, with the format, size and checksum of each one. Used to only download the songs
+    that are missing.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        """
+        Loads the manifest inside directory, if there's one.
+            Parameters:
+                directory (Path): destination folder of the songs
+        """
+        self.directory = directory
+        self.path = Path(directory, MANIFEST_NAME)
+        self.entries = {}
+        if self.path.exists():
+            content = json.loads(self.path.read_text(encoding="utf-8"))
+            self.entries = {normalize_searchstring(entry["searchstring"]): entry
+                            for entry in content["songs"]}
+
+    def get_missing(self, searchstrings: list[str], extension: Optional[str] = None) -> list[str]:
+        """
+        Returns the searchstrings without a valid entry: not recorded, whose files are gone or
+        without a file in each format of extension (if provided; several formats are separated
+        by commas).
+        """
+        extensions = parse_extensions(extension) if extension else []
+        return [song for song in searchstrings
+                if not self._is_present(normalize_searchstring(song), extensions)]
+
+    def get_removed(self, searchstrings: list[str]) -> list[str]:
+        """Returns the recorded searchstrings that are not inside searchstrings"""
+        keys = {normalize_searchstring(song) for song in searchstrings}
+        return [entry["searchstring"] for key, entry in self.entries.items() if key not in keys]
+
+    def add(self, searchstring: str, video_id: str, *paths: Path) -> None:
+        """Records the song at paths (one per format), computing their sizes and checksums"""
+        for path in paths:
+            check_file_exists(path)
+        self.entries[normalize_searchstring(searchstring)] = {
+            "searchstring": searchstring,
+            "video_id": video_id,
+            "files": [{"file": os.path.relpath(path, self.directory),
+                       "format": path.suffix.lstrip("."),
+                       "size": path.stat().st_size,
+                       "sha256": file_checksum(path)} for path in paths]}
+
+    def prune(self, searchstrings: list[str]) -> list[str]:
+        """Removes the entries (and files) of the songs not inside searchstrings"""
+        removed = self.get_removed(searchstrings)
+        for song in removed:
+            entry = self.entries.pop(normalize_searchstring(song))
+            for song_file in entry["files"]:
+                Path(self.directory, song_file["file"]).unlink(missing_ok=True)
+        return removed
+
+    def save(self) -> None:
+        """Writes the manifest, replacing the previous one atomically"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(".tmp")
+        content = {"songs": list(self.entries.values())}
+        temporary_path.write_text(json.dumps(content, indent=2), encoding="utf-8")
+        os.replace(temporary_path, self.path)
+
+    def _is_present(self, key: str, extensions: list[str]) -> bool:
+        """
+        Checks that the song under key is recorded, in each of extensions, and its files exist
+        """
+        entry = self.entries.get(key)
+        if not entry:
+            return False
+        if not set(extensions) <= {song_file["format"] for song_file in entry["files"]}:
+            return False
+        for song_file in entry["files"]:
+            song_path = Path(self.directory, song_file["file"])
+            if not song_path.exists() or song_path.stat().st_size != song_file["size"]:
+                return False
+        return True
+
+
+def file_checksum(path: Path) -> str:
+    """Returns the sha256 of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHECKSUM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,245 @@
+"""Module for the resumable http transfers of the audio streams."""
+import os
+import threading
+import http.client
+from pathlib import Path
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, Optional
+from urllib import request
+from .ratelimit import RateLimiter
+from .retry import TRANSIENT_ERRORS, RetryPolicy, is_retryable
+from .workers import WorkerPool
+
+# Called with the chunk just written and the bytes remaining to complete the file
+ProgressCallback = Callable[[bytes, int], None]
+
+PART_SUFFIX = ".part"
+SEGMENTED_PART_SUFFIX = ".segments.part"
+CHUNK_SIZE = 128 * 1024
+# Youtube throttles requests for big ranges, so streams are fetched in ranges of this size
+RANGE_SIZE = 9 * 1024 * 1024
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT = 30
+DEFAULT_SEGMENTS = 1
+DEFAULT_SEGMENT_THRESHOLD = 32 * 1024 * 1024
+REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+
+def download_resumable(url: str, destination: Path, filesize: int,
+                       on_chunk: Optional[ProgressCallback] = None,
+                       retries: int = DEFAULT_RETRIES, timeout: float = DEFAULT_TIMEOUT,
+                       limiter: Optional[RateLimiter] = None,
+                       retry: Optional[RetryPolicy] = None) -> int:
+    """
+    Downloads url into destination through a .part file, whose length is the offset the download
+    resumes from: both after a dropped connection and on a later run. Once complete, the .part
+    file is moved to destination atomically. Errors that won't go away by retrying (such as a
+    404) are raised at once. Returns the number of failed requests retried.
+        Parameters:
+            url (str): url of the stream
+            destination (Path): final path of the file
+            filesize (int): size in bytes of the stream
+            on_chunk (function): called after each chunk is written; see ProgressCallback
+            retries (int): consecutive attempts without progress allowed before giving up
+            timeout (float): seconds to wait for the server before retrying
+            limiter (RateLimiter): bandwidth limit charged with every chunk read; None for
+                no limit
+            retry (RetryPolicy): backoff waited after each attempt without progress, and
+                breaker limiting the concurrent requests; None to retry at once
+    """
+    check_filesize(filesize)
+    on_chunk = on_chunk if on_chunk else lambda chunk, remaining: None
+    if destination.exists() and destination.stat().st_size == filesize:
+        on_chunk(b"", 0)
+        return 0
+
+    part_path = get_part_path(destination)
+    retried = 0
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    with open(part_path, "ab") as part_file:
+        if offset > filesize:
+            part_file.truncate(0)
+            part_file.seek(0)
+            offset = 0
+        if offset:
+            on_chunk(b"", filesize - offset)
+        failed_attempts = 0
+        while offset < filesize:
+            new_offset, error = attempt_fetch(
+                lambda: fetch_range(url, part_file, offset, filesize, on_chunk, timeout, limiter),
+                part_file, retry)
+            retried += error is not None
+            failed_attempts = 0 if new_offset > offset else failed_attempts + 1
+            if failed_attempts > retries:
+                raise ConnectionError(f"Download of {destination} stalled at byte {offset}.")
+            if failed_attempts and retry:
+                retry.backoff(failed_attempts - 1, error)
+            offset = new_offset
+    os.replace(part_path, destination)
+    return retried
+
+
+def attempt_fetch(fetch: Callable[[], int], part_file: BinaryIO,
+                  retry: Optional[RetryPolicy]) -> tuple[int, Optional[Exception]]:
+    """
+    Calls fetch, which requests a range into part_file. Returns the offset reached and, if the
+    request was cut short by a transient error, the error; other errors are raised. If retry is
+    provided, the request takes a slot of its breaker and its outcome is reported to it.
+    """
+    with retry.slot() if retry else nullcontext():
+        try:
+            offset = fetch()
+        except TRANSIENT_ERRORS as error:
+            if retry:
+                retry.record_failure(error)
+            if not is_retryable(error):
+                raise
+            return part_file.tell(), error
+        if retry:
+            retry.record_success()
+        return offset, None
+
+
+def fetch_range(url: str, part_file: BinaryIO, offset: int, filesize: int,
+                on_chunk: ProgressCallback, timeout: float,
+                limiter: Optional[RateLimiter] = None) -> int:
+    """
+    Requests the range starting at offset and appends it to part_file. Returns the new offset,
+    which is short of the requested range end if the connection was dropped. Each chunk read
+    is charged to limiter, if provided.
+    """
+    end = min(offset + RANGE_SIZE, filesize) - 1
+    headers = dict(REQUEST_HEADERS, Range=f"bytes={offset}-{end}")
+    with request.urlopen(request.Request(url, headers=headers), timeout=timeout) as response:
+        if offset and response.status != http.client.PARTIAL_CONTENT:
+            # The server ignored the range, so the file is downloaded again from the start
+            part_file.truncate(0)
+            part_file.seek(0)
+            offset = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if limiter:
+                limiter.consume(len(chunk))
+            part_file.write(chunk)
+            offset += len(chunk)
+            on_chunk(chunk, filesize - offset)
+    part_file.flush()
+    return offset
+
+
+class RangeNotSupportedError(Exception):
+    """Raised when a server answers a range request with the whole file"""
+
+
+def download_segmented(url: str, destination: Path, filesize: int, segments: int,
+                       on_chunk: Optional[ProgressCallback] = None,
+                       retries: int = DEFAULT_RETRIES, timeout: float = DEFAULT_TIMEOUT,
+                       limiter: Optional[RateLimiter] = None,
+                       retry: Optional[RetryPolicy] = None) -> int:
+    """
+    Downloads url into destination splitting it in byte ranges fetched in parallel, each one
+    written straight into its offset of a preallocated partial file. A dropped connection
+    resumes its own segment; a later run starts over, since the partial file doesn't record
+    the progress of each segment. Falls back to download_resumable if ranges aren't supported.
+    Returns the number of failed requests retried.
+        Parameters:
+            segments (int): number of ranges, and of parallel connections
+            see download_resumable for the rest of parameters
+    """
+    check_filesize(filesize)
+    on_chunk = on_chunk if on_chunk else lambda chunk, remaining: None
+    if destination.exists() and destination.stat().st_size == filesize:
+        on_chunk(b"", 0)
+        return 0
+
+    part_path = destination.with_name(destination.name + SEGMENTED_PART_SUFFIX)
+    with open(part_path, "wb") as part_file:
+        part_file.truncate(filesize)
+
+    lock = threading.Lock()
+    remaining = [filesize]
+    retried = [0]
+
+    def on_segment_chunk(chunk: bytes) -> None:
+        with lock:
+            remaining[0] -= len(chunk)
+            on_chunk(chunk, remaining[0])
+
+    def download_segment(start: int, end: int) -> None:
+        with open(part_path, "r+b") as part_file:
+            part_file.seek(start)
+            failed_attempts = 0
+            while start <= end:
+                new_start, error = attempt_fetch(
+                    lambda: fetch_segment(url, part_file, start, end, on_segment_chunk, timeout,
+                                          limiter),
+                    part_file, retry)
+                if error:
+                    with lock:
+                        retried[0] += 1
+                failed_attempts = 0 if new_start > start else failed_attempts + 1
+                if failed_attempts > retries:
+                    raise ConnectionError(f"Segment of {destination} stalled at byte {start}.")
+                if failed_attempts and retry:
+                    retry.backoff(failed_attempts - 1, error)
+                start = new_start
+
+    pool = WorkerPool(min(segments, filesize), name="segment")
+    jobs = [pool.submit(lambda bounds=bounds: download_segment(*bounds))
+            for bounds in split_ranges(filesize, segments)]
+    pool.wait_until_finished()
+    pool.shutdown()
+    errors = [job.error for job in jobs if job.error]
+    if any(isinstance(error, RangeNotSupportedError) for error in errors):
+        part_path.unlink()
+        return retried[0] + download_resumable(url, destination, filesize, on_chunk, retries,
+                                               timeout, limiter, retry)
+    if errors:
+        raise errors[0]
+    os.replace(part_path, destination)
+    return retried[0]
+
+
+def fetch_segment(url: str, part_file: BinaryIO, start: int, end: int,
+                  on_chunk: Callable[[bytes], None], timeout: float,
+                  limiter: Optional[RateLimiter] = None) -> int:
+    """
+    Requests the bytes from start to end (included) and writes them at the current position of
+    part_file. Returns the offset the segment has reached. Each chunk read is charged to
+    limiter, if provided.
+    """
+    headers = dict(REQUEST_HEADERS, Range=f"bytes={start}-{end}")
+    with request.urlopen(request.Request(url, headers=headers), timeout=timeout) as response:
+        if response.status != http.client.PARTIAL_CONTENT:
+            raise RangeNotSupportedError(f"The server at {url} doesn't support range requests.")
+        while start <= end:
+            chunk = response.read(min(CHUNK_SIZE, end + 1 - start))
+            if not chunk:
+                break
+            if limiter:
+                limiter.consume(len(chunk))
+            part_file.write(chunk)
+            start += len(chunk)
+            on_chunk(chunk)
+    part_file.flush()
+    return start
+
+
+def split_ranges(filesize: int, segments: int) -> list[tuple[int, int]]:
+    """Splits filesize bytes in (at most) `segments` contiguous (start, end) ranges"""
+    segment_size = -(-filesize // segments)
+    return [(start, min(start + segment_size, filesize) - 1)
+            for start in range(0, filesize, segment_size)]
+
+
+def get_part_path(destination: Path) -> Path:
+    """Returns the path of the partial file of destination"""
+    return destination.with_name(destination.name + PART_SUFFIX)
+
+
+def check_filesize(filesize: int) -> None:
+    """Checks the size of the stream is known"""
+    if not filesize or filesize < 0:
+        raise ValueError("The size of the stream must be known to download it.")
@@ -0,0 +1,140 @@
+"""Module for the bounded worker pools that run playlist_downloader's jobs."""
+import time
+import queue
+import itertools
+import threading
+from typing import Callable, Optional
+
+Task = Callable[[], None]
+
+DEFAULT_JOBS = 8
+DEFAULT_SEARCH_JOBS = 4
+
+
+class Job:
+    """Handle of a task submitted to a WorkerPool, which can be waited upon."""
+
+    def __init__(self, task: Task) -> None:
+        """
+        Wraps the task; it won't be executed until a worker picks the job.
+            Parameters:
+                task (function): callable without arguments to be executed by the pool
+        """
+        self.task = task
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        """Executes the task, saving the exception it raises (if any) at self.error"""
+        self.started = time.perf_counter()
+        try:
+            self.task()
+        except Exception as err:  # pylint: disable=broad-except
+            self.error = err
+        finally:
+            self._done.set()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits until the job has been executed. Returns False if timeout ran out first"""
+        return self._done.wait(timeout)
+
+    def is_finished(self) -> bool:
+        """Checks if the job has already been executed"""
+        return self._done.is_set()
+
+    def get_wait_time(self) -> float:
+        """Seconds the job waited in the queue before being picked (so far, if not started)"""
+        started = self.started if self.started is not None else time.perf_counter()
+        return started - self.submitted
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of threads fed from a queue. Tasks are executed by priority (lowest
+    first) and, among those of equal priority, in submission order, with at most `workers` of
+    them running at the same time.
+    """
+
+    def __init__(self, workers: int, name: str = "worker") -> None:
+        """
+        Creates the queue; the threads are started on the first submission.
+            Parameters:
+                workers (int): maximum number of tasks running concurrently
+                name (str): prefix for the names of the worker threads
+        """
+        check_worker_count(workers)
+        self.workers = workers
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        # Tie breaker of equal priorities, keeping them in submission order
+        self._counter = itertools.count()
+        self._threads = []
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    def submit(self, task: Task, priority: float = 0) -> Job:
+        """
+        Queues task to be executed by the pool, before those queued with a higher priority;
+        returns its Job.
+        """
+        with self._lock:
+            if not self._threads:
+                self._start_workers()
+        job = Job(task)
+        self._queue.put((priority, next(self._counter), job))
+        return job
+
+    def wait_until_finished(self) -> None:
+        """Waits until every queued task has been executed"""
+        self._queue.join()
+
+    def busy_workers(self) -> int:
+        """Number of workers executing a task at this moment"""
+        with self._lock:
+            return self._busy
+
+    def queue_depth(self) -> int:
+        """Number of tasks waiting for a free worker"""
+        return self._queue.qsize()
+
+    def shutdown(self) -> None:
+        """Stops the workers once the queued tasks have been executed"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put((float("inf"), next(self._counter), None))
+        for thread in threads:
+            thread.join()
+
+    def _start_workers(self) -> None:
+        """Starts the worker threads. They're daemons so they don't block the program's exit"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        """Worker loop: executes jobs from the queue until a None sentinel is found"""
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            with self._lock:
+                self._busy += 1
+            try:
+                job.run()
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                self._queue.task_done()
+
+
+def check_worker_count(workers: int) -> None:
+    """Checks that the amount of workers is a positive integer"""
+    if not isinstance(workers, int):
+        raise TypeError("The number of workers must be an integer")
+    if workers < 1:
+        raise ValueError("The number of workers must be at least 1")
@@ -0,0 +1,79 @@
+"""Tests for the batch and files modules"""
+import sys
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.batch import PlaylistBatch, playlist_folder_name
+from src.cache import SearchCache
+from src.files import link_or_copy
+
+
+class TestPlaylistBatch(unittest.TestCase):
+    """PlaylistBatch class tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_same_searchstring_once(self) -> None:
+        """Songs equal once normalized should be downloaded once, into their first folder"""
+        batch = PlaylistBatch()
+        self.assertEqual(["Hey Jude, The Beatles", "Purple Rain, Prince"],
+                         batch.add(["Hey Jude, The Beatles", "Purple Rain, Prince"],
+                                   pathlib.Path("rock")))
+        self.assertEqual([], batch.add(["hey jude,  the beatles"], pathlib.Path("mix")))
+        self.assertEqual(["Hey Jude, The Beatles", "Purple Rain, Prince"], batch.get_songs())
+        self.assertEqual([(pathlib.Path("rock"), "Hey Jude, The Beatles"),
+                          (pathlib.Path("mix"), "hey jude,  the beatles")],
+                         batch.get_targets("Hey Jude, The Beatles"))
+
+    def test_same_cached_video_once(self) -> None:
+        """Different searchstrings already resolved to the same video should be merged"""
+        cache = SearchCache(pathlib.Path(self.path, "cache.sqlite"))
+        cache.set_video("Hey Jude, The Beatles", "A_MjCqQoLLA", "Hey Jude")
+        cache.set_video("Hey Jude - Remastered 2015, The Beatles", "A_MjCqQoLLA", "Hey Jude")
+        batch = PlaylistBatch(cache)
+        batch.add(["Hey Jude, The Beatles"], pathlib.Path("rock"))
+        batch.add(["Hey Jude - Remastered 2015, The Beatles"], pathlib.Path("mix"))
+        self.assertEqual(["Hey Jude, The Beatles"], batch.get_songs())
+        self.assertEqual(2, len(batch.get_targets("Hey Jude - Remastered 2015, The Beatles")))
+        cache.close()
+
+    def test_playlist_folder_name(self) -> None:
+        """Folders should be named after the playlist's id"""
+        self.assertEqual("37i9dQZF1DXcBWIGoYBM5M", playlist_folder_name(
+            "https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M?si=abc"))
+        self.assertEqual("37i9dQZF1DXcBWIGoYBM5M",
+                         playlist_folder_name("open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M"))
+
+
+class TestLinkOrCopy(unittest.TestCase):
+    """link_or_copy tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_hardlinked_into_new_folder(self) -> None:
+        """The destination should share the source's content without a second copy"""
+        source = pathlib.Path(self.path, "song.mp3")
+        source.write_bytes(b"audio")
+        destination = pathlib.Path(self.path, "mix", "song.mp3")
+        link_or_copy(source, destination)
+        self.assertEqual(b"audio", destination.read_bytes())
+        self.assertEqual(source.stat().st_ino, destination.stat().st_ino)
+        link_or_copy(source, destination)
+        link_or_copy(source, source)
+        self.assertEqual(b"audio", source.read_bytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
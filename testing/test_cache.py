@@ -0,0 +1,65 @@
+"""Tests for the cache module"""
+import sys
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.cache import SearchCache, normalize_searchstring
+
+
+class TestSearchCache(unittest.TestCase):
+    """SearchCache class tests"""
+
+    VIDEO_ID = "A_MjCqQoLLA"
+    TITLE = "Hey Jude"
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name, "cache.sqlite3")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_normalized_lookup(self) -> None:
+        """Searches differing in case or whitespace should share the same entry"""
+        cache = SearchCache(self.path)
+        cache.set_video("Hey Jude, The Beatles", self.VIDEO_ID, self.TITLE)
+        cached = cache.get_video("  hey jude,   the beatles")
+        self.assertEqual({"video_id": self.VIDEO_ID, "title": self.TITLE}, cached)
+        self.assertEqual(normalize_searchstring("A  b"), normalize_searchstring("a b"))
+
+    def test_stream_persists(self) -> None:
+        """A cached stream should be found after reopening the database"""
+        cache = SearchCache(self.path)
+        cache.set_video("Hey Jude", self.VIDEO_ID, self.TITLE)
+        cache.set_stream(self.VIDEO_ID, 140, "audio/mp4", 1234)
+        cache.close()
+        stream = SearchCache(self.path).get_stream(self.VIDEO_ID)
+        self.assertEqual({"itag": 140, "mime_type": "audio/mp4", "filesize": 1234}, stream)
+
+    def test_expired_entries(self) -> None:
+        """Entries older than the ttl should miss"""
+        cache = SearchCache(self.path, ttl=-1)
+        cache.set_video("Hey Jude", self.VIDEO_ID, self.TITLE)
+        self.assertIsNone(cache.get_video("Hey Jude"))
+
+    def test_size_eviction(self) -> None:
+        """Only the newest max_entries searches should be kept after evicting"""
+        cache = SearchCache(self.path, max_entries=2)
+        for i in range(4):
+            cache.set_video(f"song {i}", f"id{i}", f"title {i}")
+        cache.evict()
+        self.assertIsNone(cache.get_video("song 0"))
+        self.assertIsNone(cache.get_video("song 1"))
+        self.assertIsNotNone(cache.get_video("song 3"))
+
+    def test_refresh(self) -> None:
+        """A refreshing cache should miss on lookups while still being written"""
+        SearchCache(self.path).set_video("Hey Jude", self.VIDEO_ID, self.TITLE)
+        self.assertIsNone(SearchCache(self.path, refresh=True).get_video("Hey Jude"))
+        self.assertIsNotNone(SearchCache(self.path).get_video("Hey Jude"))
+
+
+if __name__ == "__main__":
+    unittest.main()
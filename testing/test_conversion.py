@@ -1,11 +1,16 @@
 """Tests for the conversion module"""
 import sys
 import shutil
+import resource
+import subprocess
 import pathlib
+import tempfile
 import unittest
 
 sys.path.append(str(pathlib.Path(".").absolute()))
-from conversion import ConversionManager, Converter
+from pydub.generators import Sine
+from src.conversion import ConversionManager, ConversionPipeline, Converter, can_remux, \
+    parse_extensions
 
 
 class TestConversionManager(unittest.TestCase):
@@ -19,6 +24,25 @@ class TestConversionManager(unittest.TestCase):
         with self.assertRaises(TypeError):
             ConversionManager(["path1", "path2"])
 
+    def test_failed_conversion_is_collected(self) -> None:
+        """A file that can't be converted should be reported, and its original kept"""
+        with tempfile.TemporaryDirectory() as directory:
+            broken_path = pathlib.Path(directory, "broken.mp4")
+            broken_path.write_bytes(b"not audio")
+            manager = ConversionManager([broken_path], workers=1)
+            manager.convert_all("mp3")
+            self.assertIn(broken_path, manager.errors)
+            manager.delete_originals()
+            self.assertTrue(broken_path.exists())
+
+    def test_invalid_format(self) -> None:
+        """Should raise an error before converting anything when the format is invalid"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory, "song.mp4")
+            path.write_bytes(b"")
+            with self.assertRaises(ValueError):
+                ConversionManager([path]).convert_all("exe")
+
 class TestConverter(unittest.TestCase):
     """Tests Converter from conversion module"""
     TEST_SONG_PATH = pathlib.Path("Testing/The Beatles - Hey Jude.mp4")
@@ -64,5 +88,123 @@ class TestConverter(unittest.TestCase):
             converter.convert_to("exe")
 
 
+@unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg is required to convert audio")
+class TestConversionPipeline(unittest.TestCase):
+    """Tests ConversionPipeline from conversion module"""
+
+    def test_originals_deleted_per_file(self) -> None:
+        """Converted files should replace their originals, failed ones keep them"""
+        with tempfile.TemporaryDirectory() as directory:
+            tone = Sine(440).to_audio_segment(duration=500)
+            sources = [pathlib.Path(directory, f"song_{i}.wav") for i in range(3)]
+            for source in sources:
+                tone.export(source, format="wav")
+            broken_path = pathlib.Path(directory, "broken.wav")
+            broken_path.write_bytes(b"not audio")
+
+            pipeline = ConversionPipeline("mp3", workers=2, delete_originals=True)
+            for source in sources + [broken_path]:
+                pipeline.submit(source)
+            pipeline.wait_until_finished()
+
+            self.assertEqual([broken_path], list(pipeline.errors))
+            self.assertTrue(broken_path.exists())
+            for source in sources:
+                self.assertFalse(source.exists())
+                self.assertTrue(source.with_suffix(".mp3").exists())
+
+    def test_several_formats(self) -> None:
+        """Each file should be converted to every format, and its original deleted afterwards"""
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "song.wav")
+            Sine(440).to_audio_segment(duration=500).export(source, format="wav")
+            broken_path = pathlib.Path(directory, "broken.wav")
+            broken_path.write_bytes(b"not audio")
+
+            pipeline = ConversionPipeline("mp3,ogg", workers=2, delete_originals=True)
+            pipeline.submit(source)
+            pipeline.submit(broken_path)
+            pipeline.wait_until_finished()
+
+            self.assertFalse(source.exists())
+            self.assertEqual(pipeline.get_paths(source),
+                             [source.with_suffix(".mp3"), source.with_suffix(".ogg")])
+            for path in pipeline.get_paths(source):
+                self.assertTrue(path.exists())
+            self.assertTrue(broken_path.exists())
+            for path in pipeline.get_paths(broken_path):
+                self.assertFalse(path.exists())
+
+    def test_remux(self) -> None:
+        """Opus audio should be copied into ogg as is, not re-encoded into vorbis"""
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "song.webm")
+            subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i",
+                            "sine=frequency=440:duration=1", "-c:a", "libopus", str(source)],
+                           check=True)
+            pipeline = ConversionPipeline("ogg", workers=1)
+            pipeline.submit(source)
+            pipeline.wait_until_finished()
+            probe = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
+                                    "stream=codec_name", "-of", "csv=p=0",
+                                    str(source.with_suffix(".ogg"))],
+                                   capture_output=True, text=True, check=True)
+            self.assertEqual("opus", probe.stdout.strip())
+            self.assertEqual(1, pipeline.metrics.counters["remuxes"])
+
+
+class TestRemux(unittest.TestCase):
+    """Tests the conversions that don't need re-encoding"""
+
+    def test_can_remux(self) -> None:
+        """Only formats whose codec the new format can hold should be remuxed"""
+        self.assertTrue(can_remux("mp4", "mp4"))
+        self.assertTrue(can_remux("webm", "ogg"))
+        self.assertFalse(can_remux("webm", "mp4"))
+        self.assertFalse(can_remux("mp4", "mp3"))
+
+    def test_parse_extensions(self) -> None:
+        """Several formats should be separated by commas, and all of them be valid"""
+        self.assertEqual(["mp3"], parse_extensions("mp3"))
+        self.assertEqual(["mp3", "ogg"], parse_extensions("mp3, ogg,mp3"))
+        with self.assertRaises(ValueError):
+            parse_extensions("mp3,exe")
+
+    def test_same_format(self) -> None:
+        """A file already in the format shouldn't be converted, nor deleted as an original"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory, "song.mp4")
+            path.write_bytes(b"not converted")
+            pipeline = ConversionPipeline("mp4", workers=1, delete_originals=True)
+            self.assertTrue(pipeline.submit(path).done())
+            pipeline.wait_until_finished()
+            self.assertEqual(b"not converted", path.read_bytes())
+            self.assertEqual({}, pipeline.errors)
+
+
+@unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg is required to convert audio")
+class TestStreamingConversion(unittest.TestCase):
+    """Tests the memory used by Converter on long files"""
+    DURATION = 10 * 60
+    # Decoding 10 min of stereo 44.1kHz audio in memory would take more than 100MB
+    MAX_RSS = 64 * 1024 * 1024
+
+    def test_flat_memory(self) -> None:
+        """Converting a long file shouldn't need memory proportional to its duration"""
+        with tempfile.TemporaryDirectory() as directory:
+            source = pathlib.Path(directory, "long_mix.mp3")
+            subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i",
+                            f"sine=frequency=440:duration={self.DURATION}", "-ac", "2",
+                            "-ar", "44100", "-b:a", "64k", str(source)], check=True)
+            own_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            Converter(source).convert_to("ogg")
+            own_rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - own_rss_before
+            encoder_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            # ru_maxrss is in KiB on linux
+            self.assertLess(own_rss_growth * 1024, self.MAX_RSS)
+            self.assertLess(encoder_rss * 1024, self.MAX_RSS)
+            self.assertTrue(pathlib.Path(directory, "long_mix.ogg").exists())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,123 @@
+"""Tests for the daemon module"""
+import sys
+import json
+import asyncio
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.daemon import SOCKET_NAME, Daemon, JobQueue, send_request
+
+
+class TestJobQueue(unittest.TestCase):
+    """JobQueue class tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+        self.queue = JobQueue(self.path / "jobs.sqlite3")
+        self.job = {"appended_songs": ["Hey Jude, The Beatles"], "path": str(self.path)}
+
+    def tearDown(self) -> None:
+        self.queue.close()
+        self.directory.cleanup()
+
+    def test_order(self) -> None:
+        """Jobs should be taken in submission order, each one once"""
+        first = self.queue.submit(self.job, "socket")
+        second = self.queue.submit(dict(self.job, sync=True), "socket")
+        self.assertEqual((first, self.job), self.queue.take())
+        self.assertEqual(second, self.queue.take()[0])
+        self.assertIsNone(self.queue.take())
+        self.assertEqual("running", self.queue.get(first)["status"])
+
+    def test_finish(self) -> None:
+        """A job should fail if any of its songs failed, or it raised"""
+        job_ids = [self.queue.submit(self.job, "socket") for _ in range(3)]
+        for _ in job_ids:
+            self.queue.take()
+        self.queue.finish(job_ids[0], {})
+        self.queue.finish(job_ids[1], {"Hey Jude, The Beatles": ValueError("No matches")})
+        self.queue.finish(job_ids[2], error=ConnectionError("Unreachable"))
+        statuses = [self.queue.get(job_id) for job_id in job_ids]
+        self.assertEqual(["done", "failed", "failed"], [status["status"] for status in statuses])
+        self.assertEqual({"Hey Jude, The Beatles": "No matches"}, statuses[1]["failed"])
+        self.assertEqual("Unreachable", statuses[2]["error"])
+
+    def test_interrupted(self) -> None:
+        """Jobs left running by a stopped daemon should be queued again when reopened"""
+        job_id = self.queue.submit(self.job, "socket")
+        self.queue.take()
+        self.queue.close()
+        self.queue = JobQueue(self.path / "jobs.sqlite3")
+        self.assertEqual(1, self.queue.requeue_interrupted())
+        self.assertEqual(job_id, self.queue.take()[0])
+
+    def test_invalid_jobs(self) -> None:
+        """Jobs without songs, with a relative path or unknown options should be rejected"""
+        with self.assertRaises(ValueError):
+            self.queue.submit({"path": str(self.path)}, "socket")
+        with self.assertRaises(ValueError):
+            self.queue.submit(dict(self.job, path="Songs"), "socket")
+        with self.assertRaises(ValueError):
+            self.queue.submit(dict(self.job, jobs=4), "socket")
+        with self.assertRaises(TypeError):
+            self.queue.submit(dict(self.job, urls="https://open.spotify.com/playlist/x"),
+                              "socket")
+        self.assertEqual([], self.queue.get_recent())
+
+
+class TestDaemon(unittest.TestCase):
+    """Daemon class tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+        self.daemon = Daemon(self.path)
+
+    def tearDown(self) -> None:
+        self.daemon.close()
+        self.directory.cleanup()
+
+    def test_spool(self) -> None:
+        """Valid jobs in the spool folder should be queued, and the rest set aside"""
+        job = {"appended_songs": ["Hey Jude, The Beatles"], "path": str(self.path)}
+        pathlib.Path(self.daemon.spool_path, "job.json").write_text(json.dumps(job))
+        pathlib.Path(self.daemon.spool_path, "broken.json").write_text("{")
+        job_ids = self.daemon.submit_spooled()
+        self.assertEqual(1, len(job_ids))
+        self.assertEqual("spool:job.json", self.daemon.queue.get(job_ids[0])["source"])
+        self.assertEqual(["broken.invalid"],
+                         [path.name for path in self.daemon.spool_path.iterdir()])
+
+    def test_requests(self) -> None:
+        """The daemon should answer status requests and reject invalid ones"""
+
+        async def run_requests() -> tuple[dict, list[str]]:
+            serving = asyncio.create_task(self.daemon.serve())
+            while not pathlib.Path(self.path, SOCKET_NAME).exists():
+                await asyncio.sleep(0.01)
+            status = await send_request({"command": "status"}, self.path)
+            rejected = []
+            for request in ({"command": "restart"}, {"command": "status", "id": 1},
+                            {"command": "submit", "job": {"path": "Songs"}}):
+                try:
+                    await send_request(request, self.path)
+                except ValueError as error:
+                    rejected.append(str(error))
+            serving.cancel()
+            try:
+                await serving
+            except asyncio.CancelledError:
+                pass
+            return status, rejected
+
+        status, rejected = asyncio.run(asyncio.wait_for(run_requests(), 5))
+        self.assertEqual({"jobs": []}, status)
+        self.assertEqual(3, len(rejected))
+        self.assertFalse(pathlib.Path(self.path, SOCKET_NAME).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+"""Tests for the distributed module"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import pathlib
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+sys.path.append(str(pathlib.Path("benchmarks").absolute()))
+from fake_services import FakeServicesTestCase, get_searchstrings, install_routes
+from src.distributed import SQLiteWorkQueue, WorkQueue, Worker, coordinate
+
+
+def process_items(path: pathlib.Path, worker: str) -> None:
+    """Leases and completes items of the queue at path until there are none left"""
+    queue = SQLiteWorkQueue(path)
+    while item := queue.lease(worker, 10):
+        time.sleep(0.001)
+        queue.complete(item["id"], worker, {"worker": worker})
+    queue.close()
+
+
+def run_worker(address: str, path: pathlib.Path, name: str, lease: float) -> None:
+    """Runs a Worker of the queue at path against the fake services until it's drained"""
+    sys.stdout = sys.stderr = open(os.devnull, "w", encoding="utf-8")  # Progress bars
+    install_routes(address)
+    queue = SQLiteWorkQueue(path)
+    worker = Worker(queue, name=name, jobs=2, search_jobs=1, lease=lease, poll_interval=0.05)
+    asyncio.run(worker.run(until_drained=True))
+    queue.close()
+
+
+class TestSQLiteWorkQueue(unittest.TestCase):
+    """SQLiteWorkQueue class tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name, "queue.sqlite3")
+        self.queue = SQLiteWorkQueue(self.path, max_leases=2)
+        self.options = {"extension": None, "keep_originals": False}
+
+    def tearDown(self) -> None:
+        self.queue.close()
+        self.directory.cleanup()
+
+    def put(self, run: str, songs: list[str]) -> None:
+        """Puts songs in the queue, to be downloaded into a folder of their own"""
+        self.queue.put(run, [{"song": song, "targets": [[self.directory.name, song]],
+                              "options": self.options} for song in songs])
+
+    def test_order(self) -> None:
+        """Items should be leased in order, each one once, and finished by their worker"""
+        self.put("run", ["Hey Jude, The Beatles", "Yesterday, The Beatles"])
+        first = self.queue.lease("a", 60)
+        second = self.queue.lease("b", 60)
+        self.assertEqual("Hey Jude, The Beatles", first["song"])
+        self.assertEqual([[self.directory.name, "Yesterday, The Beatles"]], second["targets"])
+        self.assertIsNone(self.queue.lease("c", 60))
+        self.assertFalse(self.queue.complete(first["id"], "b", {}))
+        self.assertTrue(self.queue.complete(first["id"], "a", {"video_id": "x"}))
+        self.assertTrue(self.queue.fail(second["id"], "b", "No matches"))
+        items = self.queue.get_items("run")
+        self.assertEqual(["done", "failed"], [item["status"] for item in items])
+        self.assertEqual({"video_id": "x"}, items[0]["result"])
+        self.assertEqual("No matches", items[1]["error"])
+        self.assertTrue(self.queue.is_drained())
+        self.assertEqual([], self.queue.get_items("other"))
+
+    def test_takeover(self) -> None:
+        """An expired lease should be taken over, and its first worker not finish the item"""
+        self.put("run", ["Hey Jude, The Beatles"])
+        leased = self.queue.lease("crashed", 0.05)
+        self.assertTrue(self.queue.renew(leased["id"], "crashed", 0.05))
+        self.assertIsNone(self.queue.lease("b", 60))
+        time.sleep(0.1)
+        self.assertFalse(self.queue.is_drained())
+        taken = self.queue.lease("b", 60)
+        self.assertEqual(leased["id"], taken["id"])
+        self.assertFalse(self.queue.renew(leased["id"], "crashed", 60))
+        self.assertFalse(self.queue.complete(leased["id"], "crashed", {}))
+        self.assertTrue(self.queue.complete(taken["id"], "b", {}))
+        self.assertEqual(2, self.queue.get_items("run")[0]["leases"])
+
+    def test_given_up(self) -> None:
+        """An item whose leases keep expiring should fail after max_leases"""
+        self.put("run", ["Hey Jude, The Beatles"])
+        for worker in ("a", "b"):
+            self.assertIsNotNone(self.queue.lease(worker, 0.01))
+            time.sleep(0.02)
+        self.assertIsNone(self.queue.lease("c", 60))
+        item = self.queue.get_items("run")[0]
+        self.assertEqual("failed", item["status"])
+        self.assertIn("2 times", item["error"])
+
+    def test_incomplete_backend(self) -> None:
+        """A queue missing methods of the interface shouldn't be instantiated"""
+
+        class LeaseOnlyQueue(WorkQueue):  # pylint: disable=abstract-method
+            """Queue that can only lease items"""
+
+            def lease(self, worker: str, duration: float) -> None:
+                return None
+
+        with self.assertRaises(TypeError):
+            LeaseOnlyQueue()
+
+    def test_several_processes(self) -> None:
+        """Workers in several processes sharing the file should finish every item once"""
+        songs = [f"Song {number}" for number in range(200)]
+        self.put("run", songs)
+        processes = [multiprocessing.Process(target=process_items, args=(self.path, f"w{n}"))
+                     for n in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        items = self.queue.get_items("run")
+        self.assertEqual(songs, [item["song"] for item in items])
+        self.assertTrue(all(item["status"] == "done" and item["leases"] == 1
+                            for item in items))
+        self.assertTrue(all(item["result"]["worker"] == item["worker"] for item in items))
+        self.assertGreater(len({item["worker"] for item in items}), 1)
+
+
+class TestWorker(FakeServicesTestCase):
+    """Worker class tests, against the fake services of the benchmarks"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.queue = SQLiteWorkQueue(self.path / "queue.sqlite3")
+
+    def tearDown(self) -> None:
+        self.queue.close()
+        super().tearDown()
+
+    def test_several_runs(self) -> None:
+        """A run shouldn't take the videos of a previous one, whose files may be gone"""
+        songs = [f"Song {number}, Artist {number}" for number in range(3)]
+
+        async def run_twice() -> list[dict]:
+            worker = Worker(self.queue, jobs=2, search_jobs=2, poll_interval=0.01)
+            working = asyncio.create_task(worker.run())
+            failed = [await coordinate([], self.path / "run1", self.queue, songs,
+                                       poll_interval=0.01)]
+            shutil.rmtree(self.path / "run1")
+            failed.append(await coordinate([], self.path / "run2", self.queue, songs,
+                                           poll_interval=0.01))
+            working.cancel()
+            await asyncio.gather(working, return_exceptions=True)
+            return failed
+
+        self.assertEqual([{}, {}], asyncio.run(asyncio.wait_for(run_twice(), 30)))
+        self.assertEqual(3, len(list(pathlib.Path(self.path, "run2").iterdir())))
+
+
+class TestWorkerProcesses(FakeServicesTestCase):
+    """Worker processes sharing a queue, with downloads that outlast their lease"""
+    LEASE = 1.0
+    # Each song takes about 2.7 seconds to be served
+    SERVICES = {"song_size": 32 * 1024, "bandwidth": 12 * 1024}
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.queue_path = self.path / "queue.sqlite3"
+        self.queue = SQLiteWorkQueue(self.queue_path)
+        self.context = multiprocessing.get_context("spawn")
+
+    def tearDown(self) -> None:
+        self.queue.close()
+        super().tearDown()
+
+    def start_worker(self, name: str) -> multiprocessing.Process:
+        """Starts a worker process named name"""
+        process = self.context.Process(target=run_worker, args=(
+            self.services.address, self.queue_path, name, self.LEASE))
+        process.start()
+        return process
+
+    def wait_for_lease(self, worker: str, timeout: float = 30) -> None:
+        """Waits until worker holds an item of the run"""
+        deadline = time.time() + timeout
+        while not any(item["worker"] == worker and item["status"] == "leased"
+                      for item in self.queue.get_items("run")):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_crashed_worker(self) -> None:
+        """
+        The items of a killed worker should be taken over once their lease expires, while the
+        rest keep theirs renewed, and the other workers stop once the queue is drained
+        """
+        songs = get_searchstrings(6)
+        pathlib.Path(self.path, "Songs").mkdir()  # Made by the coordinator
+        self.queue.put("run", [{"song": song, "targets": [[str(self.path / "Songs"), song]],
+                                "options": {"extension": None, "keep_originals": False}}
+                               for song in songs])
+        crashed = self.start_worker("crashed")
+        self.wait_for_lease("crashed")
+        crashed.kill()
+        crashed.join()
+        taken = {item["id"] for item in self.queue.get_items("run")
+                 if item["worker"] == "crashed" and item["status"] == "leased"}
+        workers = [self.start_worker(f"w{number}") for number in range(2)]
+        peak = 0
+        while any(worker.is_alive() for worker in workers):
+            leased = [item["worker"] for item in self.queue.get_items("run")
+                      if item["status"] == "leased" and item["worker"] != "crashed"]
+            peak = max([peak] + [leased.count(worker) for worker in set(leased)])
+            time.sleep(0.05)
+        for worker in workers:
+            worker.join()
+            self.assertEqual(0, worker.exitcode)
+        items = self.queue.get_items("run")
+        self.assertTrue(all(item["status"] == "done" for item in items))
+        self.assertTrue(taken)
+        self.assertEqual(taken, {item["id"] for item in items if item["leases"] == 2})
+        self.assertTrue(all(item["leases"] == 1 for item in items if item["id"] not in taken))
+        self.assertTrue(all(item["worker"] in ("w0", "w1") for item in items
+                            if item["id"] in taken))
+        self.assertLessEqual(peak, 3)
+        self.assertEqual(6, len(list(pathlib.Path(self.path, "Songs").iterdir())))
+
+
+if __name__ == "__main__":
+    unittest.main()
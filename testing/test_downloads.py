@@ -4,21 +4,24 @@ import pathlib
 import unittest
 
 sys.path.append(str(pathlib.Path(".").absolute()))
-from downloads import DownloadManager, Downloader
+sys.path.append(str(pathlib.Path("benchmarks").absolute()))
+from fake_services import FakeServicesTestCase, get_searchstrings
+from src.downloads import DownloadManager
 
-class TestDownloader(unittest.TestCase):
-    """Downloader class tests"""
 
-    TITLE = "Hey Jude"
-    PATH = pathlib.Path("Testing")
-    PARENT = DownloadManager([TITLE], PATH)
+class TestDownloader(FakeServicesTestCase):
+    """Downloader class tests"""
 
     def test_multiple_calls_to_donwload(self) -> None:
-        """Should raise an error when star_all is called multiple times"""
-        downloader = Downloader(self.TITLE, self.PARENT)
+        """Should raise an error when download is called multiple times"""
+        title = get_searchstrings(1)[0]
+        parent = DownloadManager([title], self.path)
+        downloader = parent.downloads[0]
         with self.assertRaises(ValueError):
             downloader.download()
             downloader.download()
+        parent.wait_until_finished()
+        self.assertIsNone(downloader.get_error())
 
 
 class TestDownloadManager(unittest.TestCase):
@@ -39,6 +42,49 @@ class TestDownloadManager(unittest.TestCase):
             DownloadManager(bad_songlist, self.PATH)
 
 
+class TestDownloads(FakeServicesTestCase):
+    """DownloadManager tests against the fake services"""
+
+    def test_download_all(self) -> None:
+        """Every song should be downloaded once, duplicates and songs added later included"""
+        songs = get_searchstrings(4)
+        finished = []
+        manager = DownloadManager(songs[:3] + songs[:1], self.path,
+                                  on_finished=lambda downloader: finished.append(downloader))
+        manager.start_all()
+        manager.add_song(songs[3])
+        manager.wait_until_finished()
+        self.assertEqual({}, manager.failed)
+        self.assertEqual(5, len(finished))
+        self.assertEqual(1, manager.metrics.counters["duplicates"])
+        paths = manager.get_file_paths()
+        self.assertEqual(5, len(paths))
+        self.assertTrue(all(path.exists() for path in paths))
+        self.assertEqual(4, len(list(self.path.iterdir())))
+
+    def test_pool_status(self) -> None:
+        """Should report the busy and queued downloads and searches, none once finished"""
+        songs = get_searchstrings(4)
+        manager = DownloadManager(songs, self.path, jobs=2, search_jobs=1)
+        idle = {"busy": 0, "workers": 2, "queued": 0, "searching": 0, "search_queued": 0}
+        self.assertEqual(idle, manager.get_pool_status())
+        manager.start_all()
+        status = manager.get_pool_status()
+        self.assertLessEqual(status["busy"], 2)
+        self.assertLessEqual(status["searching"], 1)
+        manager.wait_until_finished()
+        self.assertEqual(idle, manager.get_pool_status())
+
+    def test_failures(self) -> None:
+        """A song that fails should be kept in failed instead of stopping the rest"""
+        self.services.server.RequestHandlerClass.error_rate = 1.0
+        songs = get_searchstrings(2)
+        manager = DownloadManager(songs, self.path, retries=1)
+        manager.start_all()
+        manager.wait_until_finished()
+        self.assertEqual(sorted(songs), sorted(manager.failed))
+        self.assertEqual([], manager.get_file_paths())
+        self.assertIsNotNone(manager.downloads[0].get_error())
 
 
 if __name__ == "__main__":
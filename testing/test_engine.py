@@ -0,0 +1,295 @@
+"""Tests for the engine module"""
+import sys
+import time
+import asyncio
+import pathlib
+import threading
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+sys.path.append(str(pathlib.Path("benchmarks").absolute()))
+from fake_services import (FakeServicesTestCase, get_searchstrings, get_song_size, get_stats,
+                           get_video_id, playlist_url)
+from src.cache import SearchCache
+from src.engine import SongPipeline, Stage, download_playlist
+from src.metrics import Metrics
+from src.store import AudioStore, object_name
+
+
+class TestStage(unittest.TestCase):
+    """Stage class tests"""
+
+    def test_bounded_concurrency(self) -> None:
+        """No more than limit calls should run at once, whatever the coroutines waiting"""
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+
+        def blocking_call() -> None:
+            with lock:
+                running.append(1)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        async def run_all() -> None:
+            stage = Stage("test", 3)
+
+            async def song() -> None:
+                async with stage.slot():
+                    await stage.call(blocking_call)
+
+            await asyncio.gather(*(song() for _ in range(50)))
+            stage.shutdown()
+
+        asyncio.run(run_all())
+        self.assertEqual(3, peak[0])
+
+    def test_priority_order(self) -> None:
+        """Waiting coroutines should get the slot by priority, then in arrival order"""
+        order = []
+
+        async def run_all() -> None:
+            stage = Stage("test", 1)
+            release = asyncio.Event()
+
+            async def first() -> None:
+                async with stage.slot():
+                    await release.wait()
+
+            async def song(name: str, priority: int) -> None:
+                async with stage.slot(priority):
+                    order.append(name)
+
+            tasks = [asyncio.create_task(first())]
+            await asyncio.sleep(0)
+            tasks += [asyncio.create_task(song(name, priority))
+                      for name, priority in (("a", 0), ("b", -5), ("c", 0), ("d", -5))]
+            await asyncio.sleep(0)
+            release.set()
+            await asyncio.gather(*tasks)
+            stage.shutdown()
+
+        asyncio.run(run_all())
+        self.assertEqual(["b", "d", "a", "c"], order)
+
+    def test_status(self) -> None:
+        """busy and queue_depth should count the coroutines inside and waiting for a slot"""
+
+        async def run_all() -> list[tuple[int, int]]:
+            stage = Stage("test", 2)
+            release = asyncio.Event()
+            status = [(stage.busy(), stage.queue_depth())]
+
+            async def song() -> None:
+                async with stage.slot():
+                    await release.wait()
+
+            tasks = [asyncio.create_task(song()) for _ in range(5)]
+            await asyncio.sleep(0)
+            status.append((stage.busy(), stage.queue_depth()))
+            release.set()
+            await asyncio.gather(*tasks)
+            status.append((stage.busy(), stage.queue_depth()))
+            stage.shutdown()
+            return status
+
+        self.assertEqual([(0, 0), (2, 3), (0, 0)], asyncio.run(run_all()))
+
+    def test_cancelled_waiter(self) -> None:
+        """A coroutine cancelled while waiting shouldn't keep a slot"""
+
+        async def run_all() -> bool:
+            stage = Stage("test", 1)
+            async with stage.slot():
+                waiter = asyncio.create_task(stage.slot().__aenter__())
+                await asyncio.sleep(0)
+                waiter.cancel()
+            async with stage.slot():
+                entered = True
+            stage.shutdown()
+            return entered
+
+        self.assertTrue(asyncio.run(asyncio.wait_for(run_all(), 1)))
+
+
+class TestSongPipeline(FakeServicesTestCase):
+    """SongPipeline class tests"""
+
+    def process_all(self, songs: list[str], folder: pathlib.Path, **options) -> Metrics:
+        """Processes songs into folder with a new pipeline, returning its metrics"""
+        metrics = Metrics()
+
+        async def run_all() -> None:
+            pipeline = SongPipeline(len(songs), metrics=metrics, **options)
+            try:
+                await asyncio.gather(*(pipeline.process(song, folder) for song in songs))
+            finally:
+                pipeline.close()
+
+        folder.mkdir(parents=True, exist_ok=True)
+        asyncio.run(asyncio.wait_for(run_all(), 30))
+        return metrics
+
+    def test_duplicates(self) -> None:
+        """Songs resolved to the same video should wait for its file instead of downloading it"""
+        songs = get_searchstrings(2)
+        metrics = self.process_all([songs[0], songs[1], songs[0], songs[0]], self.path / "Songs")
+        self.assertEqual(sorted(get_video_id(song) for song in songs),
+                         sorted(self.get_completed(2)))
+        self.assertEqual(2, metrics.counters["duplicates"])
+        self.assertEqual(2, len(list(pathlib.Path(self.path, "Songs").iterdir())))
+
+    def test_store_before_resolving(self) -> None:
+        """With the stream cached, a stored song shouldn't be resolved again"""
+        songs = get_searchstrings(5)
+        options = {"cache": SearchCache(self.path / "cache.sqlite3"),
+                   "store": AudioStore(self.path / "store")}
+        self.process_all(songs, self.path / "first", **options)
+        self.assertEqual(5, self.get_player_requests())
+        metrics = self.process_all(songs, self.path / "second", **options)
+        self.assertEqual(5, self.get_player_requests())
+        self.assertEqual(5, metrics.counters["store_hits"])
+        self.assertEqual(5, len(list(pathlib.Path(self.path, "second").iterdir())))
+
+    def test_stored_conversions(self) -> None:
+        """Songs whose conversions are all stored shouldn't be downloaded, even if evicted"""
+        songs = get_searchstrings(3)
+        store = AudioStore(self.path / "store")
+        for song in songs:
+            for extension in ("mp3", "ogg"):
+                source = pathlib.Path(self.path, f"source.{extension}")
+                source.write_bytes(extension.encode())
+                store.put(object_name(get_video_id(song), 251, extension, converted=True),
+                          source)
+        metrics = self.process_all(songs, self.path / "Songs", extension="mp3,ogg",
+                                   store=store)
+        self.assertEqual({}, get_stats(self.services.address)["completed"])
+        self.assertEqual(6, metrics.counters["conversion_store_hits"])
+        self.assertEqual(sorted(f"{song.split(',')[0]}.{extension}" for song in songs
+                                for extension in ("mp3", "ogg")),
+                         sorted(path.name for path in pathlib.Path(self.path, "Songs").iterdir()))
+
+    def test_conversion_off_the_loop(self) -> None:
+        """Conversions, which touch the file and the store, shouldn't be submitted from the loop"""
+        songs = get_searchstrings(2)
+        threads = []
+
+        async def run_all() -> None:
+            pipeline = SongPipeline(len(songs), extension="mp4",
+                                    store=AudioStore(self.path / "store"))
+            submit = pipeline.conversions.submit
+
+            def record_thread(*args):
+                threads.append(threading.current_thread())
+                return submit(*args)
+
+            pipeline.conversions.submit = record_thread
+            try:
+                await asyncio.gather(*(pipeline.process(song, self.path) for song in songs))
+            finally:
+                pipeline.close()
+
+        asyncio.run(asyncio.wait_for(run_all(), 30))
+        self.assertEqual(2, len(threads))
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestSchedule(FakeServicesTestCase):
+    """Download schedule tests, with streams of several sizes served slowly"""
+    SERVICES = {"song_size": 64 * 1024, "sizes": "uniform", "bandwidth": 256 * 1024}
+
+    def test_largest_first(self) -> None:
+        """Once the first song takes the only slot, the rest should be downloaded biggest first"""
+        songs = get_searchstrings(6)
+
+        async def run_all() -> None:
+            pipeline = SongPipeline(len(songs), jobs=1, schedule="largest-first")
+            try:
+                await asyncio.gather(*(pipeline.process(song, self.path) for song in songs))
+            finally:
+                pipeline.close()
+
+        asyncio.run(asyncio.wait_for(run_all(), 30))
+        sizes = [get_song_size(video_id, 64 * 1024, "uniform")
+                 for video_id in self.get_completed(6)]
+        self.assertEqual(6, len(sizes))
+        self.assertEqual(sorted(sizes[1:], reverse=True), sizes[1:])
+
+    def test_unknown_schedule(self) -> None:
+        """Should raise an error when the schedule isn't one of SCHEDULES"""
+        with self.assertRaises(ValueError):
+            SongPipeline(1, schedule="smallest-first")
+
+
+class TestDownloadPlaylist(FakeServicesTestCase):
+    """download_playlist function tests"""
+
+    def test_failures(self) -> None:
+        """Failed songs should be returned, not stop the rest, and be retried by a later sync"""
+        handler = self.services.server.RequestHandlerClass
+        handler.error_rate = 1.0
+        songs = get_searchstrings(3)
+        url = playlist_url(3)
+        failed = asyncio.run(asyncio.wait_for(download_playlist(
+            [url], self.path, appended_songs=songs[:1], sync=True, retries=1), 30))
+        self.assertEqual(sorted(songs), sorted(failed))
+        self.assertTrue(all(isinstance(error, Exception) for error in failed.values()))
+        handler.error_rate = 0.0
+        failed = asyncio.run(asyncio.wait_for(download_playlist(
+            [url], self.path, sync=True, retries=1), 30))
+        self.assertEqual({}, failed)
+        self.assertEqual(3, len([path for path in self.path.iterdir()
+                                 if path.suffix in (".mp4", ".webm")]))
+
+    def test_failed_playlist(self) -> None:
+        """A playlist that can't be scraped should be reported, not stop the others"""
+        bad_url = "https://example.com/playlist/bench3"
+        urls = [playlist_url(3), bad_url, playlist_url(2)]
+        for sync in (False, True):
+            with self.subTest(sync=sync):
+                path = pathlib.Path(self.path, f"sync_{sync}")
+                failed = asyncio.run(asyncio.wait_for(download_playlist(
+                    urls, path, sync=sync, prune=sync), 30))
+                self.assertEqual([bad_url], list(failed))
+                self.assertIsInstance(failed[bad_url], ValueError)
+                self.assertEqual([2, 3], sorted(
+                    len([song for song in folder.iterdir() if song.suffix == ".webm"])
+                    for folder in path.iterdir()))
+
+    def test_failed_playlist_not_pruned(self) -> None:
+        """The songs of a playlist that can't be scraped shouldn't be pruned"""
+        asyncio.run(asyncio.wait_for(download_playlist(
+            [playlist_url(3)], self.path, sync=True), 30))
+        songs = sorted(self.path.iterdir())
+        failed = asyncio.run(asyncio.wait_for(download_playlist(
+            ["https://example.com/playlist/bench3"], self.path, sync=True, prune=True), 30))
+        self.assertEqual(1, len(failed))
+        self.assertEqual(songs, sorted(self.path.iterdir()))
+
+
+
+class TestStreaming(FakeServicesTestCase):
+    """Songs sent through the pipeline as the pages of their playlist arrive"""
+    SERVICES = {"song_size": 16 * 1024, "latency": 0.1}
+
+    def test_search_while_scraping(self) -> None:
+        """The first songs should be searched before the last pages of the playlist arrive"""
+        metrics = Metrics()
+
+        async def search_first_song() -> bool:
+            downloading = asyncio.create_task(download_playlist(
+                [playlist_url(1000)], self.path, metrics=metrics))
+            while not (await asyncio.to_thread(get_stats, self.services.address))["searched"]:
+                await asyncio.sleep(0.01)
+            scraped = "scrape" in metrics.stages
+            downloading.cancel()
+            await asyncio.gather(downloading, return_exceptions=True)
+            return scraped
+
+        self.assertFalse(asyncio.run(asyncio.wait_for(search_first_song(), 30)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests for the metrics module"""
+import sys
+import json
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Metrics class tests"""
+
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.metrics.record("search", 0.2, "Hey Jude, The Beatles")
+        self.metrics.record("search", 0.4, "Purple Rain, Prince")
+        self.metrics.record("download", 2.0, "Hey Jude, The Beatles")
+        self.metrics.count("bytes", 1000, "Hey Jude, The Beatles")
+        self.metrics.count("bytes", 500, "Purple Rain, Prince")
+
+    def test_report(self) -> None:
+        """Stages and counters should be aggregated overall and per song"""
+        report = self.metrics.to_dict()
+        self.assertEqual(2, report["stages"]["search"]["count"])
+        self.assertAlmostEqual(0.6, report["stages"]["search"]["total_seconds"])
+        self.assertAlmostEqual(0.4, report["stages"]["search"]["max_seconds"])
+        self.assertEqual({"bytes": 1500}, report["counters"])
+        self.assertEqual({"stages": {"search": 0.2, "download": 2.0},
+                          "counters": {"bytes": 1000}},
+                         report["songs"]["Hey Jude, The Beatles"])
+
+    def test_measure(self) -> None:
+        """The time inside the block should be recorded even if it raises"""
+        with self.assertRaises(ValueError):
+            with self.metrics.measure("convert", "Hey Jude, The Beatles"):
+                raise ValueError()
+        self.assertEqual(1, self.metrics.to_dict()["stages"]["convert"]["count"])
+
+    def test_prometheus(self) -> None:
+        """Histogram buckets should be cumulative, ending with the total count"""
+        lines = self.metrics.to_prometheus().splitlines()
+        self.assertIn('playlist_downloader_stage_seconds_bucket{stage="search",le="0.1"} 0',
+                      lines)
+        self.assertIn('playlist_downloader_stage_seconds_bucket{stage="search",le="0.5"} 2',
+                      lines)
+        self.assertIn('playlist_downloader_stage_seconds_count{stage="download"} 1', lines)
+        self.assertIn("playlist_downloader_bytes_total 1500", lines)
+
+    def test_save_format(self) -> None:
+        """Reports should be saved as Prometheus text or JSON depending on the suffix"""
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = pathlib.Path(directory, "metrics.json")
+            prometheus_path = pathlib.Path(directory, "metrics.prom")
+            self.metrics.save(json_path)
+            self.metrics.save(prometheus_path)
+            self.assertEqual(1500, json.loads(json_path.read_text())["counters"]["bytes"])
+            self.assertIn("# TYPE playlist_downloader_stage_seconds histogram",
+                          prometheus_path.read_text())
+            text_path = pathlib.Path(directory, "metrics.txt")
+            self.metrics.save(text_path)
+            self.assertIn("# TYPE playlist_downloader_stage_seconds histogram",
+                          text_path.read_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
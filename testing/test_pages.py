@@ -0,0 +1,148 @@
+"""Tests for the pages module"""
+import sys
+import json
+import pathlib
+import threading
+import http.client
+import unittest
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.pages import ConnectionPool, PlaylistFetcher, get_page_urls
+from src.workers import WorkerPool
+
+TOTAL = 250
+LIMIT = 100
+TOKEN = "fixture-token"
+TRACKS = [{"type": "track", "name": f"Song {i}",
+           "artists": [{"type": "artist", "name": f"Artist {i}"}]} for i in range(TOTAL)]
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of Spotify: serves a playlist page holding its first LIMIT tracks and json pages
+    with the rest. Pages are only served with the page's access token, and the last page isn't
+    served until `last_page_gate` is set. The client ports of the requests are logged.
+    """
+    protocol_version = "HTTP/1.1"
+    last_page_gate = threading.Event()
+    client_ports = set()
+    failing_offset = None
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serves the playlist page or one of its json pages"""
+        self.client_ports.add(self.client_address[1])
+        url = urlsplit(self.path)
+        if url.path == "/playlist/fixture":
+            self.send_body(self.playlist_page(), "text/html")
+            return
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            self.send_error(401)
+            return
+        query = parse_qs(url.query)
+        offset, limit = int(query["offset"][0]), int(query["limit"][0])
+        if offset == self.failing_offset:
+            self.send_error(500)
+            return
+        if offset + limit >= TOTAL:
+            self.last_page_gate.wait(10)
+        page = {"items": [{"track": track} for track in TRACKS[offset:offset + limit]],
+                "total": TOTAL, "offset": offset, "limit": limit}
+        self.send_body(json.dumps(page), "application/json")
+
+    def playlist_page(self) -> str:
+        """Html page embedding the first tracks, their pagination and the access token"""
+        host = f"http://{self.headers['Host']}"
+        resource = {"type": "playlist", "name": "Fixture",
+                    "tracks": {"items": [{"track": track} for track in TRACKS[:LIMIT]],
+                               "total": TOTAL, "offset": 0, "limit": LIMIT,
+                               "next": f"{host}/v1/playlists/fixture/tracks?offset={LIMIT}"}}
+        session = {"accessToken": TOKEN}
+        return ("<html><head>"
+                f'<script id="session" type="application/json">{json.dumps(session)}</script>'
+                f'<script id="resource" type="application/json">{json.dumps(resource)}</script>'
+                "</head><body><h1>Fixture</h1></body></html>")
+
+    def send_body(self, body: str, content_type: str) -> None:
+        """Sends body with a content length, so the connection can be kept alive"""
+        encoded_body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        """Silences the server logs"""
+
+
+class TestPlaylistFetcher(unittest.TestCase):
+    """PlaylistFetcher tests against a local server"""
+
+    def setUp(self) -> None:
+        PlaylistHandler.last_page_gate = threading.Event()
+        PlaylistHandler.client_ports = set()
+        PlaylistHandler.failing_offset = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PlaylistHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/playlist/fixture"
+
+    def tearDown(self) -> None:
+        PlaylistHandler.last_page_gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_all_pages_in_order(self) -> None:
+        """Every track should be yielded once, in playlist order"""
+        PlaylistHandler.last_page_gate.set()
+        fetcher = PlaylistFetcher(self.url, jobs=2)
+        titles = [track["title"] for track in fetcher]
+        self.assertEqual([track["name"] for track in TRACKS], titles)
+        # One connection for the first page and one per page worker, at most
+        self.assertLessEqual(len(PlaylistHandler.client_ports), 3)
+
+    def test_tracks_before_last_page(self) -> None:
+        """Tracks of the first pages should be yielded while the last one is still pending"""
+        fetcher = PlaylistFetcher(self.url, jobs=2)
+        tracks = iter(fetcher)
+        first_tracks = [next(tracks) for _ in range(2 * LIMIT)]
+        self.assertEqual("Song 199", first_tracks[-1]["title"])
+        PlaylistHandler.last_page_gate.set()
+        self.assertEqual(TOTAL - 2 * LIMIT, len(list(tracks)))
+
+    def test_shared_page_workers(self) -> None:
+        """Fetchers sharing their page workers should reuse their connections"""
+        PlaylistHandler.last_page_gate.set()
+        connections = ConnectionPool()
+        pages = WorkerPool(2, name="page")
+        for _ in range(5):
+            fetcher = PlaylistFetcher(self.url, connections=connections, pages=pages)
+            self.assertEqual(TOTAL, len(list(fetcher)))
+        pages.shutdown()
+        connections.close()
+        # One connection for the first pages and one per page worker, at most
+        self.assertLessEqual(len(PlaylistHandler.client_ports), 3)
+
+    def test_failed_page(self) -> None:
+        """A page that fails should stop the iteration, closing the workers and connections"""
+        PlaylistHandler.last_page_gate.set()
+        PlaylistHandler.failing_offset = LIMIT
+        fetcher = PlaylistFetcher(self.url, jobs=2)
+        with self.assertRaises(http.client.HTTPException):
+            list(fetcher)
+        self.assertEqual([], [thread for thread in threading.enumerate()
+                              if thread.name.startswith("page-")])
+        self.assertEqual([], fetcher.connections._connections)  # pylint: disable=protected-access
+
+    def test_page_urls(self) -> None:
+        """Page urls should cover the playlist after the first page, keeping other parameters"""
+        pagination = {"total": 250, "limit": 100, "offset": 0, "next": None}
+        urls = get_page_urls("https://host/playlist/id?si=abc", pagination, 100)
+        self.assertEqual(["https://host/playlist/id?si=abc&offset=100&limit=100",
+                          "https://host/playlist/id?si=abc&offset=200&limit=100"], urls)
+        self.assertEqual([], get_page_urls("https://host/playlist/id", None, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
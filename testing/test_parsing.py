@@ -0,0 +1,59 @@
+"""Tests for the parsing module"""
+import sys
+import pathlib
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.parsing import PlaylistPageParser, parse_playlist_page
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+class TestPlaylistPageParser(unittest.TestCase):
+    """
+    PlaylistPageParser tests, over saved pages embedding the same playlist in different shapes.
+        Attributes:
+            FIXTURE_NAMES (str list): pages with web api, base64 graphql and ld+json data
+            TITLES (str list): contains titles with numbers, which the text parsing can't split
+            ARTISTS (str list): contains the artists of each song, joined if there are several
+    """
+
+    FIXTURE_NAMES = ["playlist_resource.html",
+                     "playlist_initial_state.html",
+                     "playlist_ld_json.html"]
+
+    TITLES = ["Todo Para Todos", "Life On Mars?", "Alfonsina y el mar", "99 Luftballons",
+              "1979", "Under Pressure"]
+
+    ARTISTS = ["Enric Montefusco", "Seu Jorge", "Avishai Cohen", "Nena",
+               "The Smashing Pumpkins", "Queen, David Bowie"]
+
+    def read_fixture(self, name: str) -> str:
+        """Returns the html of the fixture page"""
+        return pathlib.Path(FIXTURES, name).read_text(encoding="utf-8")
+
+    def test_fixtures(self) -> None:
+        """Every page shape should give the same titles and artists, in order"""
+        for name in self.FIXTURE_NAMES:
+            with self.subTest(fixture=name):
+                tracks = parse_playlist_page(self.read_fixture(name))
+                self.assertEqual(self.TITLES, [track["title"] for track in tracks])
+                self.assertEqual(self.ARTISTS, [track["artist"] for track in tracks])
+
+    def test_incremental_feed(self) -> None:
+        """Feeding the page in small chunks should give the same result as a whole"""
+        html = self.read_fixture(self.FIXTURE_NAMES[1])
+        parser = PlaylistPageParser()
+        for start in range(0, len(html), 7):
+            parser.feed(html[start:start + 7])
+        parser.close()
+        self.assertEqual(parse_playlist_page(html), parser.get_tracks())
+
+    def test_page_without_data(self) -> None:
+        """A page without structured data should give no tracks"""
+        html = "<html><body><script>var a = 1;</script><p>Hey Jude</p></body></html>"
+        self.assertEqual([], parse_playlist_page(html))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for the progressbar module"""
+import io
+import sys
+import pathlib
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.progressbar import DownloadProgressBar
+
+
+class FakeStream:
+    """Minimal stand-in of a pytube Stream: only its filesize is needed"""
+
+    def __init__(self, filesize: int) -> None:
+        self.filesize = filesize
+
+
+class TestDownloadProgressBar(unittest.TestCase):
+    """DownloadProgressBar class tests"""
+
+    CHUNK_SIZE = 10
+    CHUNKS = 500
+
+    def setUp(self) -> None:
+        self.stderr = redirect_stderr(io.StringIO())
+        self.stderr.__enter__()
+
+    def tearDown(self) -> None:
+        self.stderr.__exit__(None, None, None)
+
+    def download(self, progress_bar: DownloadProgressBar, song) -> None:
+        """Sends the callbacks of a whole download of song, of CHUNKS chunks"""
+        for chunk in range(self.CHUNKS):
+            remaining_bytes = (self.CHUNKS - chunk - 1) * self.CHUNK_SIZE
+            progress_bar.callback(song, b"", remaining_bytes)
+
+    def test_concurrent_callbacks(self) -> None:
+        """Callbacks from many threads shouldn't lose any byte"""
+        streams = [FakeStream(self.CHUNK_SIZE * self.CHUNKS) for _ in range(16)]
+        progress_bar = DownloadProgressBar(streams, refresh_interval=0.01)
+        threads = [threading.Thread(target=self.download, args=(progress_bar, stream))
+                   for stream in streams]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        progress_bar.close()
+        self.assertEqual(progress_bar.total_bytes, progress_bar.downloaded_bytes)
+        self.assertEqual(progress_bar.total_bytes, progress_bar.download_bar.n)
+        self.assertTrue(progress_bar.is_finished())
+
+    def test_finished_tracking(self) -> None:
+        """The bar shouldn't be finished while a stream, even a late one, is pending"""
+        first_stream = FakeStream(self.CHUNK_SIZE * self.CHUNKS)
+        progress_bar = DownloadProgressBar([first_stream])
+        self.download(progress_bar, first_stream)
+        self.assertTrue(progress_bar.is_finished())
+        progress_bar.add_stream(FakeStream(100))
+        self.assertFalse(progress_bar.is_finished())
+        self.assertEqual(self.CHUNK_SIZE * self.CHUNKS + 100, progress_bar.total_bytes)
+        progress_bar.close()
+
+    def test_unknown_sizes(self) -> None:
+        """Songs should be counted before their sizes are known, which grow the total later"""
+        progress_bar = DownloadProgressBar([])
+        progress_bar.add_song("first")
+        progress_bar.add_song("second", 100)
+        self.assertEqual(100, progress_bar.total_bytes)
+        self.assertEqual(1, progress_bar.unknown_sizes)
+        progress_bar.set_filesize("first", self.CHUNK_SIZE * self.CHUNKS)
+        self.assertEqual(self.CHUNK_SIZE * self.CHUNKS + 100, progress_bar.total_bytes)
+        self.assertEqual(0, progress_bar.unknown_sizes)
+        self.download(progress_bar, "first")
+        progress_bar.render()
+        self.assertEqual("1/2 songs", progress_bar.download_bar.desc)
+        progress_bar.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Tests for the ratelimit module"""
+import sys
+import time
+import pathlib
+import threading
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.ratelimit import RateLimiter
+
+RATE = 4 * 1024 * 1024  # 4MiB/s
+CHUNK = 32 * 1024
+
+
+class TestRateLimiter(unittest.TestCase):
+    """RateLimiter class tests"""
+
+    def test_burst(self) -> None:
+        """A full bucket should let the burst through without waiting"""
+        limiter = RateLimiter(RATE, burst=4 * CHUNK)
+        waited = sum(limiter.consume(CHUNK) for _ in range(4))
+        self.assertEqual(0, waited)
+        self.assertGreater(limiter.consume(CHUNK), 0)
+
+    def test_shared_rate(self) -> None:
+        """Concurrent consumers should add up to the rate, each one getting an even share"""
+        limiter = RateLimiter(RATE, burst=CHUNK)
+        consumed = [0] * 4
+        stop = threading.Event()
+
+        def consume(i: int) -> None:
+            while not stop.is_set():
+                limiter.consume(CHUNK)
+                consumed[i] += CHUNK
+
+        threads = [threading.Thread(target=consume, args=(i,)) for i in range(4)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        rate = (sum(consumed) - CHUNK) / (time.monotonic() - start)
+        self.assertAlmostEqual(1, rate / RATE, delta=0.1)
+        self.assertLessEqual(max(consumed) - min(consumed), 2 * CHUNK)
+
+    def test_invalid_rate(self) -> None:
+        """Rates that aren't positive should raise a ValueError"""
+        self.assertRaises(ValueError, RateLimiter, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
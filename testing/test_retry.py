@@ -0,0 +1,120 @@
+"""Tests for the retry module"""
+import sys
+import time
+import pathlib
+import threading
+import unittest
+from email.message import Message
+from email.utils import formatdate
+from urllib.error import HTTPError
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.retry import CircuitBreaker, RetryPolicy, get_retry_after, is_retryable
+
+
+def http_error(code: int, retry_after: str = None) -> HTTPError:
+    """Returns an HTTPError with the status code and, if provided, a Retry-After header"""
+    headers = Message()
+    if retry_after:
+        headers["Retry-After"] = retry_after
+    return HTTPError("http://localhost/", code, "Error", headers, None)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """RetryPolicy class tests"""
+
+    def test_transient_errors(self) -> None:
+        """Transient errors should be retried until the task succeeds"""
+        errors = [ConnectionError(), http_error(503)]
+
+        def task() -> str:
+            if errors:
+                raise errors.pop()
+            return "done"
+
+        retried = []
+        policy = RetryPolicy(attempts=3, base_delay=0)
+        self.assertEqual("done", policy.call(task, retried.append))
+        self.assertEqual(2, len(retried))
+
+    def test_attempts_run_out(self) -> None:
+        """The last error should be raised once the attempts run out"""
+        calls = []
+
+        def task() -> None:
+            calls.append(1)
+            raise ConnectionError()
+
+        self.assertRaises(ConnectionError, RetryPolicy(attempts=3, base_delay=0).call, task)
+        self.assertEqual(3, len(calls))
+
+    def test_permanent_errors(self) -> None:
+        """Errors that won't go away by retrying should be raised at once"""
+        calls = []
+
+        def task() -> None:
+            calls.append(1)
+            raise http_error(404)
+
+        self.assertRaises(HTTPError, RetryPolicy(base_delay=0).call, task)
+        self.assertEqual(1, len(calls))
+        self.assertFalse(is_retryable(ValueError()))
+        self.assertTrue(is_retryable(http_error(429)))
+
+    def test_delay(self) -> None:
+        """Delays should grow exponentially up to max_delay, or be as long as Retry-After"""
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+        for attempt in range(5):
+            self.assertLessEqual(policy.get_delay(attempt), min(4, 2 ** attempt))
+        self.assertGreaterEqual(policy.get_delay(0, http_error(429, "10")), 10)
+
+    def test_retry_after(self) -> None:
+        """Retry-After should be read both as seconds and as a date"""
+        self.assertEqual(3, get_retry_after(http_error(429, "3")))
+        self.assertAlmostEqual(60, get_retry_after(http_error(503, formatdate(time.time() + 60))),
+                               delta=2)
+        self.assertIsNone(get_retry_after(http_error(429)))
+        self.assertIsNone(get_retry_after(ConnectionError()))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """CircuitBreaker class tests"""
+
+    def test_limit(self) -> None:
+        """The limit should halve when errors reach the threshold and grow back on successes"""
+        breaker = CircuitBreaker(8, window=4, threshold=0.5)
+        breaker.record_failure()
+        breaker.record_success()
+        self.assertEqual(8, breaker.limit)
+        breaker.record_failure()
+        self.assertEqual(4, breaker.limit)
+        for _ in range(4):
+            breaker.record_success()
+        self.assertEqual(5, breaker.limit)
+
+    def test_slots(self) -> None:
+        """Requests beyond the limit should wait until a slot is released"""
+        breaker = CircuitBreaker(1)
+        entered = threading.Event()
+
+        def request() -> None:
+            with breaker.slot():
+                entered.set()
+
+        with breaker.slot():
+            thread = threading.Thread(target=request)
+            thread.start()
+            self.assertFalse(entered.wait(0.1))
+        self.assertTrue(entered.wait(1))
+        thread.join()
+
+    def test_throttled(self) -> None:
+        """A throttled request should lower the limit below the requests running"""
+        breaker = CircuitBreaker(8)
+        with breaker.slot(), breaker.slot(), breaker.slot():
+            breaker.record_failure(throttled=True)
+        self.assertEqual(2, breaker.limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,7 @@ import pathlib
 import unittest
 
 sys.path.append(str(pathlib.Path(".").absolute()))
-from scrap import Scrapper
+from src.scrap import Scrapper
 
 class TestScrapper(unittest.TestCase):
     """
@@ -2,9 +2,10 @@
 import sys
 import pathlib
 import unittest
+from types import SimpleNamespace
 
 sys.path.append(str(pathlib.Path(".").absolute()))
-from search import YTVideo
+from src.search import YTVideo, select_audio_stream
 
 class TestYTVideo(unittest.TestCase):
     """YTVideo class tests"""
@@ -16,5 +17,25 @@ class TestYTVideo(unittest.TestCase):
             YTVideo(unusual_searchstring)
 
 
+class TestSelectAudioStream(unittest.TestCase):
+    """select_audio_stream function tests"""
+    AAC = SimpleNamespace(itag=140, subtype="mp4", bitrate=130000)
+    OPUS_LOW = SimpleNamespace(itag=250, subtype="webm", bitrate=70000)
+    OPUS = SimpleNamespace(itag=251, subtype="webm", bitrate=140000)
+
+    def test_highest_bitrate(self) -> None:
+        """Without an extension, or one no stream can be remuxed into, the best one is picked"""
+        streams = [self.OPUS_LOW, self.AAC, self.OPUS]
+        self.assertIs(self.OPUS, select_audio_stream(streams))
+        self.assertIs(self.OPUS, select_audio_stream(streams, "mp3"))
+
+    def test_remuxable(self) -> None:
+        """Streams whose codec the extension can hold should be preferred"""
+        streams = [self.OPUS_LOW, self.AAC, self.OPUS]
+        self.assertIs(self.AAC, select_audio_stream(streams, "mp4"))
+        self.assertIs(self.OPUS, select_audio_stream(streams, "ogg"))
+        self.assertIs(self.AAC, select_audio_stream([self.AAC], "ogg"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for the store module"""
+import sys
+import time
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.conversion import ConversionPipeline
+from src.store import AudioStore, object_name
+
+
+class TestAudioStore(unittest.TestCase):
+    """AudioStore class tests"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+        self.store = AudioStore(pathlib.Path(self.path, "store"), max_size=10)
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.directory.cleanup()
+
+    def write_song(self, name: str, content: bytes) -> pathlib.Path:
+        """Writes a fake song file in the temporary folder"""
+        song_path = pathlib.Path(self.path, name)
+        song_path.write_bytes(content)
+        return song_path
+
+    def test_hit_is_hardlinked(self) -> None:
+        """A stored song should be placed in a new folder without copying it"""
+        source = self.write_song("Hey Jude.mp4", b"audio")
+        name = object_name("A_MjCqQoLLA", 140, "mp4")
+        self.store.put(name, source)
+        destination = pathlib.Path(self.path, "other", "Hey Jude.mp4")
+        destination.parent.mkdir()
+        self.assertTrue(self.store.materialize(name, destination))
+        self.assertEqual(source.stat().st_ino, destination.stat().st_ino)
+
+    def test_miss(self) -> None:
+        """Songs never stored, or whose stored file is gone, shouldn't be materialized"""
+        destination = pathlib.Path(self.path, "Hey Jude.mp4")
+        self.assertFalse(self.store.materialize(object_name("A_MjCqQoLLA", 140, "mp4"),
+                                                destination))
+        name = object_name("A_MjCqQoLLA", 140, "mp3", converted=True)
+        self.store.put(name, self.write_song("Hey Jude.mp3", b"audio"))
+        self.store.get_object_path(name).unlink()
+        self.assertFalse(self.store.materialize(name, destination))
+        self.assertFalse(destination.exists())
+
+    def test_least_recently_used_removed(self) -> None:
+        """Beyond max_size, the least recently used songs should be removed first"""
+        names = [object_name(f"video{i}", 140, "mp4") for i in range(3)]
+        self.store.put(names[0], self.write_song("0.mp4", b"1234"))
+        time.sleep(0.01)
+        self.store.put(names[1], self.write_song("1.mp4", b"1234"))
+        time.sleep(0.01)
+        self.assertTrue(self.store.materialize(names[0], pathlib.Path(self.path, "copy.mp4")))
+        time.sleep(0.01)
+        self.store.put(names[2], self.write_song("2.mp4", b"1234"))
+        self.assertFalse(self.store.get_object_path(names[1]).exists())
+        self.assertTrue(self.store.get_object_path(names[0]).exists())
+        self.assertEqual(8, self.store.get_size())
+
+    def test_bigger_than_max_size(self) -> None:
+        """A song bigger than the store shouldn't be stored, nor evict the rest"""
+        small, big = object_name("video0", 140, "mp4"), object_name("video1", 140, "mp4")
+        self.assertTrue(self.store.put(small, self.write_song("0.mp4", b"1234")))
+        self.assertFalse(self.store.put(big, self.write_song("1.mp4", b"12345678901")))
+        self.assertFalse(self.store.contains(big))
+        self.assertTrue(self.store.contains(small))
+        self.assertEqual(4, self.store.get_size())
+
+    def test_conversion_hit(self) -> None:
+        """A stored conversion should be used instead of converting the file again"""
+        original = self.write_song("Hey Jude.mp4", b"original")
+        name = object_name("A_MjCqQoLLA", 140, "mp3", converted=True)
+        self.store.put(name, self.write_song("stored.mp3", b"mp3"))
+        pipeline = ConversionPipeline("mp3", workers=1, store=self.store)
+        pipeline.submit(original, {"mp3": name})
+        pipeline.wait_until_finished()
+        self.assertEqual({}, pipeline.errors)
+        self.assertEqual(b"mp3", pathlib.Path(self.path, "Hey Jude.mp3").read_bytes())
+        self.assertFalse(original.exists())
+
+    def test_conversions_taken_without_original(self) -> None:
+        """Conversions to every format should be taken from the store only if all are stored"""
+        names = {extension: object_name("A_MjCqQoLLA", 251, extension, converted=True)
+                 for extension in ("mp3", "ogg")}
+        self.store.put(names["mp3"], self.write_song("stored.mp3", b"mp3"))
+        path = pathlib.Path(self.path, "Hey Jude.webm")
+        pipeline = ConversionPipeline("mp3,ogg", workers=1, store=self.store)
+        self.assertFalse(pipeline.take_stored(path, names))
+        self.assertFalse(path.with_suffix(".mp3").exists())
+        self.store.put(names["ogg"], self.write_song("stored.ogg", b"ogg"))
+        self.assertTrue(pipeline.take_stored(path, names))
+        kept = ConversionPipeline("mp3,ogg", workers=1, store=self.store, delete_originals=False)
+        self.assertFalse(kept.take_stored(path, names))
+        pipeline.wait_until_finished()
+        kept.wait_until_finished()
+        self.assertEqual(b"ogg", path.with_suffix(".ogg").read_bytes())
+        self.assertFalse(path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
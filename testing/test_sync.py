@@ -0,0 +1,77 @@
+"""Tests for the sync module"""
+import sys
+import pathlib
+import tempfile
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.sync import Manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Manifest class tests"""
+
+    SONGS = ["Hey Jude, The Beatles", "Purple Rain, Prince"]
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def add_song(self, manifest: Manifest, song: str, extension: str = "mp4") -> pathlib.Path:
+        """Writes a fake song file and records it in manifest"""
+        song_path = pathlib.Path(self.path, f"{song}.{extension}")
+        song_path.write_bytes(song.encode())
+        manifest.add(song, "video_id", song_path)
+        return song_path
+
+    def test_missing_songs(self) -> None:
+        """Only songs not recorded in a saved manifest should be missing"""
+        manifest = Manifest(self.path)
+        self.add_song(manifest, self.SONGS[0])
+        manifest.save()
+        missing = Manifest(self.path).get_missing(self.SONGS)
+        self.assertEqual([self.SONGS[1]], missing)
+
+    def test_deleted_file_is_missing(self) -> None:
+        """A recorded song whose file was deleted should be downloaded again"""
+        manifest = Manifest(self.path)
+        self.add_song(manifest, self.SONGS[0]).unlink()
+        self.assertEqual(self.SONGS, manifest.get_missing(self.SONGS))
+
+    def test_other_format_is_missing(self) -> None:
+        """A recorded song in a different format than requested should be missing"""
+        manifest = Manifest(self.path)
+        self.add_song(manifest, self.SONGS[0], "mp3")
+        self.assertEqual([], manifest.get_missing(self.SONGS[:1], "mp3"))
+        self.assertEqual(self.SONGS[:1], manifest.get_missing(self.SONGS[:1], "ogg"))
+
+    def test_several_formats(self) -> None:
+        """A song should be missing unless it's recorded in every format requested"""
+        manifest = Manifest(self.path)
+        paths = [pathlib.Path(self.path, f"{self.SONGS[0]}.{extension}")
+                 for extension in ("mp3", "ogg")]
+        for path in paths:
+            path.write_bytes(b"song")
+        manifest.add(self.SONGS[0], "video_id", *paths)
+        manifest.save()
+        manifest = Manifest(self.path)
+        self.assertEqual([], manifest.get_missing(self.SONGS[:1], "ogg,mp3"))
+        self.assertEqual(self.SONGS[:1], manifest.get_missing(self.SONGS[:1], "mp3,mp4"))
+        paths[1].unlink()
+        self.assertEqual(self.SONGS[:1], manifest.get_missing(self.SONGS[:1], "mp3"))
+
+    def test_prune(self) -> None:
+        """Songs no longer in the playlist should be removed along with their files"""
+        manifest = Manifest(self.path)
+        removed_path = self.add_song(manifest, self.SONGS[0])
+        kept_path = self.add_song(manifest, self.SONGS[1])
+        self.assertEqual(self.SONGS[:1], manifest.prune(self.SONGS[1:]))
+        self.assertFalse(removed_path.exists())
+        self.assertTrue(kept_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests for the transfer module"""
+import sys
+import time
+import pathlib
+import tempfile
+import threading
+import unittest
+from urllib.error import HTTPError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.ratelimit import RateLimiter
+from src.retry import RetryPolicy
+from src.transfer import download_resumable, download_segmented, get_part_path, split_ranges
+
+CONTENT = bytes(range(256)) * 4096  # 1MiB
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Serves CONTENT honoring Range headers, but drops the connection after sending
+    `drop_after` bytes of each response (if set) and answers with the whole file if
+    `ignore_ranges` is set. The first `failures` requests are answered with `failure_status`
+    instead. Every requested range start is logged.
+    """
+    drop_after = None
+    ignore_ranges = False
+    failures = 0
+    failure_status = 503
+    range_starts = []
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Sends the requested range of CONTENT, maybe cutting it short"""
+        if FlakyHandler.failures:
+            FlakyHandler.failures -= 1
+            self.range_starts.append(None)
+            self.send_error(self.failure_status)
+            return
+        start, end = 0, len(CONTENT) - 1
+        if "Range" in self.headers and not self.ignore_ranges:
+            first, last = self.headers["Range"].split("=")[1].split("-")
+            start, end = int(first), min(int(last), end)
+        self.range_starts.append(start)
+        body = CONTENT[start:end + 1]
+        self.send_response(206 if start or end < len(CONTENT) - 1 else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.drop_after is not None:
+            body = body[:self.drop_after]
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        """Silences the server logs"""
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """Base for the tests downloading from a local FlakyHandler server"""
+
+    def setUp(self) -> None:
+        FlakyHandler.drop_after = None
+        FlakyHandler.ignore_ranges = False
+        FlakyHandler.failures = 0
+        FlakyHandler.failure_status = 503
+        FlakyHandler.range_starts = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/stream"
+        self.directory = tempfile.TemporaryDirectory()
+        self.destination = pathlib.Path(self.directory.name, "song.mp4")
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+
+class TestDownloadResumable(LocalServerTestCase):
+    """download_resumable tests against a local server"""
+
+    def test_dropped_connections(self) -> None:
+        """A download whose connections keep dropping should resume until it's complete"""
+        FlakyHandler.drop_after = 300 * 1024
+        download_resumable(self.url, self.destination, len(CONTENT))
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+        self.assertFalse(get_part_path(self.destination).exists())
+        self.assertEqual([0, 300 * 1024, 600 * 1024, 900 * 1024], FlakyHandler.range_starts)
+
+    def test_resume_from_part_file(self) -> None:
+        """A partial file left by a previous run should be resumed from its length"""
+        offset = 12345
+        get_part_path(self.destination).write_bytes(CONTENT[:offset])
+        remaining = []
+        download_resumable(self.url, self.destination, len(CONTENT),
+                           lambda chunk, remaining_bytes: remaining.append(remaining_bytes))
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+        self.assertEqual([offset], FlakyHandler.range_starts)
+        self.assertEqual(len(CONTENT) - offset, remaining[0])
+        self.assertEqual(0, remaining[-1])
+
+    def test_stalled_download(self) -> None:
+        """A server that never sends anything should make the download fail"""
+        FlakyHandler.drop_after = 0
+        with self.assertRaises(ConnectionError):
+            download_resumable(self.url, self.destination, len(CONTENT), retries=2)
+        self.assertEqual(3, len(FlakyHandler.range_starts))
+
+    def test_error_statuses(self) -> None:
+        """Transient statuses should be retried with backoff, and the rest raised at once"""
+        FlakyHandler.failures = 2
+        retry = RetryPolicy(base_delay=0)
+        self.assertEqual(2, download_resumable(self.url, self.destination, len(CONTENT),
+                                               retry=retry))
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+        FlakyHandler.failures = 1
+        FlakyHandler.failure_status = 404
+        with self.assertRaises(HTTPError):
+            download_resumable(self.url, pathlib.Path(self.directory.name, "other.mp4"),
+                               len(CONTENT))
+
+
+class TestDownloadSegmented(LocalServerTestCase):
+    """download_segmented tests against a local server"""
+
+    def test_segments(self) -> None:
+        """Every segment should be requested, resumed if dropped, and the progress be exact"""
+        FlakyHandler.drop_after = 100 * 1024
+        remaining = []
+        download_segmented(self.url, self.destination, len(CONTENT), 4,
+                           lambda chunk, remaining_bytes: remaining.append(remaining_bytes))
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+        for start, _ in split_ranges(len(CONTENT), 4):
+            self.assertIn(start, FlakyHandler.range_starts)
+        self.assertEqual(sorted(remaining, reverse=True), remaining)
+        self.assertEqual(0, remaining[-1])
+
+    def test_ranges_not_supported(self) -> None:
+        """A server ignoring ranges should make the download fall back to one connection"""
+        FlakyHandler.ignore_ranges = True
+        download_segmented(self.url, self.destination, len(CONTENT), 4)
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+
+    def test_rate_limit(self) -> None:
+        """The segments together shouldn't exceed the limiter's rate"""
+        limiter = RateLimiter(4 * 1024 * 1024, burst=128 * 1024)
+        start = time.monotonic()
+        download_segmented(self.url, self.destination, len(CONTENT), 4, limiter=limiter)
+        self.assertEqual(CONTENT, self.destination.read_bytes())
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_split_ranges(self) -> None:
+        """Ranges should be contiguous and cover the whole file"""
+        ranges = split_ranges(10, 3)
+        self.assertEqual([(0, 3), (4, 7), (8, 9)], ranges)
+
+
+if __name__ == "__main__":
+    unittest.main()
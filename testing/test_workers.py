@@ -0,0 +1,73 @@
+"""Tests for the workers module"""
+import sys
+import time
+import pathlib
+import threading
+import unittest
+
+sys.path.append(str(pathlib.Path(".").absolute()))
+from src.workers import WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    """WorkerPool class tests"""
+
+    def test_invalid_worker_count(self) -> None:
+        """Should raise an error when the number of workers isn't a positive integer"""
+        with self.assertRaises(ValueError):
+            WorkerPool(0)
+        with self.assertRaises(TypeError):
+            WorkerPool(2.5)
+
+    def test_concurrency_is_bounded(self) -> None:
+        """No more than `workers` tasks should be running at the same time"""
+        workers = 3
+        pool = WorkerPool(workers)
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def task():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        jobs = [pool.submit(task) for _ in range(20)]
+        pool.wait_until_finished()
+        self.assertTrue(all(job.is_finished() for job in jobs))
+        self.assertEqual(workers, peak[0])
+        self.assertEqual(0, pool.queue_depth())
+        self.assertEqual(0, pool.busy_workers())
+
+    def test_error_is_saved_in_job(self) -> None:
+        """An exception raised by a task should be kept by its Job, not kill the worker"""
+        pool = WorkerPool(1)
+
+        def failing_task():
+            raise ValueError("Failed")
+
+        failed = pool.submit(failing_task)
+        succeeded = pool.submit(lambda: None)
+        pool.wait_until_finished()
+        self.assertIsInstance(failed.error, ValueError)
+        self.assertIsNone(succeeded.error)
+
+    def test_priority_order(self) -> None:
+        """Queued tasks should run lowest priority first, then in submission order"""
+        pool = WorkerPool(1)
+        gate = threading.Event()
+        order = []
+        pool.submit(gate.wait)
+        for name, priority in [("small", -1), ("big", -10), ("unknown", 0), ("huge", -10)]:
+            pool.submit(lambda name=name: order.append(name), priority)
+        gate.set()
+        pool.wait_until_finished()
+        self.assertEqual(["big", "huge", "small", "unknown"], order)
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()